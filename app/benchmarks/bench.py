@@ -0,0 +1,442 @@
+"""
+Benchmark Runner
+Boots the three services against a local Postgres, drives scenarios at a fixed concurrency and writes a JSON baseline
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import socket
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+import scenarios
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Per-service gunicorn options and environment from the services' Dockerfiles
+GUNICORN_ARGS = {'data-ingest': ('--threads', '32')}
+SERVICE_ENV = {'data-ingest': {'DATABASE_POOL_MAX_SIZE': '4'}}
+
+BOOT_TIMEOUT = 30
+REQUEST_TIMEOUT = 300
+
+PERCENTILES = (50, 95, 99)
+
+_CONNECT_SAMPLE = re.compile(r'^db_query_duration_seconds_count\{statement="connect"\} (\S+)$', re.MULTILINE)
+
+
+class Client:
+    """Keep-alive HTTP connections of one load-generating thread, one per service"""
+
+    def __init__(self, urls):
+        self.urls = urls
+        self._connections = {}
+
+    def _connection(self, service):
+        conn = self._connections.get(service)
+        if conn is None:
+            url = urlsplit(self.urls[service])
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=REQUEST_TIMEOUT)
+            self._connections[service] = conn
+        return conn
+
+    def send(self, req):
+        """Send a scenarios.Request; returns (status, body)"""
+        conn = self._connection(req.service)
+        headers = {'Content-Type': req.content_type} if req.body is not None else {}
+        try:
+            conn.request(req.method, req.path, body=req.body, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        except Exception:
+            # A server that closed the connection gets a fresh one next time
+            conn.close()
+            raise
+
+    def get_text(self, service, path):
+        status, body = self.send(scenarios.Request(service, 'GET', path))
+        if status != 200:
+            raise RuntimeError(f"GET {path} on {service} returned {status}")
+        return body.decode('utf-8')
+
+    def close(self):
+        for conn in self._connections.values():
+            conn.close()
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an ascending list"""
+    if not ordered:
+        return None
+    rank = max(math.ceil(p / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class Services:
+    """The three services as gunicorn processes, or already running ones when urls are given"""
+
+    def __init__(self, args, log_dir):
+        self.args = args
+        self.log_dir = log_dir
+        self.processes = {}
+        self.metrics_dir = None
+        self.urls = {
+            'frontend-api': args.frontend_url or f"http://127.0.0.1:{args.base_port}",
+            'business-logic': args.business_logic_url or f"http://127.0.0.1:{args.base_port + 1}",
+            'data-ingest': args.data_ingest_url or f"http://127.0.0.1:{args.base_port + 2}",
+        }
+        self.booted = not (args.frontend_url or args.business_logic_url or args.data_ingest_url)
+
+    def start(self):
+        if not self.booted:
+            return
+        self.metrics_dir = tempfile.mkdtemp(prefix='bench-metrics-')
+        env = {
+            **os.environ,
+            'BUSINESS_LOGIC_URL': self.urls['business-logic'],
+            'DATA_INGEST_URL': self.urls['data-ingest'],
+            # Fresh per run, so /metrics counters start at zero
+            'METRICS_DIR': self.metrics_dir,
+            'TRACING_SAMPLE_RATE': os.getenv('TRACING_SAMPLE_RATE', '0'),
+            'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+        }
+        for service, url in self.urls.items():
+            port = urlsplit(url).port
+            _check_port_free(port)
+            if service == 'frontend-api':
+                argv = [sys.executable, 'serve.py']
+                service_env = {**env, 'PORT': str(port), 'SERVER_WORKERS': str(self.args.workers),
+                               'SERVER_MODE': self.args.frontend_mode}
+            else:
+                argv = ['gunicorn', '--bind', f"127.0.0.1:{port}", '--workers', str(self.args.workers),
+                        *GUNICORN_ARGS.get(service, ()), '--timeout', '120', 'app:app']
+                service_env = {**SERVICE_ENV.get(service, {}), **env}
+            with open(os.path.join(self.log_dir, f"{service}.log"), 'wb') as log:
+                self.processes[service] = subprocess.Popen(
+                    argv, cwd=os.path.join(APP_DIR, service), env=service_env, stdout=log, stderr=subprocess.STDOUT
+                )
+        client = Client(self.urls)
+        try:
+            for service in self.urls:
+                self._wait_healthy(client, service)
+        finally:
+            client.close()
+
+    def _wait_healthy(self, client, service):
+        deadline = time.monotonic() + BOOT_TIMEOUT
+        while time.monotonic() < deadline:
+            process = self.processes[service]
+            if process.poll() is not None:
+                raise RuntimeError(f"{service} exited with {process.returncode}; see {self.log_dir}/{service}.log")
+            try:
+                if client.send(scenarios.Request(service, 'GET', '/health/live'))[0] == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"{service} not healthy after {BOOT_TIMEOUT}s; see {self.log_dir}/{service}.log")
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.metrics_dir is not None:
+            shutil.rmtree(self.metrics_dir, ignore_errors=True)
+
+    def worker_memory(self):
+        """RSS of each gunicorn worker in MiB, by service; empty for services not started here"""
+        memory = {}
+        for service, process in self.processes.items():
+            workers = [_rss_mib(pid) for pid in _children(process.pid)]
+            workers = [rss for rss in workers if rss is not None]
+            if workers:
+                memory[service] = {
+                    'workers': len(workers),
+                    'rss_mib_max': round(max(workers), 1),
+                    'rss_mib_mean': round(sum(workers) / len(workers), 1),
+                    'peak_rss_mib_max': round(max(_rss_mib(pid, 'VmHWM') or 0 for pid in _children(process.pid)), 1),
+                }
+        return memory
+
+    def connections_opened(self, client):
+        """Database connections opened so far by every worker, by service, from /metrics"""
+        opened = {}
+        for service in self.urls:
+            try:
+                match = _CONNECT_SAMPLE.search(client.get_text(service, '/metrics'))
+            except (OSError, RuntimeError):
+                match = None
+            opened[service] = float(match.group(1)) if match else 0.0
+        return opened
+
+
+def _check_port_free(port):
+    with socket.socket() as s:
+        if s.connect_ex(('127.0.0.1', port)) == 0:
+            raise RuntimeError(f"port {port} is in use; pick another --base-port")
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after its ')'
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def _rss_mib(pid, field='VmRSS'):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def run_scenario(scenario, services, concurrency, duration, warmup):
+    """Drive one scenario; returns its result record"""
+    concurrency = min(concurrency, scenario.max_concurrency or concurrency)
+    setup_client = Client(services.urls)
+    try:
+        scenario.setup(setup_client)
+        connections_before = services.connections_opened(setup_client)
+    finally:
+        setup_client.close()
+
+    lock = threading.Lock()
+    counter = iter(range(sys.maxsize))
+    latencies = []
+    statuses = {}
+    errors = []
+    rows = [0]
+    started = time.monotonic()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+    barrier = threading.Barrier(concurrency) if scenario.burst else None
+
+    def worker():
+        client = Client(services.urls)
+        try:
+            while time.monotonic() < stop_at:
+                if barrier is not None:
+                    try:
+                        barrier.wait(REQUEST_TIMEOUT)
+                    except threading.BrokenBarrierError:
+                        return
+                with lock:
+                    n = next(counter)
+                req = scenario.next_request(n)
+                sent = time.monotonic()
+                try:
+                    status, _ = client.send(req)
+                except Exception as e:
+                    status = type(e).__name__
+                elapsed = time.monotonic() - sent
+                if sent < measure_from:
+                    continue
+                with lock:
+                    statuses[str(status)] = statuses.get(str(status), 0) + 1
+                    if isinstance(status, int) and status < 400:
+                        latencies.append(elapsed)
+                        rows[0] += req.rows
+                    else:
+                        errors.append(status)
+        finally:
+            if barrier is not None:
+                # Clients still waiting for this one's wave move on
+                barrier.abort()
+            client.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = max(time.monotonic() - measure_from, 1e-9)
+
+    client = Client(services.urls)
+    try:
+        connections_after = services.connections_opened(client)
+    finally:
+        client.close()
+
+    latencies.sort()
+    completed = len(latencies)
+    return {
+        'description': scenario.description,
+        'concurrency': concurrency,
+        'duration_seconds': round(elapsed, 3),
+        'requests': completed + len(errors),
+        'errors': len(errors),
+        'statuses': statuses,
+        'throughput_rps': round(completed / elapsed, 2),
+        'rows_per_second': round(rows[0] / elapsed, 1),
+        'latency_ms': {
+            **{f"p{p}": _ms(percentile(latencies, p)) for p in PERCENTILES},
+            'mean': _ms(sum(latencies) / completed if completed else None),
+            'max': _ms(latencies[-1] if latencies else None),
+        },
+        'db_connections_opened': {
+            service: int(connections_after[service] - connections_before.get(service, 0.0))
+            for service in connections_after
+        },
+        'worker_memory': services.worker_memory(),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def init_db():
+    """Apply init-db.sql with psql, using the DATABASE_* settings the services read"""
+    env = {
+        **os.environ,
+        'PGHOST': os.getenv('DATABASE_HOST', 'localhost'),
+        'PGPORT': os.getenv('DATABASE_PORT', '5432'),
+        'PGDATABASE': os.getenv('DATABASE_NAME', 'appdb'),
+        'PGUSER': os.getenv('DATABASE_USER', 'appuser'),
+        'PGPASSWORD': os.getenv('DATABASE_PASSWORD', 'password'),
+    }
+    subprocess.run(
+        ['psql', '-q', '-v', 'ON_ERROR_STOP=1', '-f', os.path.join(APP_DIR, 'init-db.sql')],
+        env=env, check=True, stdout=subprocess.DEVNULL
+    )
+
+
+def print_summary(results, out=sys.stdout):
+    header = f"{'scenario':<22} {'conc':>4} {'req/s':>9} {'rows/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'db conn':>7}"
+    print(header, file=out)
+    print('-' * len(header), file=out)
+    for name, r in results.items():
+        latency = r['latency_ms']
+        print(
+            f"{name:<22} {r['concurrency']:>4} {r['throughput_rps']:>9.1f} {r['rows_per_second']:>10.0f} "
+            f"{_fmt(latency['p50']):>9} {_fmt(latency['p95']):>9} {_fmt(latency['p99']):>9} "
+            f"{r['errors']:>7} {sum(r['db_connections_opened'].values()):>7}",
+            file=out
+        )
+
+
+def _fmt(value):
+    return '-' if value is None else f"{value:.2f}"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[-1])
+    parser.add_argument('scenarios', nargs='*',
+                        help="scenario names or prefixes ending in * (default: all but the smaller NDJSON batches)")
+    parser.add_argument('--list', action='store_true', help='list scenarios and exit')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients (default 8)')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per scenario (default 10)')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds before each scenario (default 2)')
+    parser.add_argument('--batch-sizes', default=','.join(map(str, scenarios.BATCH_SIZES)),
+                        help='comma-separated ingest batch sizes')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers per service (default 4)')
+    parser.add_argument('--frontend-mode', choices=('wsgi', 'asgi'), default='wsgi', help='frontend-api SERVER_MODE')
+    parser.add_argument('--base-port', type=int, default=18080,
+                        help='frontend-api port; business-logic and data-ingest use the next two')
+    parser.add_argument('--frontend-url', help='benchmark a running frontend-api instead of starting one')
+    parser.add_argument('--business-logic-url', help='benchmark a running business-logic instead of starting one')
+    parser.add_argument('--data-ingest-url', help='benchmark a running data-ingest instead of starting one')
+    parser.add_argument('--init-db', action='store_true', help='apply init-db.sql with psql before starting')
+    parser.add_argument('--output', help='result file (default results/<UTC timestamp>.json)')
+    parser.add_argument('--label', default='', help='free-form label stored with the results')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    run_id = f"{int(time.time()) & 0xffffff:06x}"
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',') if size.strip()]
+    available = scenarios.catalogue(run_id, batch_sizes)
+    if args.list:
+        for name, scenario in available.items():
+            print(f"{name:<22} {scenario.description}")
+        return 0
+    try:
+        selected = scenarios.names_matching(list(available), args.scenarios) if args.scenarios \
+            else scenarios.default_names(list(available))
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+
+    started_at = datetime.now(timezone.utc)
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'results', f"{started_at:%Y%m%dT%H%M%SZ}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    log_dir = tempfile.mkdtemp(prefix='bench-logs-')
+
+    if args.init_db:
+        init_db()
+    services = Services(args, log_dir)
+    results = {}
+    try:
+        services.start()
+        for name in selected:
+            print(f"running {name} ...", file=sys.stderr, flush=True)
+            results[name] = run_scenario(available[name], services, args.concurrency, args.duration, args.warmup)
+    finally:
+        services.stop()
+
+    report = {
+        'meta': {
+            'label': args.label,
+            'started_at': started_at.isoformat(),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'booted_services': services.booted,
+            'workers_per_service': args.workers if services.booted else None,
+            'frontend_mode': args.frontend_mode if services.booted else None,
+            'concurrency': args.concurrency,
+            'duration_seconds': args.duration,
+            'warmup_seconds': args.warmup,
+        },
+        'scenarios': results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print_summary(results)
+    print(f"\nresults written to {output}", file=sys.stderr)
+    shutil.rmtree(log_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Benchmark Comparison
+Compares a benchmark result file against a baseline and flags latency or throughput regressions
+"""
+import sys
+import json
+import argparse
+
+# (label, getter, True when higher is better)
+FIELDS = (
+    ('req/s', lambda r: r['throughput_rps'], True),
+    ('rows/s', lambda r: r['rows_per_second'], True),
+    ('p50 ms', lambda r: r['latency_ms']['p50'], False),
+    ('p95 ms', lambda r: r['latency_ms']['p95'], False),
+    ('p99 ms', lambda r: r['latency_ms']['p99'], False),
+    ('db conn', lambda r: sum(r['db_connections_opened'].values()), False),
+)
+
+# Fields that fail the comparison when they regress beyond the threshold
+GATED = ('req/s', 'p99 ms')
+
+
+def change(before, after):
+    """Relative change in percent, or None when it cannot be computed"""
+    if before is None or after is None or before == 0:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(baseline, candidate, threshold):
+    """Rows of (scenario, label, before, after, change %, regressed) for scenarios present in both"""
+    rows = []
+    for name, before in baseline['scenarios'].items():
+        after = candidate['scenarios'].get(name)
+        if after is None:
+            continue
+        for label, get, higher_is_better in FIELDS:
+            old, new = get(before), get(after)
+            delta = change(old, new)
+            worse = delta is not None and (-delta if higher_is_better else delta) > threshold
+            rows.append((name, label, old, new, delta, worse and label in GATED))
+    return rows
+
+
+def _fmt(value):
+    return '-' if value is None else f"{value:.2f}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[-1])
+    parser.add_argument('baseline', help='result file to compare against')
+    parser.add_argument('candidate', help='result file of the run under test')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='percent drop in req/s or rise in p99 that counts as a regression (default 10)')
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    rows = compare(baseline, candidate, args.threshold)
+    print(f"{'scenario':<22} {'metric':<8} {'baseline':>11} {'candidate':>11} {'change':>9}")
+    for name, label, old, new, delta, regressed in rows:
+        marker = '  REGRESSION' if regressed else ''
+        delta_text = '-' if delta is None else f"{delta:+.1f}%"
+        print(f"{name:<22} {label:<8} {_fmt(old):>11} {_fmt(new):>11} {delta_text:>9}{marker}")
+
+    regressions = sorted({name for name, *_, regressed in rows if regressed})
+    if regressions:
+        print(f"\n{len(regressions)} scenario(s) regressed by more than {args.threshold}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
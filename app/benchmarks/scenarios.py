@@ -0,0 +1,216 @@
+"""
+Benchmark Scenarios
+Request mixes driven against the three services, one scenario at a time
+"""
+import json
+import random
+import itertools
+
+# Batch sizes of the default ingest_batch_<n> and ingest_copy_<n> scenarios
+BATCH_SIZES = (10, 100, 1000, 10000, 100000)
+
+# Batches this large are sent by at most this many clients at once, so one
+# scenario measures batch throughput rather than exhausting the DB pools
+LARGE_BATCH_ROWS = 10000
+LARGE_BATCH_CONCURRENCY = 2
+
+
+class Request:
+    """One request to send: service name, method, path, body bytes, content type and rows carried"""
+    __slots__ = ('service', 'method', 'path', 'body', 'content_type', 'rows')
+
+    def __init__(self, service, method, path, body=None, content_type='application/json', rows=0):
+        self.service = service
+        self.method = method
+        self.path = path
+        self.body = body
+        self.content_type = content_type
+        self.rows = rows
+
+
+def _json(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _record(i):
+    return {'type': 'bench', 'data': {'i': i, 'value': random.random()}, 'source': 'bench'}
+
+
+class Scenario:
+    """A named request generator; next_request(n) returns the n-th Request of a run
+
+    burst scenarios release their clients together in waves instead of
+    letting each one loop independently.
+    """
+    description = ''
+    burst = False
+    max_concurrency = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def setup(self, client):
+        """Prepare data the requests depend on, through the client's services"""
+
+    def next_request(self, n):
+        raise NotImplementedError
+
+
+class IngestSingle(Scenario):
+    description = 'one record per POST /api/v1/ingest on data-ingest'
+
+    def __init__(self, name='ingest_single'):
+        super().__init__(name)
+        self._body = _json(_record(0))
+
+    def next_request(self, n):
+        return Request('data-ingest', 'POST', '/api/v1/ingest', self._body, rows=1)
+
+
+class IngestProxy(Scenario):
+    description = 'one record per POST /api/v1/data/ingest through frontend-api'
+
+    def __init__(self, name='ingest_proxy'):
+        super().__init__(name)
+        self._body = _json(_record(0))
+
+    def next_request(self, n):
+        return Request('frontend-api', 'POST', '/api/v1/data/ingest', self._body, rows=1)
+
+
+class IngestBatch(Scenario):
+    """POST /api/v1/ingest/batch with a fixed batch, as JSON or as NDJSON (COPY)"""
+
+    def __init__(self, size, copy=False):
+        super().__init__(f"ingest_{'copy' if copy else 'batch'}_{size}")
+        self.size = size
+        self.description = f"{size} records per POST /api/v1/ingest/batch as {'NDJSON (COPY)' if copy else 'JSON'}"
+        self.copy = copy
+        if size >= LARGE_BATCH_ROWS:
+            self.max_concurrency = LARGE_BATCH_CONCURRENCY
+        self._body = None
+        self._content_type = 'application/x-ndjson' if copy else 'application/json'
+
+    def setup(self, client):
+        # Built once so the client's encoding time stays out of the measurement
+        records = [_record(i) for i in range(self.size)]
+        if self.copy:
+            self._body = b''.join(_json(record) + b'\n' for record in records)
+        else:
+            self._body = _json({'records': records})
+
+    def next_request(self, n):
+        return Request(
+            'data-ingest', 'POST', '/api/v1/ingest/batch', self._body, self._content_type, rows=self.size
+        )
+
+
+class CreateUser(Scenario):
+    description = 'POST /api/v1/users on frontend-api (validation call to business-logic, then insert)'
+
+    def __init__(self, name='create_user', run_id=None):
+        super().__init__(name)
+        self.run_id = run_id or f"{random.getrandbits(24):06x}"
+
+    def next_request(self, n):
+        # Usernames are limited to 20 characters
+        username = f"bu{self.run_id}_{n:x}"
+        return Request(
+            'frontend-api', 'POST', '/api/v1/users',
+            _json({'username': username, 'email': f"{username}@bench.example.com"}), rows=1
+        )
+
+
+class OrderBurst(Scenario):
+    description = 'POST /api/v1/process/order on business-logic, all clients at once in waves'
+    burst = True
+
+    def __init__(self, name='order_burst'):
+        super().__init__(name)
+        self.user_id = None
+
+    def setup(self, client):
+        username = f"bo_{random.getrandbits(32):08x}"
+        status, body = client.send(Request(
+            'frontend-api', 'POST', '/api/v1/users',
+            _json({'username': username, 'email': f"{username}@bench.example.com"})
+        ))
+        if status != 201:
+            raise RuntimeError(f"could not create the order user: {status} {body[:200]!r}")
+        self.user_id = json.loads(body)['user']['id']
+
+    def next_request(self, n):
+        return Request(
+            'business-logic', 'POST', '/api/v1/process/order',
+            _json({'user_id': self.user_id, 'amount': f"{10 + n % 90}.99"}), rows=1
+        )
+
+
+# Dashboard reads, cycled in order
+POLLING_REQUESTS = (
+    ('data-ingest', '/api/v1/ingest/stats'),
+    ('data-ingest', '/api/v1/ingest/recent?limit=20'),
+    ('business-logic', '/api/v1/analytics/summary'),
+    ('frontend-api', '/api/v1/users?limit=20'),
+)
+
+
+class StatsPolling(Scenario):
+    description = 'GET ingest stats, recent records, analytics summary and the user list in turn'
+
+    def __init__(self, name='stats_polling'):
+        super().__init__(name)
+
+    def next_request(self, n):
+        service, path = POLLING_REQUESTS[n % len(POLLING_REQUESTS)]
+        return Request(service, 'GET', path)
+
+
+class Mix(Scenario):
+    """Weighted mix of other scenarios, chosen per request"""
+
+    def __init__(self, name, weighted, description=''):
+        super().__init__(name)
+        self.description = description or ', '.join(f"{weight}x {s.name}" for s, weight in weighted)
+        self._scenarios = [s for s, _ in weighted]
+        self._weights = [weight for _, weight in weighted]
+
+    def setup(self, client):
+        for scenario in self._scenarios:
+            scenario.setup(client)
+
+    def next_request(self, n):
+        return random.choices(self._scenarios, self._weights)[0].next_request(n)
+
+
+def catalogue(run_id, batch_sizes=BATCH_SIZES):
+    """Every scenario by name, in the default run order"""
+    scenarios = [IngestSingle(), IngestProxy()]
+    scenarios += [IngestBatch(size) for size in batch_sizes]
+    scenarios += [IngestBatch(size, copy=True) for size in batch_sizes]
+    scenarios += [CreateUser(run_id=run_id), OrderBurst(), StatsPolling()]
+    scenarios.append(Mix('mixed', [
+        (IngestSingle(), 50), (StatsPolling(), 30), (CreateUser('create_user', run_id=f"{run_id}m"), 10),
+        (OrderBurst(), 10),
+    ], 'traffic mix: 50% single ingest, 30% stats polling, 10% user creation, 10% orders'))
+    return {scenario.name: scenario for scenario in scenarios}
+
+
+def default_names(names):
+    """Default selection: everything except the NDJSON batches below the largest size"""
+    largest = max((int(name.rsplit('_', 1)[1]) for name in names if name.startswith('ingest_copy_')), default=None)
+    return [name for name in names if not name.startswith('ingest_copy_') or name == f"ingest_copy_{largest}"]
+
+
+def names_matching(names, patterns):
+    """Scenario names matching comma-separated exact names or trailing-* prefixes, in catalogue order"""
+    selected = []
+    for pattern in itertools.chain.from_iterable(p.split(',') for p in patterns):
+        pattern = pattern.strip()
+        if not pattern:
+            continue
+        matches = [n for n in names if n == pattern or (pattern.endswith('*') and n.startswith(pattern[:-1]))]
+        if not matches:
+            raise ValueError(f"unknown scenario {pattern!r}")
+        selected += [n for n in matches if n not in selected]
+    return [n for n in names if n in selected]
@@ -0,0 +1,261 @@
+"""
+Analytics Summary Rollups
+Per-day/per-status order totals maintained with each insert, and daily user counts rolled up by watermark
+"""
+import os
+import time
+import random
+import logging
+import threading
+from decimal import Decimal
+from datetime import timedelta
+from collections import OrderedDict
+from psycopg2.extras import RealDictCursor, execute_values
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+ANALYTICS_SLOTS = int(os.getenv('ANALYTICS_SLOTS', '8'))
+ANALYTICS_MAX_STALENESS = float(os.getenv('ANALYTICS_MAX_STALENESS', '5'))
+ANALYTICS_USER_ROLLUP_INTERVAL = float(os.getenv('ANALYTICS_USER_ROLLUP_INTERVAL', '300'))
+
+GROUP_BYS = ('status', 'day')
+
+# Days before today that are still counted live from users rather than
+# rolled up, so transactions that commit late are never missed
+USER_ROLLUP_LAG_DAYS = 1
+
+USER_ROLLUP_LOCK_KEY = 'analytics_user_rollup'
+
+# Distinct (window, group_by) results cached per worker
+CACHE_ENTRIES = 64
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_last_user_rollup = 0.0
+
+
+def record_orders(cur, orders):
+    """Add (status, amount) pairs to today's order rollups inside the caller's transaction
+
+    Like the ingest stats, each key is spread over ANALYTICS_SLOTS rows and
+    written in sorted order so concurrent writers neither queue on one row
+    lock nor deadlock.
+    """
+    totals = {}
+    for status, amount in orders:
+        count, amount_sum = totals.get(status, (0, Decimal(0)))
+        totals[status] = (count + 1, amount_sum + Decimal(amount))
+    if not totals:
+        return
+    slot = random.randrange(ANALYTICS_SLOTS)
+    execute_values(
+        cur,
+        """
+        INSERT INTO order_stats_daily (day, status, slot, order_count, total_amount)
+        VALUES %s
+        ON CONFLICT (day, status, slot) DO UPDATE SET
+            order_count = order_stats_daily.order_count + EXCLUDED.order_count,
+            total_amount = order_stats_daily.total_amount + EXCLUDED.total_amount
+        """,
+        [(status, slot, count, amount_sum) for status, (count, amount_sum) in sorted(totals.items())],
+        template="(CURRENT_DATE, %s, %s, %s, %s)"
+    )
+
+
+def roll_up_users(conn):
+    """Fold users from days that can no longer change into user_stats_daily
+
+    One worker at a time; returns the number of days added, or None if
+    another worker holds the lock.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", (USER_ROLLUP_LOCK_KEY,))
+    if not cur.fetchone()[0]:
+        conn.rollback()
+        cur.close()
+        return None
+    cur.execute("SELECT rolled_up_until FROM analytics_watermarks WHERE name = 'users' FOR UPDATE")
+    row = cur.fetchone()
+    since = row[0] if row else None
+    cur.execute("SELECT CURRENT_DATE - %s", (USER_ROLLUP_LAG_DAYS,))
+    until = cur.fetchone()[0]
+    if since is not None and since >= until:
+        conn.rollback()
+        cur.close()
+        return 0
+
+    cur.execute(
+        """
+        INSERT INTO user_stats_daily (day, user_count)
+        SELECT created_at::date, COUNT(*)
+        FROM users
+        WHERE created_at < %s AND (%s::date IS NULL OR created_at >= %s)
+        GROUP BY created_at::date
+        ON CONFLICT (day) DO UPDATE SET user_count = user_stats_daily.user_count + EXCLUDED.user_count
+        """,
+        (until, since, since)
+    )
+    days = cur.rowcount
+    cur.execute(
+        """
+        INSERT INTO analytics_watermarks (name, rolled_up_until) VALUES ('users', %s)
+        ON CONFLICT (name) DO UPDATE SET rolled_up_until = EXCLUDED.rolled_up_until, updated_at = CURRENT_TIMESTAMP
+        """,
+        (until,)
+    )
+    conn.commit()
+    cur.close()
+    if days:
+        logger.info(f"Rolled up users for {days} days before {until}")
+    return days
+
+
+def maybe_roll_up_users(connection):
+    """Run roll_up_users on a primary connection if ANALYTICS_USER_ROLLUP_INTERVAL has passed"""
+    global _last_user_rollup
+    now = time.monotonic()
+    if now - _last_user_rollup < ANALYTICS_USER_ROLLUP_INTERVAL:
+        return
+    _last_user_rollup = now
+    try:
+        with connection() as conn:
+            roll_up_users(conn)
+    except Exception as e:
+        logger.error(f"User rollup failed: {e}")
+
+
+def _window_conditions(column, start, end, params):
+    conditions = []
+    if start is not None:
+        conditions.append(f"{column} >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append(f"{column} <= %s")
+        params.append(end)
+    return conditions
+
+
+def _where(conditions):
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+
+def order_totals(count, amount):
+    count = int(count)
+    amount = float(amount)
+    return {
+        'count': count,
+        'total_amount': amount,
+        'average_amount': amount / count if count else 0.0,
+    }
+
+
+def read_summary(conn, start=None, end=None, group_by=None):
+    """Summary for the days start..end (inclusive, either may be None) from the rollups"""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+
+    # Users: rolled-up days plus a live count of the days after the watermark
+    cur.execute("SELECT rolled_up_until FROM analytics_watermarks WHERE name = 'users'")
+    row = cur.fetchone()
+    rolled_up_until = row['rolled_up_until'] if row else None
+
+    params = []
+    conditions = _window_conditions('day', start, end, params)
+    if rolled_up_until is not None:
+        conditions.append("day < %s")
+        params.append(rolled_up_until)
+        cur.execute(f"SELECT day, user_count FROM user_stats_daily {_where(conditions)}", params)
+        users_by_day = {r['day']: int(r['user_count']) for r in cur.fetchall()}
+    else:
+        users_by_day = {}
+
+    params = []
+    conditions = []
+    live_start = max(filter(None, (start, rolled_up_until)), default=None)
+    if live_start is not None:
+        conditions.append("created_at >= %s")
+        params.append(live_start)
+    if end is not None:
+        conditions.append("created_at < %s")
+        params.append(end + timedelta(days=1))
+    if group_by == 'day':
+        cur.execute(
+            f"SELECT created_at::date AS day, COUNT(*) AS user_count FROM users {_where(conditions)} GROUP BY 1",
+            params
+        )
+        for r in cur.fetchall():
+            if r['day'] is not None:
+                users_by_day[r['day']] = users_by_day.get(r['day'], 0) + int(r['user_count'])
+        live_users = 0
+    else:
+        # A plain count is an index-only scan of idx_users_created_at_id
+        cur.execute(f"SELECT COUNT(*) AS user_count FROM users {_where(conditions)}", params)
+        live_users = cur.fetchone()['user_count']
+
+    # Orders: the rollups hold every day, maintained with each insert
+    params = []
+    conditions = _window_conditions('day', start, end, params)
+    cur.execute(
+        f"""
+        SELECT day, status, SUM(order_count) AS order_count, SUM(total_amount) AS total_amount
+        FROM order_stats_daily
+        {_where(conditions)}
+        GROUP BY day, status
+        """,
+        params
+    )
+    order_rows = cur.fetchall()
+    cur.close()
+
+    total_count = sum(r['order_count'] for r in order_rows)
+    total_amount = sum((r['total_amount'] for r in order_rows), Decimal(0))
+    summary = {
+        'users': sum(users_by_day.values()) + live_users,
+        'orders': order_totals(total_count, total_amount),
+    }
+    if group_by == 'status':
+        by_status = {}
+        for r in order_rows:
+            count, amount = by_status.get(r['status'], (0, Decimal(0)))
+            by_status[r['status']] = (count + r['order_count'], amount + r['total_amount'])
+        summary['groups'] = [
+            {'status': status, **order_totals(count, amount)}
+            for status, (count, amount) in sorted(by_status.items())
+        ]
+    elif group_by == 'day':
+        by_day = {}
+        for r in order_rows:
+            count, amount = by_day.get(r['day'], (0, Decimal(0)))
+            by_day[r['day']] = (count + r['order_count'], amount + r['total_amount'])
+        days = sorted(set(by_day) | set(users_by_day))
+        summary['groups'] = [
+            {
+                'day': day.isoformat(),
+                'new_users': users_by_day.get(day, 0),
+                **order_totals(*by_day.get(day, (0, Decimal(0)))),
+            }
+            for day in days
+        ]
+    return summary
+
+
+def get_summary(connection, start=None, end=None, group_by=None, max_staleness=ANALYTICS_MAX_STALENESS):
+    """Rollup summary, served from this worker's cache when fresh enough
+
+    Returns (summary, age_seconds).
+    """
+    key = (start, end, group_by)
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and now - cached[1] <= max_staleness:
+        return cached[0], now - cached[1]
+
+    with connection() as conn:
+        value = read_summary(conn, start, end, group_by)
+    with _cache_lock:
+        _cache[key] = (value, time.monotonic())
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return value, 0.0
@@ -4,39 +4,54 @@ Processes core business operations and validations
 """
 import os
 import logging
+from functools import partial
 import re
-from flask import Flask, jsonify, request
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from flask import Flask, Response, jsonify, request
+from psycopg2.extras import RealDictCursor, execute_values
+from datetime import datetime, date, timedelta
+import db
+import fast_json
+import metrics
+import tracing
+import known_users
+import analytics
+import response_cache
+import health
 
 app = Flask(__name__)
+app.json = fast_json.FastJSONProvider(app)
 logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
+metrics.instrument(app, 'business-logic')
+tracing.instrument(app, 'business-logic')
 
 # Configuration from environment variables
-DB_HOST = os.getenv('DATABASE_HOST', 'localhost')
-DB_PORT = os.getenv('DATABASE_PORT', '5432')
-DB_NAME = os.getenv('DATABASE_NAME', 'appdb')
-DB_USER = os.getenv('DATABASE_USER', 'appuser')
-DB_PASSWORD = os.getenv('DATABASE_PASSWORD', 'password')
 REGION = os.getenv('REGION', 'unknown')
 
-def get_db_connection():
-    """Create database connection"""
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            connect_timeout=5
-        )
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection failed: {e}")
-        raise
+# Largest batch accepted by /api/v1/validate/users
+VALIDATE_BATCH_MAX = int(os.getenv('VALIDATE_BATCH_MAX', '10000'))
+
+# Largest batch accepted by /api/v1/process/orders and rows per INSERT
+ORDERS_BATCH_MAX = int(os.getenv('ORDERS_BATCH_MAX', '10000'))
+ORDERS_INSERT_PAGE_SIZE = int(os.getenv('ORDERS_INSERT_PAGE_SIZE', '1000'))
+
+# orders.amount is DECIMAL(10, 2)
+MAX_ORDER_AMOUNT = Decimal('100000000')
+CENTS = Decimal('0.01')
+
+# Summary modes: approximate (cached rollups), exact (fresh rollups),
+# scan (full-table scans of users and orders, for verification)
+SUMMARY_MODES = ('approximate', 'exact', 'scan')
+
+# Longest window accepted by ?days= on /api/v1/analytics/summary
+SUMMARY_MAX_DAYS = 3660
+
+# Response cache tag of endpoints that read orders
+ORDERS_CACHE_TAG = 'orders'
+
+# Load the validation bloom filter in the background, before the first validation
+known_users.warm()
 
 def validate_email(email):
     """Validate email format"""
@@ -59,17 +74,17 @@ def liveness():
         'timestamp': datetime.utcnow().isoformat()
     }), 200
 
+def check_database():
+    """Postgres reachable through this worker's pool, which may be busy but must be moving"""
+    return db.check_primary(health.HEALTH_CHECK_TIMEOUT / 2, health.HEALTH_MAX_AGE)
+
+health.monitor.register('postgres', check_database)
+
 @app.route('/health/ready', methods=['GET'])
 def readiness():
-    """Readiness probe - checks if service can handle requests"""
-    try:
-        # Check database connectivity
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT 1")
-        cur.close()
-        conn.close()
-        
+    """Readiness probe - served from the background health monitor's cached results"""
+    ready, reason, dependencies = health.monitor.readiness()
+    if ready:
         return jsonify({
             'status': 'ready',
             'service': 'business-logic',
@@ -77,12 +92,21 @@ def readiness():
             'database': 'connected',
             'timestamp': datetime.utcnow().isoformat()
         }), 200
-    except Exception as e:
-        logger.error(f"Readiness check failed: {e}")
-        return jsonify({
-            'status': 'not_ready',
-            'reason': str(e)
-        }), 503
+    return jsonify({
+        'status': 'not_ready',
+        'reason': reason,
+        'dependencies': dependencies
+    }), 503
+
+@app.route('/health/dependencies', methods=['GET'])
+def get_dependencies():
+    """Per-dependency health results and latency history for this worker"""
+    return jsonify({
+        'service': 'business-logic',
+        'region': REGION,
+        'pid': os.getpid(),
+        'dependencies': health.monitor.details()
+    }), 200
 
 @app.route('/api/v1/validate/user', methods=['POST'])
 def validate_user():
@@ -108,13 +132,10 @@ def validate_user():
         
         # Check if username already exists
         if username and not errors:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT id FROM users WHERE username = %s", (username,))
-            if cur.fetchone():
+            with db.connection() as conn:
+                taken_usernames, _ = known_users.find_taken(conn, usernames=[username])
+            if taken_usernames:
                 errors.append('username already exists')
-            cur.close()
-            conn.close()
         
         if errors:
             return jsonify({
@@ -132,6 +153,89 @@ def validate_user():
         logger.error(f"Validation error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/v1/validate/users', methods=['POST'])
+def validate_users():
+    """Validate many candidate users with one existence lookup"""
+    try:
+        data = request.get_json()
+        candidates = data.get('users') if isinstance(data, dict) else data
+        
+        if not isinstance(candidates, list) or not candidates:
+            return jsonify({'error': 'users must be a non-empty list'}), 400
+        if len(candidates) > VALIDATE_BATCH_MAX:
+            return jsonify({'error': f"at most {VALIDATE_BATCH_MAX} users per request"}), 400
+        
+        # Formats and duplicates within the batch, in one pass
+        results = []
+        seen_usernames = set()
+        seen_emails = set()
+        for index, candidate in enumerate(candidates):
+            if not isinstance(candidate, dict):
+                candidate = {}
+            username = candidate.get('username')
+            email = candidate.get('email')
+            errors = []
+            conflicts = []
+            
+            if not username:
+                errors.append('username is required')
+            elif not isinstance(username, str) or not validate_username(username):
+                errors.append('username must be 3-20 characters, alphanumeric and underscores only')
+            elif username in seen_usernames:
+                conflicts.append('duplicate username in request')
+            
+            if not email:
+                errors.append('email is required')
+            elif not isinstance(email, str) or not validate_email(email):
+                errors.append('invalid email format')
+            elif email in seen_emails:
+                conflicts.append('duplicate email in request')
+            
+            if not errors and not conflicts:
+                seen_usernames.add(username)
+                seen_emails.add(email)
+            results.append({
+                'index': index,
+                'username': username,
+                'email': email,
+                'errors': errors,
+                'conflicts': conflicts,
+            })
+        
+        # Existence of every well-formed candidate in a single query
+        check_usernames = [r['username'] for r in results if not r['errors'] and not r['conflicts']]
+        check_emails = [r['email'] for r in results if not r['errors'] and not r['conflicts']]
+        taken_usernames, taken_emails = set(), set()
+        if check_usernames:
+            with db.connection() as conn:
+                taken_usernames, taken_emails = known_users.find_taken(conn, check_usernames, check_emails)
+        
+        valid_count = 0
+        for result in results:
+            conflicts = result.pop('conflicts')
+            if not result['errors'] and not conflicts:
+                if result['username'] in taken_usernames:
+                    conflicts.append('username already exists')
+                if result['email'] in taken_emails:
+                    conflicts.append('email already exists')
+            # Well-formed, but clashes with an existing user or an earlier candidate
+            result['duplicate'] = not result['errors'] and bool(conflicts)
+            result['errors'] += conflicts
+            result['valid'] = not result['errors']
+            valid_count += result['valid']
+        
+        return jsonify({
+            'valid': valid_count == len(results),
+            'valid_count': valid_count,
+            'invalid_count': len(results) - valid_count,
+            'results': results,
+            'region': REGION
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Bulk validation error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/v1/process/order', methods=['POST'])
 def process_order():
     """Process business order logic"""
@@ -143,26 +247,26 @@ def process_order():
         if not user_id or not amount:
             return jsonify({'error': 'user_id and amount are required'}), 400
         
-        # Verify user exists
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SELECT id, username FROM users WHERE id = %s", (user_id,))
-        user = cur.fetchone()
-        
-        if not user:
+        with db.connection() as conn:
+            # Verify user exists
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute("SELECT id, username FROM users WHERE id = %s", (user_id,))
+            user = cur.fetchone()
+            
+            if not user:
+                cur.close()
+                return jsonify({'error': 'user not found'}), 404
+            
+            # Insert order
+            cur.execute(
+                "INSERT INTO orders (user_id, amount, status) VALUES (%s, %s, %s) RETURNING id, user_id, amount, status, created_at",
+                (user_id, amount, 'pending')
+            )
+            order = cur.fetchone()
+            analytics.record_orders(cur, [(order['status'], order['amount'])])
+            conn.commit()
             cur.close()
-            conn.close()
-            return jsonify({'error': 'user not found'}), 404
-        
-        # Insert order
-        cur.execute(
-            "INSERT INTO orders (user_id, amount, status) VALUES (%s, %s, %s) RETURNING id, user_id, amount, status, created_at",
-            (user_id, amount, 'pending')
-        )
-        order = cur.fetchone()
-        conn.commit()
-        cur.close()
-        conn.close()
+        response_cache.invalidate(ORDERS_CACHE_TAG)
         
         logger.info(f"Order processed: {order['id']} for user {user_id} in region {REGION}")
         
@@ -176,44 +280,286 @@ def process_order():
         logger.error(f"Order processing error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def parse_order_amount(amount):
+    """Amount as a Decimal that fits orders.amount, or None"""
+    if isinstance(amount, bool) or not isinstance(amount, (int, float, str)):
+        return None
+    try:
+        value = Decimal(str(amount))
+    except InvalidOperation:
+        return None
+    if not value.is_finite() or value <= 0 or value >= MAX_ORDER_AMOUNT or value != value.quantize(CENTS):
+        return None
+    # Two places, so results render like the order.amount read back from the database
+    return value.quantize(CENTS)
+
+@app.route('/api/v1/process/orders', methods=['POST'])
+def process_orders():
+    """Process many orders with one user lookup and multi-row inserts"""
+    try:
+        data = request.get_json()
+        orders = data.get('orders') if isinstance(data, dict) else data
+        
+        if not isinstance(orders, list) or not orders:
+            return jsonify({'error': 'orders must be a non-empty list'}), 400
+        if len(orders) > ORDERS_BATCH_MAX:
+            return jsonify({'error': f"at most {ORDERS_BATCH_MAX} orders per request"}), 400
+        
+        results = []
+        for index, order in enumerate(orders):
+            if not isinstance(order, dict):
+                order = {}
+            user_id = order.get('user_id')
+            amount = parse_order_amount(order.get('amount'))
+            errors = []
+            if isinstance(user_id, bool) or not isinstance(user_id, int) or user_id <= 0:
+                errors.append('user_id must be a positive integer')
+            if amount is None:
+                errors.append('amount must be a positive number with at most 2 decimal places below 100000000')
+            results.append({
+                'index': index,
+                'user_id': user_id,
+                'amount': amount,
+                'status': 'invalid' if errors else 'pending',
+                'errors': errors,
+            })
+        
+        candidates = [r for r in results if r['status'] == 'pending']
+        processed = 0
+        if candidates:
+            with db.connection() as conn:
+                cur = conn.cursor(cursor_factory=RealDictCursor)
+                
+                # Verify every user at once; KEY SHARE keeps them from being
+                # deleted before the inserts commit
+                cur.execute(
+                    "SELECT id, username FROM users WHERE id = ANY(%s) FOR KEY SHARE",
+                    (sorted({r['user_id'] for r in candidates}),)
+                )
+                users = {row['id']: row for row in cur.fetchall()}
+                
+                valid = []
+                for result in candidates:
+                    if result['user_id'] in users:
+                        valid.append(result)
+                    else:
+                        result['status'] = 'user_not_found'
+                        result['errors'].append('user not found')
+                
+                for start in range(0, len(valid), ORDERS_INSERT_PAGE_SIZE):
+                    page = valid[start:start + ORDERS_INSERT_PAGE_SIZE]
+                    rows = execute_values(
+                        cur,
+                        """
+                        INSERT INTO orders (user_id, amount, status) VALUES %s
+                        RETURNING id, user_id, amount, status, created_at
+                        """,
+                        [(r['user_id'], r['amount'], 'pending') for r in page],
+                        page_size=ORDERS_INSERT_PAGE_SIZE,
+                        fetch=True
+                    )
+                    # Ids are assigned in VALUES order; RETURNING order is not guaranteed
+                    rows.sort(key=lambda row: row['id'])
+                    for result, row in zip(page, rows):
+                        result['status'] = 'processed'
+                        result['order'] = row
+                processed = len(valid)
+                analytics.record_orders(cur, [('pending', r['amount']) for r in valid])
+                conn.commit()
+                cur.close()
+            if valid:
+                response_cache.invalidate(ORDERS_CACHE_TAG)
+        
+        logger.info(f"Processed {processed} of {len(results)} orders in region {REGION}")
+        
+        return jsonify({
+            'processed': processed,
+            'rejected': len(results) - processed,
+            'results': results,
+            'region': REGION
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Bulk order processing error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/v1/analytics/summary', methods=['GET'])
+@response_cache.cached(ORDERS_CACHE_TAG, bypass=lambda args: args.get('mode') in ('exact', 'scan'),
+                       volatile=('timestamp', 'staleness_seconds'))
 def get_analytics_summary():
     """Get analytics summary"""
     try:
-        conn = get_db_connection()
+        mode = request.args.get('mode', 'approximate')
+        if mode not in SUMMARY_MODES:
+            return jsonify({'error': f"mode must be one of {', '.join(SUMMARY_MODES)}"}), 400
+        group_by = request.args.get('group_by')
+        if group_by is not None and group_by not in analytics.GROUP_BYS:
+            return jsonify({'error': f"group_by must be one of {', '.join(analytics.GROUP_BYS)}"}), 400
+        try:
+            start, end = parse_summary_window(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if mode == 'scan':
+            result = scan_analytics_summary(start, end, group_by)
+            age = 0.0
+        else:
+            # approximate may be served from this worker's cache; exact reads the
+            # rollups, which are updated in the same transaction as every order
+            max_staleness = request.args.get('max_staleness', analytics.ANALYTICS_MAX_STALENESS, type=float)
+            analytics.maybe_roll_up_users(db.connection)
+            # exact only reads the replica when it has replayed everything it received
+            result, age = analytics.get_summary(
+                partial(db.read_connection, 0) if mode == 'exact' else db.read_connection,
+                start, end, group_by, 0 if mode == 'exact' else max_staleness
+            )
+        
+        return jsonify({
+            **result,
+            'window': {
+                'from': start.isoformat() if start else None,
+                'to': end.isoformat() if end else None,
+            },
+            'mode': mode,
+            'staleness_seconds': round(age, 3),
+            'region': REGION,
+            'timestamp': datetime.utcnow().isoformat()
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Analytics error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def parse_summary_window(args):
+    """(first day, last day) from ?from=/?to= ISO dates or ?days=N, either may be None"""
+    if 'days' in args:
+        if 'from' in args or 'to' in args:
+            raise ValueError('days cannot be combined with from/to')
+        try:
+            days = int(args['days'])
+        except ValueError:
+            raise ValueError('days must be an integer')
+        if not 1 <= days <= SUMMARY_MAX_DAYS:
+            raise ValueError(f"days must be between 1 and {SUMMARY_MAX_DAYS}")
+        # Days follow created_at, which is UTC with the default database time zone
+        today = datetime.utcnow().date()
+        return today - timedelta(days=days - 1), today
+    
+    window = []
+    for name in ('from', 'to'):
+        value = args.get(name)
+        try:
+            window.append(date.fromisoformat(value) if value else None)
+        except ValueError:
+            raise ValueError(f"{name} must be an ISO date (YYYY-MM-DD)")
+    start, end = window
+    if start and end and start > end:
+        raise ValueError('from must not be after to')
+    return start, end
+
+def scan_analytics_summary(start, end, group_by):
+    """Compute the analytics summary with full scans of users and orders"""
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append("created_at >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append("created_at < %s")
+        params.append(end + timedelta(days=1))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    with db.read_connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # Get user count
-        cur.execute("SELECT COUNT(*) as user_count FROM users")
+        cur.execute(f"SELECT COUNT(*) as user_count FROM users {where}", params)
         user_count = cur.fetchone()['user_count']
         
         # Get order stats
-        cur.execute("""
+        cur.execute(f"""
             SELECT 
                 COUNT(*) as order_count,
                 COALESCE(SUM(amount), 0) as total_amount,
                 COALESCE(AVG(amount), 0) as avg_amount
             FROM orders
-        """)
+            {where}
+        """, params)
         order_stats = cur.fetchone()
         
-        cur.close()
-        conn.close()
-        
-        return jsonify({
+        result = {
             'users': user_count,
             'orders': {
                 'count': order_stats['order_count'],
                 'total_amount': float(order_stats['total_amount']),
                 'average_amount': float(order_stats['avg_amount'])
-            },
-            'region': REGION,
-            'timestamp': datetime.utcnow().isoformat()
-        }), 200
+            }
+        }
         
-    except Exception as e:
-        logger.error(f"Analytics error: {e}")
-        return jsonify({'error': str(e)}), 500
+        if group_by == 'status':
+            cur.execute(f"""
+                SELECT status, COUNT(*) as order_count, SUM(amount) as total_amount
+                FROM orders {where}
+                GROUP BY status ORDER BY status
+            """, params)
+            result['groups'] = [
+                {'status': row['status'], **analytics.order_totals(row['order_count'], row['total_amount'])}
+                for row in cur.fetchall()
+            ]
+        elif group_by == 'day':
+            cur.execute(f"""
+                SELECT created_at::date as day, COUNT(*) as order_count, SUM(amount) as total_amount
+                FROM orders {where}
+                GROUP BY 1
+            """, params)
+            by_day = {row['day']: (row['order_count'], row['total_amount']) for row in cur.fetchall()}
+            cur.execute(f"SELECT created_at::date as day, COUNT(*) as user_count FROM users {where} GROUP BY 1", params)
+            users_by_day = {row['day']: row['user_count'] for row in cur.fetchall()}
+            result['groups'] = [
+                {
+                    'day': day.isoformat(),
+                    'new_users': users_by_day.get(day, 0),
+                    **analytics.order_totals(*by_day.get(day, (0, 0))),
+                }
+                for day in sorted(set(by_day) | set(users_by_day))
+            ]
+        
+        cur.close()
+    return result
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics summed over this pod's workers"""
+    return Response(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/metrics/db-pool', methods=['GET'])
+def get_pool_metrics():
+    """Database connection pool metrics for this worker"""
+    return jsonify({
+        'service': 'business-logic',
+        'region': REGION,
+        **db.pool_stats()
+    }), 200
+
+@app.route('/metrics/validation-cache', methods=['GET'])
+def get_validation_cache_metrics():
+    """Known-users cache metrics for this worker"""
+    return jsonify({
+        'service': 'business-logic',
+        'region': REGION,
+        'pid': os.getpid(),
+        **known_users.cache_stats()
+    }), 200
+
+@app.route('/metrics/response-cache', methods=['GET'])
+def get_response_cache_metrics():
+    """Response cache metrics for this worker"""
+    return jsonify({
+        'service': 'business-logic',
+        'region': REGION,
+        'pid': os.getpid(),
+        **response_cache.cache_stats()
+    }), 200
 
 @app.route('/api/v1/info', methods=['GET'])
 def get_info():
@@ -223,7 +569,7 @@ def get_info():
         'version': '1.0.0',
         'region': REGION,
         'environment': os.getenv('ENVIRONMENT', 'production'),
-        'database_host': DB_HOST
+        'database_host': db.DB_HOST
     }), 200
 
 if __name__ == '__main__':
@@ -0,0 +1,302 @@
+"""
+Known Users Cache
+Answers "is this username/email taken?" with one ANY() query, skipping the database where a cache can
+"""
+import os
+import math
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import db
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+# 'off' always asks PostgreSQL; 'on' keeps a bloom filter of every taken
+# username/email (negative answers skip the database) plus an LRU of
+# confirmed taken values (repeated positive answers skip it too)
+VALIDATE_CACHE = os.getenv('VALIDATE_CACHE', 'off').lower() in ('on', 'true', '1')
+VALIDATE_CACHE_REFRESH = float(os.getenv('VALIDATE_CACHE_REFRESH', '1'))
+VALIDATE_CACHE_LRU_SIZE = int(os.getenv('VALIDATE_CACHE_LRU_SIZE', '100000'))
+VALIDATE_CACHE_LRU_TTL = float(os.getenv('VALIDATE_CACHE_LRU_TTL', '300'))
+VALIDATE_BLOOM_CAPACITY = int(os.getenv('VALIDATE_BLOOM_CAPACITY', '1000000'))
+VALIDATE_BLOOM_ERROR_RATE = float(os.getenv('VALIDATE_BLOOM_ERROR_RATE', '0.01'))
+
+# Rows read per round trip while loading the bloom filter
+LOAD_BATCH_ROWS = 10000
+
+# Ids below the watermark re-read on each refresh to catch late commits
+RESCAN_WINDOW_IDS = 1000
+
+# Seconds before a failed full load is tried again
+LOAD_RETRY_SECONDS = 30
+
+
+class BloomFilter:
+    """Fixed-size bloom filter over strings"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.bits = max(int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.bits / self.capacity * math.log(2))), 1)
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+def _key(kind, value):
+    return f"{kind}:{value}"
+
+
+class KnownUsers:
+    """Bloom filter of taken usernames/emails kept current by users.id watermark
+
+    Full loads (the first one and rebuilds past capacity) read every user,
+    so they run in a background thread on their own connection and never
+    hold the lock; until the first one finishes, lookups go to the database.
+    Requests only apply the small incremental refreshes.
+    """
+
+    def __init__(self, capacity=VALIDATE_BLOOM_CAPACITY):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._capacity = capacity
+        self._watermark = 0
+        self._recent_ids = set()
+        self._refreshed_at = 0.0
+        self._loading = False
+        self._load_failed_at = None
+        self._taken = OrderedDict()
+        self._stats = {'bloom_negative': 0, 'lru_hits': 0, 'db_lookups': 0, 'rebuilds': 0}
+
+    @staticmethod
+    def _load(cur, bloom, after_id, recent_ids):
+        """Add users with id > after_id (and late commits just below it) to bloom
+
+        recent_ids holds the ids already added near the watermark; returns
+        (new watermark, new recent_ids).
+        """
+        watermark = after_id
+        # Ids are assigned before commit, so a transaction holding a lower id
+        # can commit after a higher one was read; rescan a window below the
+        # watermark and skip the ids already added
+        since = max(after_id - RESCAN_WINDOW_IDS, 0)
+        while True:
+            cur.execute(
+                "SELECT id, username, email FROM users WHERE id > %s ORDER BY id LIMIT %s",
+                (since, LOAD_BATCH_ROWS)
+            )
+            rows = cur.fetchall()
+            for row_id, username, email in rows:
+                since = row_id
+                if row_id in recent_ids:
+                    continue
+                bloom.add(_key('u', username))
+                bloom.add(_key('e', email))
+                recent_ids.add(row_id)
+                watermark = max(watermark, row_id)
+            if len(rows) < LOAD_BATCH_ROWS:
+                break
+        return watermark, {row_id for row_id in recent_ids if row_id > watermark - RESCAN_WINDOW_IDS}
+
+    def start_loading(self, capacity=None):
+        """Build a new bloom filter in a background thread unless one is being built"""
+        with self._lock:
+            if self._loading:
+                return
+            if self._load_failed_at is not None and time.monotonic() - self._load_failed_at < LOAD_RETRY_SECONDS:
+                return
+            self._loading = True
+        threading.Thread(
+            target=self._build, args=(capacity or self._capacity,), name='validation-bloom-load', daemon=True
+        ).start()
+
+    def _build(self, capacity):
+        try:
+            bloom = BloomFilter(capacity, VALIDATE_BLOOM_ERROR_RATE)
+            with db.connection() as conn:
+                cur = conn.cursor()
+                watermark, recent_ids = self._load(cur, bloom, 0, set())
+                cur.close()
+                conn.rollback()
+            with self._lock:
+                if self._bloom is not None:
+                    self._stats['rebuilds'] += 1
+                self._bloom = bloom
+                self._capacity = capacity
+                self._watermark = watermark
+                self._recent_ids = recent_ids
+                self._refreshed_at = time.monotonic()
+                self._load_failed_at = None
+            logger.info(f"Loaded {bloom.count} usernames/emails into the validation bloom filter")
+        except Exception as e:
+            with self._lock:
+                self._load_failed_at = time.monotonic()
+            logger.error(f"Loading the validation bloom filter failed: {e}")
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def refresh(self, conn):
+        """Pick up users created since the last refresh, at most every VALIDATE_CACHE_REFRESH seconds
+
+        Returns False while there is no bloom filter yet.
+        """
+        now = time.monotonic()
+        with self._lock:
+            bloom = self._bloom
+            if bloom is not None and now - self._refreshed_at < VALIDATE_CACHE_REFRESH:
+                return True
+        if bloom is None:
+            self.start_loading()
+            return False
+        if bloom.count > bloom.capacity:
+            # Past capacity the false-positive rate climbs; the current
+            # filter stays in use while a larger one is built
+            self.start_loading(bloom.capacity * 2)
+        with self._lock:
+            if self._bloom is not bloom or now - self._refreshed_at < VALIDATE_CACHE_REFRESH:
+                return True
+            cur = conn.cursor()
+            self._watermark, self._recent_ids = self._load(cur, bloom, self._watermark, self._recent_ids)
+            cur.close()
+            self._refreshed_at = now
+        return True
+
+    def _lru_get(self, key, now):
+        expires = self._taken.get(key)
+        if expires is None:
+            return False
+        if expires < now:
+            del self._taken[key]
+            return False
+        self._taken.move_to_end(key)
+        return True
+
+    def _lru_put(self, key, now):
+        self._taken[key] = now + VALIDATE_CACHE_LRU_TTL
+        self._taken.move_to_end(key)
+        while len(self._taken) > VALIDATE_CACHE_LRU_SIZE:
+            self._taken.popitem(last=False)
+
+    def find_taken(self, conn, usernames, emails):
+        """(taken usernames, taken emails) among the given values"""
+        if not self.refresh(conn):
+            with self._lock:
+                self._stats['db_lookups'] += len(usernames) + len(emails)
+            return query_taken(conn, usernames, emails)
+        now = time.monotonic()
+        taken_usernames, taken_emails = set(), set()
+        ask_usernames, ask_emails = [], []
+        with self._lock:
+            for kind, values, taken, ask in (('u', usernames, taken_usernames, ask_usernames),
+                                             ('e', emails, taken_emails, ask_emails)):
+                for value in values:
+                    key = _key(kind, value)
+                    if self._lru_get(key, now):
+                        taken.add(value)
+                        self._stats['lru_hits'] += 1
+                    elif key not in self._bloom:
+                        self._stats['bloom_negative'] += 1
+                    else:
+                        ask.append(value)
+
+        if ask_usernames or ask_emails:
+            found_usernames, found_emails = query_taken(conn, ask_usernames, ask_emails)
+            taken_usernames |= found_usernames
+            taken_emails |= found_emails
+            with self._lock:
+                self._stats['db_lookups'] += len(ask_usernames) + len(ask_emails)
+                for value in found_usernames:
+                    self._lru_put(_key('u', value), now)
+                for value in found_emails:
+                    self._lru_put(_key('e', value), now)
+        return taken_usernames, taken_emails
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': True,
+                'bloom_ready': self._bloom is not None,
+                'bloom_loading': self._loading,
+                'bloom_entries': self._bloom.count if self._bloom else 0,
+                'bloom_capacity': self._bloom.capacity if self._bloom else self._capacity,
+                'bloom_bytes': len(self._bloom.array) if self._bloom else 0,
+                'watermark_id': self._watermark,
+                'lru_entries': len(self._taken),
+                **self._stats,
+            }
+
+
+def query_taken(conn, usernames, emails):
+    """(taken usernames, taken emails) from a single ANY() lookup"""
+    usernames = list(usernames)
+    emails = list(emails)
+    if not usernames and not emails:
+        return set(), set()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT username, email FROM users WHERE username = ANY(%s) OR email = ANY(%s)",
+        (usernames, emails)
+    )
+    rows = cur.fetchall()
+    cur.close()
+    wanted_usernames = set(usernames)
+    wanted_emails = set(emails)
+    return (
+        {username for username, _ in rows if username in wanted_usernames},
+        {email for _, email in rows if email in wanted_emails},
+    )
+
+
+_cache = None
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """This worker's cache, or None when VALIDATE_CACHE is off"""
+    global _cache, _cache_pid
+    if not VALIDATE_CACHE:
+        return None
+    pid = os.getpid()
+    with _cache_lock:
+        if _cache is None or _cache_pid != pid:
+            _cache = KnownUsers()
+            _cache_pid = pid
+        return _cache
+
+
+def warm():
+    """Start loading this worker's bloom filter when the cache is enabled"""
+    cache = get_cache()
+    if cache is not None:
+        cache.start_loading()
+
+
+def find_taken(conn, usernames=(), emails=()):
+    """(taken usernames, taken emails), through the cache when it is enabled"""
+    cache = get_cache()
+    if cache is None:
+        return query_taken(conn, usernames, emails)
+    return cache.find_taken(conn, usernames, emails)
+
+
+def cache_stats():
+    cache = get_cache()
+    return cache.stats() if cache is not None else {'enabled': False}
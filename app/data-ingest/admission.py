@@ -0,0 +1,322 @@
+"""
+Admission Control
+Adaptive per-endpoint concurrency limits, fast load shedding and request body limits for the write endpoints
+
+Each limited endpoint admits up to `limit` requests at a time per worker.
+The limit grows by one per limit's worth of requests whose service time
+stays within INGEST_ADMISSION_LATENCY_TOLERANCE of the endpoint's baseline,
+and is cut by INGEST_ADMISSION_BACKOFF (at most once per service time)
+when recent service times exceed that, requests fail with 5xx, or a
+request still in flight has run that long - the AIMD rule TCP uses for
+its congestion window. For these endpoints the
+service time is almost all database time: queries, commits, pool waits
+and coalesced writes. Requests over the limit wait in a short queue; when
+it is full they get 429, and when they wait longer than the queue timeout
+they get 503, both with Retry-After, instead of piling up on a slow
+database. A request that still times out waiting for a pool connection
+gets the same 503.
+"""
+import os
+import math
+import time
+import logging
+import threading
+from functools import wraps
+from flask import current_app, jsonify, request
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+ADMISSION_ENABLED = os.getenv('INGEST_ADMISSION', 'on').lower() in ('on', 'true', '1')
+ADMISSION_INITIAL_LIMIT = int(os.getenv('INGEST_ADMISSION_INITIAL_LIMIT', '4'))
+ADMISSION_MIN_LIMIT = int(os.getenv('INGEST_ADMISSION_MIN_LIMIT', '1'))
+# Single-record ingests wait on the coalescer, not on a pool connection, so
+# they may take most of the Dockerfile's 32 gunicorn --threads; the rest
+# hold the queues and turn requests away while the database stalls
+ADMISSION_MAX_LIMIT = int(os.getenv('INGEST_ADMISSION_MAX_LIMIT', '20'))
+# Each batch holds a pool connection throughout; one is left for the
+# coalescer's writer and one for reads
+ADMISSION_BATCH_MAX_LIMIT = int(os.getenv('INGEST_ADMISSION_BATCH_MAX_LIMIT', str(max(db.DB_POOL_MAX_SIZE - 2, 1))))
+ADMISSION_LATENCY_TOLERANCE = float(os.getenv('INGEST_ADMISSION_LATENCY_TOLERANCE', '2'))
+ADMISSION_BACKOFF = float(os.getenv('INGEST_ADMISSION_BACKOFF', '0.75'))
+ADMISSION_QUEUE_SIZE = int(os.getenv('INGEST_ADMISSION_QUEUE_SIZE', '4'))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('INGEST_ADMISSION_QUEUE_TIMEOUT', '0.5'))
+
+# Weights of the newest sample in the recent and baseline service times;
+# the baseline moves ten times slower still while the endpoint is congested,
+# so a sustained slowdown is not mistaken for the new normal
+RECENT_WEIGHT = 0.2
+BASELINE_WEIGHT = 0.01
+CONGESTED_BASELINE_WEIGHT = 0.001
+
+# Batch service times grow with the body, so samples are taken per this
+# many body bytes; a large batch after small ones is not read as congestion
+SAMPLE_UNIT_BYTES = 64 * 1024
+
+MAX_RETRY_AFTER_SECONDS = 30
+
+ADMISSIONS = metrics.Counter(
+    'ingest_admission_requests_total', 'Requests to limited endpoints, by admission outcome',
+    ['endpoint', 'outcome']
+)
+LIMITS = metrics.Gauge('ingest_admission_limit', 'Concurrency limit of each endpoint, summed over workers', ['endpoint'])
+
+OUTCOMES = ('admitted', 'queued', 'rejected_queue_full', 'rejected_timeout', 'rejected_too_large')
+
+
+class Rejected(Exception):
+    """A request turned away before it reached the view"""
+
+    def __init__(self, status, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit with a bounded wait queue for one endpoint in one worker"""
+
+    def __init__(self, name, initial=ADMISSION_INITIAL_LIMIT, min_limit=ADMISSION_MIN_LIMIT,
+                 max_limit=ADMISSION_MAX_LIMIT, queue_size=ADMISSION_QUEUE_SIZE, queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.limit = float(max(min(initial, max_limit), min_limit))
+        self.waiting = 0
+        self._started = {}
+        self._recent = None
+        self._baseline = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._outcomes = {outcome: ADMISSIONS.labels(name, outcome) for outcome in OUTCOMES}
+        self._counts = dict.fromkeys(OUTCOMES, 0)
+        self._limit_gauge = LIMITS.labels(name)
+        self._limit_gauge.set(int(self.limit))
+
+    def count(self, outcome):
+        self._counts[outcome] += 1
+        self._outcomes[outcome].inc()
+
+    @property
+    def in_flight(self):
+        return len(self._started)
+
+    def retry_after(self):
+        """Seconds until the queue ahead has likely drained"""
+        service_time = self._recent or 0.0
+        estimate = service_time * (self.waiting + 1) / max(int(self.limit), 1)
+        return min(max(1, math.ceil(estimate)), MAX_RETRY_AFTER_SECONDS)
+
+    def _admit(self):
+        token = object()
+        self._started[token] = time.monotonic()
+        return token
+
+    def acquire(self):
+        """Take a slot, waiting up to queue_timeout; returns the token for release()
+
+        Raises Rejected when the request is shed.
+        """
+        with self._cond:
+            if self.in_flight < int(self.limit) and not self.waiting:
+                self.count('admitted')
+                return self._admit()
+            # Completions are the usual signal, but a stalled database
+            # produces none, so look at how long the slots have been held
+            if self._baseline is not None:
+                oldest = time.monotonic() - min(self._started.values(), default=time.monotonic())
+                if oldest > self._baseline * ADMISSION_LATENCY_TOLERANCE:
+                    self._decrease(oldest)
+            if self.waiting >= self.queue_size:
+                self.count('rejected_queue_full')
+                raise Rejected(429, f"{self.name} is at its concurrency limit", self.retry_after())
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.in_flight >= int(self.limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.count('rejected_timeout')
+                        raise Rejected(503, f"{self.name} is overloaded", self.retry_after())
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.count('queued')
+            return self._admit()
+
+    def release(self, token, failed=False, units=1.0):
+        """Give the slot back and adjust the limit from the request's service time per unit of work"""
+        with self._cond:
+            seconds = (time.monotonic() - self._started.pop(token)) / units
+            self._update(seconds, failed)
+            self._limit_gauge.set(int(self.limit))
+            # The freed slot, plus any the limit just gained
+            self._cond.notify(max(int(self.limit) - self.in_flight, 1))
+
+    def _update(self, seconds, failed):
+        if self._recent is None:
+            self._recent = self._baseline = seconds
+        self._recent += RECENT_WEIGHT * (seconds - self._recent)
+        congested = failed or self._recent > self._baseline * ADMISSION_LATENCY_TOLERANCE
+        weight = CONGESTED_BASELINE_WEIGHT if congested else BASELINE_WEIGHT
+        self._baseline += weight * (seconds - self._baseline)
+
+        if congested:
+            self._decrease(self._recent)
+        else:
+            self.limit = min(self.limit + 1.0 / self.limit, float(self.max_limit))
+
+    def _decrease(self, service_time):
+        # One cut per service time, so the completions of one slow round
+        # count as a single congestion signal
+        now = time.monotonic()
+        if now - self._last_decrease >= service_time:
+            self._last_decrease = now
+            self.limit = max(self.limit * ADMISSION_BACKOFF, float(self.min_limit))
+            self._limit_gauge.set(int(self.limit))
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'recent_ms': round(self._recent * 1000, 3) if self._recent is not None else None,
+                'baseline_ms': round(self._baseline * 1000, 3) if self._baseline is not None else None,
+                **self._counts,
+            }
+
+
+class CappedStream:
+    """wsgi.input wrapper for bodies without a Content-Length that stops reading past max_bytes"""
+
+    def __init__(self, stream, max_bytes):
+        self._stream = stream
+        self._remaining = max_bytes
+        self.bytes_read = 0
+        self.exceeded = False
+
+    def _take(self, data):
+        self.bytes_read += len(data)
+        self._remaining -= len(data)
+        if self._remaining < 0:
+            self.exceeded = True
+            raise Rejected(413, 'request body too large', None)
+        return data
+
+    def read(self, size=-1):
+        if self.exceeded:
+            raise Rejected(413, 'request body too large', None)
+        if size is None or size < 0:
+            size = self._remaining + 1
+        return self._take(self._stream.read(min(size, self._remaining + 1)))
+
+    def readline(self, size=-1):
+        if self.exceeded:
+            raise Rejected(413, 'request body too large', None)
+        if size is None or size < 0:
+            size = self._remaining + 1
+        return self._take(self._stream.readline(min(size, self._remaining + 1)))
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+_limiters = {}
+_limiters_pid = None
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name, max_limit=ADMISSION_MAX_LIMIT):
+    """This worker's limiter for an endpoint"""
+    global _limiters, _limiters_pid
+    pid = os.getpid()
+    with _limiters_lock:
+        if _limiters_pid != pid:
+            # Counts of in-flight requests do not carry over a fork
+            _limiters = {}
+            _limiters_pid = pid
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = AdaptiveLimiter(name, max_limit=max_limit)
+        return limiter
+
+
+def _rejection(error):
+    response = jsonify({'error': str(error)})
+    response.status_code = error.status
+    if error.retry_after is not None:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def _pool_exhausted(limiter, error):
+    logger.warning(f"{limiter.name}: {error}")
+    return _rejection(Rejected(503, f"{limiter.name} is overloaded: {error}", limiter.retry_after()))
+
+
+def limited(name, max_body_bytes, max_limit=ADMISSION_MAX_LIMIT):
+    """Admission-control a view: body size limit, then the endpoint's adaptive concurrency limit
+
+    The view lets db.PoolTimeout propagate; it is answered with 503 and
+    Retry-After like a request shed from the queue.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            limiter = get_limiter(name, max_limit)
+            if not ADMISSION_ENABLED:
+                try:
+                    return view(*args, **kwargs)
+                except db.PoolTimeout as e:
+                    return _pool_exhausted(limiter, e)
+
+            length = request.content_length
+            capped = None
+            if length is not None and length > max_body_bytes:
+                limiter.count('rejected_too_large')
+                return _rejection(Rejected(413, f"request body larger than {max_body_bytes} bytes", None))
+            if length is None:
+                # Chunked bodies are counted as they are read
+                capped = request.environ['wsgi.input'] = CappedStream(request.environ['wsgi.input'], max_body_bytes)
+
+            try:
+                token = limiter.acquire()
+            except Rejected as e:
+                return _rejection(e)
+            failed = True
+            try:
+                try:
+                    response = current_app.make_response(view(*args, **kwargs))
+                except db.PoolTimeout as e:
+                    response = _pool_exhausted(limiter, e)
+                failed = response.status_code >= 500 and not (capped is not None and capped.exceeded)
+            finally:
+                body_bytes = length if capped is None else capped.bytes_read
+                limiter.release(token, failed, max(1.0, body_bytes / SAMPLE_UNIT_BYTES))
+            if capped is not None and capped.exceeded:
+                # The view saw the body cut short; whatever it answered, the cause is the size
+                limiter.count('rejected_too_large')
+                return _rejection(Rejected(413, f"request body larger than {max_body_bytes} bytes", None))
+            return response
+        return wrapper
+    return decorator
+
+
+def admission_stats():
+    """Limits, queues and outcomes of this worker's limiters"""
+    with _limiters_lock:
+        limiters = dict(_limiters) if _limiters_pid == os.getpid() else {}
+    return {
+        'enabled': ADMISSION_ENABLED,
+        'endpoints': {name: limiter.stats() for name, limiter in limiters.items()},
+    }
@@ -4,39 +4,151 @@ Handles data ingestion workflows and batch processing
 """
 import os
 import logging
-import json
-from flask import Flask, jsonify, request
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from functools import partial
+from collections import Counter
+from flask import Flask, Response, jsonify, request
+from psycopg2.extras import RealDictCursor, execute_values
 from datetime import datetime
+import db
+import fast_json
+import metrics
+import tracing
+import health
+import idempotency
+import coalesce
+import admission
+from copy_ingest import (
+    COPY_CHUNK_ROWS, RejectedLine, copy_ndjson, format_copy_row, parse_line, process_ndjson, raw_line_parser,
+    validate_record
+)
+from spool import SpoolError, get_spool, start_pending_flusher
+import stats
+import partitions
+import maintenance
+import pagination
+import export
+import response_cache
 
 app = Flask(__name__)
+app.json = fast_json.FastJSONProvider(app)
 logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
+metrics.instrument(app, 'data-ingest')
+tracing.instrument(app, 'data-ingest')
 
 # Configuration from environment variables
-DB_HOST = os.getenv('DATABASE_HOST', 'localhost')
-DB_PORT = os.getenv('DATABASE_PORT', '5432')
-DB_NAME = os.getenv('DATABASE_NAME', 'appdb')
-DB_USER = os.getenv('DATABASE_USER', 'appuser')
-DB_PASSWORD = os.getenv('DATABASE_PASSWORD', 'password')
 REGION = os.getenv('REGION', 'unknown')
 
-def get_db_connection():
-    """Create database connection"""
+# Records per multi-row INSERT statement in /api/v1/ingest
+INSERT_PAGE_SIZE = int(os.getenv('INGEST_INSERT_PAGE_SIZE', '500'))
+
+# Request body limits; larger requests get 413 before reaching the database
+INGEST_MAX_BODY_BYTES = int(os.getenv('INGEST_MAX_BODY_BYTES', str(1024 * 1024)))
+INGEST_BATCH_MAX_BODY_BYTES = int(os.getenv('INGEST_BATCH_MAX_BODY_BYTES', str(256 * 1024 * 1024)))
+
+# Default acknowledgement mode: 'sync' commits to PostgreSQL before
+# responding, 'spool' acknowledges once records are in the local spool
+INGEST_DURABILITY = os.getenv('INGEST_DURABILITY', 'sync').lower()
+DURABILITY_MODES = ('sync', 'spool')
+
+# Stats modes: approximate (cached rollups), exact (fresh rollups),
+# scan (full-table scans of ingested_data, for verification)
+STATS_MODES = ('approximate', 'exact', 'scan')
+
+# Request content types that select the streaming COPY path for batches
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl')
+
+# NDJSON line formats: 'record' lines are {"type", "data", "source"}
+# objects; 'raw' lines are the data payloads themselves, stored as sent
+PAYLOAD_FORMATS = ('record', 'raw')
+
+# Create partitions ahead of time when ingested_data is partitioned, and
+# prune expired rows outside ingest transactions
+maintenance.start()
+# Drain records a previous worker or pod acknowledged but did not flush
+start_pending_flusher()
+
+def requested_durability():
+    """Durability mode for this request (?durability= overrides the default)"""
+    mode = request.args.get('durability', INGEST_DURABILITY).lower()
+    if mode not in DURABILITY_MODES:
+        raise ValueError(f"durability must be one of {', '.join(DURABILITY_MODES)}")
+    return mode
+
+def requested_dedupe():
+    """Deduplicator for this request, keyed by its Idempotency-Key header if any"""
+    batch_key = request.headers.get(idempotency.HEADER)
+    if batch_key is not None:
+        idempotency.validate_key(batch_key, f"{idempotency.HEADER} header")
+    return idempotency.Deduplicator(batch_key)
+
+def keyed_records(records):
+    """(idempotency_key, record) pairs; raises ValueError for an invalid key"""
+    entries = []
+    for index, record in enumerate(records):
+        try:
+            entries.append((idempotency.record_key(record), record))
+        except ValueError as e:
+            raise ValueError(f"record {index}: {e}")
+    return entries
+
+def spool_records(records, default_source, dedupe):
+    """Validate records and append those not seen before to the spool as one entry
+
+    Returns (spool, sequence, rows), or (None, None, 0) when every record
+    was a repeat. Keys are checked against this worker's recent-key cache
+    only; the spool flusher does not claim them.
+    """
+    entries = []
+    for index, record in enumerate(records):
+        try:
+            record_type, payload, source = validate_record(record, default_source)
+            key = idempotency.record_key(record)
+        except (RejectedLine, ValueError) as e:
+            raise ValueError(f"record {index}: {e}")
+        entries.append((key, format_copy_row(record_type, payload, source, REGION)))
+    rows = [row for _, row in dedupe.screen(entries)]
+    if not rows:
+        return None, None, 0
+    spool = get_spool()
+    sequence = spool.append(''.join(rows), len(rows))
+    dedupe.committed()
+    return spool, sequence, len(rows)
+
+def requested_line_parser():
+    """NDJSON line parser for this request (?payload=raw with ?type= and ?source= for raw payloads)"""
+    payload_format = request.args.get('payload', 'record').lower()
+    if payload_format not in PAYLOAD_FORMATS:
+        raise ValueError(f"payload must be one of {', '.join(PAYLOAD_FORMATS)}")
+    if payload_format == 'record':
+        return parse_line
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            connect_timeout=5
-        )
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection failed: {e}")
-        raise
+        return raw_line_parser(request.args.get('type', 'generic'), request.args.get('source', 'batch'))
+    except RejectedLine as e:
+        raise ValueError(str(e))
+
+def spool_response(spool, sequence, accepted, **extra):
+    """Acknowledgement for records accepted into the spool"""
+    return jsonify({
+        'accepted': accepted,
+        'sequence': sequence,
+        'durability': 'spool',
+        'fsync': spool.fsync,
+        'status_url': f"/api/v1/ingest/status/{sequence}",
+        **extra,
+        'region': REGION,
+        'timestamp': datetime.utcnow().isoformat()
+    }), 202
+
+def duplicates_response(dedupe, **extra):
+    """Response for a request whose records had all been ingested before"""
+    return jsonify({
+        'ingested': 0,
+        'duplicates_skipped': dedupe.skipped,
+        **extra,
+        'region': REGION,
+        'timestamp': datetime.utcnow().isoformat()
+    }), 200
 
 @app.route('/health/live', methods=['GET'])
 def liveness():
@@ -48,17 +160,17 @@ def liveness():
         'timestamp': datetime.utcnow().isoformat()
     }), 200
 
+def check_database():
+    """Postgres reachable through this worker's pool, which may be busy but must be moving"""
+    return db.check_primary(health.HEALTH_CHECK_TIMEOUT / 2, health.HEALTH_MAX_AGE)
+
+health.monitor.register('postgres', check_database)
+
 @app.route('/health/ready', methods=['GET'])
 def readiness():
-    """Readiness probe - checks if service can handle requests"""
-    try:
-        # Check database connectivity
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT 1")
-        cur.close()
-        conn.close()
-        
+    """Readiness probe - served from the background health monitor's cached results"""
+    ready, reason, dependencies = health.monitor.readiness()
+    if ready:
         return jsonify({
             'status': 'ready',
             'service': 'data-ingest',
@@ -66,14 +178,24 @@ def readiness():
             'database': 'connected',
             'timestamp': datetime.utcnow().isoformat()
         }), 200
-    except Exception as e:
-        logger.error(f"Readiness check failed: {e}")
-        return jsonify({
-            'status': 'not_ready',
-            'reason': str(e)
-        }), 503
+    return jsonify({
+        'status': 'not_ready',
+        'reason': reason,
+        'dependencies': dependencies
+    }), 503
+
+@app.route('/health/dependencies', methods=['GET'])
+def get_dependencies():
+    """Per-dependency health results and latency history for this worker"""
+    return jsonify({
+        'service': 'data-ingest',
+        'region': REGION,
+        'pid': os.getpid(),
+        'dependencies': health.monitor.details()
+    }), 200
 
 @app.route('/api/v1/ingest', methods=['POST'])
+@admission.limited('ingest', INGEST_MAX_BODY_BYTES)
 def ingest_data():
     """Ingest data records"""
     try:
@@ -85,45 +207,110 @@ def ingest_data():
         # Support both single record and batch
         records = data if isinstance(data, list) else [data]
         
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            dedupe = requested_dedupe()
+            if requested_durability() == 'spool':
+                spool, sequence, rows = spool_records(records, 'api', dedupe)
+                if not rows:
+                    return duplicates_response(dedupe, records=[])
+                logger.info(f"Spooled {rows} records up to sequence {sequence} in region {REGION}")
+                return spool_response(spool, sequence, rows, duplicates_skipped=dedupe.skipped)
+            # Retries of recently committed records stop here, before the database
+            entries = dedupe.screen(keyed_records(records))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except SpoolError as e:
+            logger.error(f"Spool unavailable: {e}")
+            return jsonify({'error': f"spool unavailable: {e}"}), 503
         
-        ingested_records = []
-        for record in records:
-            record_type = record.get('type', 'generic')
-            payload = json.dumps(record.get('data', {}))
-            source = record.get('source', 'api')
-            
-            cur.execute(
-                """
-                INSERT INTO ingested_data (record_type, payload, source, region)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id, record_type, source, region, created_at
-                """,
-                (record_type, payload, source, REGION)
-            )
-            ingested_record = cur.fetchone()
-            ingested_records.append(ingested_record)
+        if not entries:
+            return duplicates_response(dedupe, records=[])
         
-        conn.commit()
-        cur.close()
-        conn.close()
+        if coalesce.COALESCE_ENABLED and len(records) == 1:
+            return ingest_coalesced(dedupe, entries[0])
+        
+        with db.connection() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            
+            values = []
+            for _, record in dedupe.claim(cur, entries):
+                record_type = record.get('type', 'generic')
+                payload = fast_json.dumps(record.get('data', {}), sort_keys=False)
+                source = record.get('source', 'api')
+                values.append((record_type, payload, source, REGION))
+            
+            # One multi-row INSERT per page instead of a round trip per record
+            ingested_records = []
+            for start in range(0, len(values), INSERT_PAGE_SIZE):
+                page = execute_values(
+                    cur,
+                    """
+                    INSERT INTO ingested_data (record_type, payload, source, region)
+                    VALUES %s
+                    RETURNING id, record_type, source, region, created_at
+                    """,
+                    values[start:start + INSERT_PAGE_SIZE],
+                    page_size=INSERT_PAGE_SIZE,
+                    fetch=True
+                )
+                # Ids are assigned in VALUES order; RETURNING order is not guaranteed
+                page.sort(key=lambda row: row['id'])
+                ingested_records.extend(page)
+            
+            if values:
+                stats.record_ingest(cur, Counter((value[0], value[2]) for value in values))
+                conn.commit()
+            cur.close()
+        if not values:
+            return duplicates_response(dedupe, records=[])
+        dedupe.committed()
+        stats.INGESTED_ROWS.labels('api').inc(len(ingested_records))
+        response_cache.invalidate(stats.CACHE_TAG)
         
         logger.info(f"Ingested {len(ingested_records)} records in region {REGION}")
         
         return jsonify({
             'ingested': len(ingested_records),
+            'duplicates_skipped': dedupe.skipped,
             'records': ingested_records,
             'region': REGION
         }), 201
         
+    except db.PoolTimeout:
+        # Answered as overload by admission control
+        raise
     except Exception as e:
         logger.error(f"Data ingestion error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def ingest_coalesced(dedupe, entry):
+    """Write one record together with other requests' through this worker's coalescer"""
+    key, record = entry
+    try:
+        record_type, payload, source = validate_record(record, 'api')
+    except RejectedLine as e:
+        return jsonify({'error': str(e)}), 400
+    
+    rows = coalesce.get_coalescer().submit(dedupe, [(key, (record_type, payload, source, REGION))])
+    if not rows:
+        return duplicates_response(dedupe, records=[])
+    stats.INGESTED_ROWS.labels('api').inc(len(rows))
+    response_cache.invalidate(stats.CACHE_TAG)
+    
+    return jsonify({
+        'ingested': len(rows),
+        'duplicates_skipped': dedupe.skipped,
+        'records': rows,
+        'region': REGION
+    }), 201
+
 @app.route('/api/v1/ingest/batch', methods=['POST'])
+@admission.limited('batch', INGEST_BATCH_MAX_BODY_BYTES, admission.ADMISSION_BATCH_MAX_LIMIT)
 def ingest_batch():
     """Ingest large batch of data"""
+    if request.mimetype in NDJSON_MIMETYPES or request.args.get('mode') == 'copy':
+        return ingest_batch_copy()
+
     try:
         data = request.get_json()
         records = data.get('records', [])
@@ -131,47 +318,207 @@ def ingest_batch():
         if not records:
             return jsonify({'error': 'no records provided'}), 400
         
-        conn = get_db_connection()
-        cur = conn.cursor()
+        try:
+            dedupe = requested_dedupe()
+            if requested_durability() == 'spool':
+                spool, sequence, rows = spool_records(records, 'batch', dedupe)
+                if not rows:
+                    return duplicates_response(dedupe)
+                logger.info(f"Spooled batch of {rows} records up to sequence {sequence} in region {REGION}")
+                return spool_response(spool, sequence, rows, duplicates_skipped=dedupe.skipped)
+            # Retries of recently committed records stop here, before the database
+            entries = dedupe.screen(keyed_records(records))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except SpoolError as e:
+            logger.error(f"Spool unavailable: {e}")
+            return jsonify({'error': f"spool unavailable: {e}"}), 503
         
-        # Batch insert for performance
-        values = []
-        for record in records:
-            record_type = record.get('type', 'generic')
-            payload = json.dumps(record.get('data', {}))
-            source = record.get('source', 'batch')
-            values.append((record_type, payload, source, REGION))
+        if not entries:
+            return duplicates_response(dedupe)
         
-        cur.executemany(
-            """
-            INSERT INTO ingested_data (record_type, payload, source, region)
-            VALUES (%s, %s, %s, %s)
-            """,
-            values
-        )
-        
-        conn.commit()
-        count = cur.rowcount
-        cur.close()
-        conn.close()
+        with db.connection() as conn:
+            cur = conn.cursor()
+            
+            # Batch insert for performance
+            values = []
+            for _, record in dedupe.claim(cur, entries):
+                record_type = record.get('type', 'generic')
+                payload = fast_json.dumps(record.get('data', {}), sort_keys=False)
+                source = record.get('source', 'batch')
+                values.append((record_type, payload, source, REGION))
+            
+            if values:
+                cur.executemany(
+                    """
+                    INSERT INTO ingested_data (record_type, payload, source, region)
+                    VALUES (%s, %s, %s, %s)
+                    """,
+                    values
+                )
+                count = cur.rowcount
+                
+                stats.record_ingest(cur, Counter((value[0], value[2]) for value in values))
+                conn.commit()
+            cur.close()
+        if not values:
+            return duplicates_response(dedupe)
+        dedupe.committed()
+        stats.INGESTED_ROWS.labels('batch').inc(count)
+        response_cache.invalidate(stats.CACHE_TAG)
         
         logger.info(f"Batch ingested {count} records in region {REGION}")
         
         return jsonify({
             'ingested': count,
+            'duplicates_skipped': dedupe.skipped,
             'region': REGION,
             'timestamp': datetime.utcnow().isoformat()
         }), 201
         
+    except db.PoolTimeout:
+        # Answered as overload by admission control
+        raise
     except Exception as e:
         logger.error(f"Batch ingestion error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def ingest_batch_copy():
+    """Stream newline-delimited JSON records into the database with COPY"""
+    try:
+        chunk_rows = request.args.get('chunk_rows', COPY_CHUNK_ROWS, type=int)
+        if chunk_rows < 1:
+            return jsonify({'error': 'chunk_rows must be positive'}), 400
+
+        try:
+            parse = requested_line_parser()
+            dedupe = requested_dedupe()
+            if requested_durability() == 'spool':
+                return ingest_batch_spool(chunk_rows, parse, dedupe)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except SpoolError as e:
+            logger.error(f"Spool unavailable: {e}")
+            return jsonify({'error': f"spool unavailable: {e}"}), 503
+
+        with db.connection() as conn:
+            result = copy_ndjson(conn, request.stream, REGION, chunk_rows=chunk_rows, parse=parse, dedupe=dedupe)
+            if result['ingested']:
+                conn.commit()
+        if result['ingested']:
+            dedupe.committed()
+            stats.INGESTED_ROWS.labels('copy').inc(result['ingested'])
+            response_cache.invalidate(stats.CACHE_TAG)
+
+        if not result['ingested'] and not result['rejected']:
+            if result['duplicates_skipped']:
+                return duplicates_response(dedupe, mode='copy')
+            return jsonify({'error': 'no records provided'}), 400
+
+        logger.info(
+            f"Bulk ingested {result['ingested']} records ({result['rejected']} rejected, "
+            f"{result['duplicates_skipped']} duplicates) in region {REGION}"
+        )
+
+        return jsonify({
+            **result,
+            'mode': 'copy',
+            'region': REGION,
+            'timestamp': datetime.utcnow().isoformat()
+        }), 201 if result['ingested'] else 400
+
+    except db.PoolTimeout:
+        # Answered as overload by admission control
+        raise
+    except Exception as e:
+        logger.error(f"Bulk ingestion error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def ingest_batch_spool(chunk_rows, parse, dedupe):
+    """Stage an NDJSON body and append it to the spool as one entry"""
+    spool = get_spool()
+    batch = spool.batch()
+    try:
+        result = process_ndjson(
+            request.stream, REGION, batch.write, chunk_rows=chunk_rows, parse=parse, select=dedupe.screen
+        )
+        if not result['ingested']:
+            batch.discard()
+            if not result['rejected']:
+                if result['duplicates_skipped']:
+                    return duplicates_response(dedupe, mode='copy')
+                return jsonify({'error': 'no records provided'}), 400
+            return jsonify({**result, 'mode': 'copy', 'region': REGION}), 400
+        sequence = batch.commit()
+    except Exception:
+        batch.discard()
+        raise
+    dedupe.committed()
+
+    logger.info(
+        f"Spooled {result['ingested']} bulk records ({result['rejected']} rejected) "
+        f"up to sequence {sequence} in region {REGION}"
+    )
+    accepted = result.pop('ingested')
+    return spool_response(spool, sequence, accepted, mode='copy', **result)
+
+@app.route('/api/v1/ingest/status/<int:sequence>', methods=['GET'])
+def get_ingest_status(sequence):
+    """Check whether a spooled sequence id has been persisted"""
+    try:
+        status = get_spool().status(sequence)
+        if not status['known']:
+            return jsonify({'error': 'unknown sequence', **status}), 404
+        return jsonify({**status, 'region': REGION}), 200
+    except SpoolError as e:
+        return jsonify({'error': f"spool unavailable: {e}"}), 503
+
+@app.route('/api/v1/ingest/spool', methods=['GET'])
+def get_spool_stats():
+    """Spool backlog and flusher statistics"""
+    try:
+        return jsonify({**get_spool().stats(), 'region': REGION}), 200
+    except SpoolError as e:
+        return jsonify({'error': f"spool unavailable: {e}"}), 503
+
 @app.route('/api/v1/ingest/stats', methods=['GET'])
+@response_cache.cached(stats.CACHE_TAG, bypass=lambda args: args.get('mode') in ('exact', 'scan'),
+                       volatile=('timestamp', 'staleness_seconds'))
 def get_ingest_stats():
     """Get ingestion statistics"""
     try:
-        conn = get_db_connection()
+        mode = request.args.get('mode', 'approximate')
+        if mode not in STATS_MODES:
+            return jsonify({'error': f"mode must be one of {', '.join(STATS_MODES)}"}), 400
+        
+        if mode == 'scan':
+            result = scan_ingest_stats()
+            age = 0.0
+        else:
+            # approximate may be served from this worker's cache; exact reads the
+            # rollups, which are updated in the same transaction as every write
+            max_staleness = request.args.get('max_staleness', stats.STATS_MAX_STALENESS, type=float)
+            # exact only reads the replica when it has replayed everything it received
+            result, age = stats.get_stats(
+                partial(db.read_connection, 0) if mode == 'exact' else db.read_connection,
+                0 if mode == 'exact' else max_staleness
+            )
+        
+        return jsonify({
+            **result,
+            'mode': mode,
+            'staleness_seconds': round(age, 3),
+            'region': REGION,
+            'timestamp': datetime.utcnow().isoformat()
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Stats error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def scan_ingest_stats():
+    """Compute ingestion statistics with full scans of ingested_data"""
+    with db.read_connection() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         # Get overall stats
@@ -200,73 +547,145 @@ def get_ingest_stats():
         cur.execute("""
             SELECT COUNT(*) as recent_count
             FROM ingested_data
-            WHERE created_at > NOW() - INTERVAL '1 hour'
+            WHERE created_at > LOCALTIMESTAMP - INTERVAL '1 hour'
         """)
         recent_stats = cur.fetchone()
         
         cur.close()
-        conn.close()
-        
-        return jsonify({
-            'total_records': overall_stats['total_records'],
-            'unique_types': overall_stats['unique_types'],
-            'unique_sources': overall_stats['unique_sources'],
-            'recent_hour_count': recent_stats['recent_count'],
-            'by_type': type_stats,
-            'region': REGION,
-            'timestamp': datetime.utcnow().isoformat()
-        }), 200
-        
-    except Exception as e:
-        logger.error(f"Stats error: {e}")
-        return jsonify({'error': str(e)}), 500
+    
+    return {
+        'total_records': overall_stats['total_records'],
+        'unique_types': overall_stats['unique_types'],
+        'unique_sources': overall_stats['unique_sources'],
+        'recent_hour_count': recent_stats['recent_count'],
+        'by_type': type_stats
+    }
 
 @app.route('/api/v1/ingest/recent', methods=['GET'])
+@response_cache.cached(stats.CACHE_TAG, bypass=lambda args: 'stream' in args)
 def get_recent_ingestions():
-    """Get recent ingested records"""
+    """Get recent ingested records, newest first, one keyset page at a time"""
     try:
-        limit = request.args.get('limit', 50, type=int)
+        limit, after, stream = pagination.parse_page_args(request.args, 50)
         record_type = request.args.get('type')
+        since = request.args.get('since')
         
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
+        # A lower bound on created_at lets PostgreSQL skip older partitions
+        conditions = []
+        params = []
         if record_type:
-            cur.execute(
-                """
-                SELECT id, record_type, source, region, created_at
-                FROM ingested_data
-                WHERE record_type = %s
-                ORDER BY created_at DESC
-                LIMIT %s
-                """,
-                (record_type, limit)
-            )
-        else:
-            cur.execute(
-                """
-                SELECT id, record_type, source, region, created_at
-                FROM ingested_data
-                ORDER BY created_at DESC
-                LIMIT %s
-                """,
-                (limit,)
+            conditions.append("record_type = %s")
+            params.append(record_type)
+        if since:
+            try:
+                params.append(datetime.fromisoformat(since))
+            except ValueError:
+                return jsonify({'error': 'since must be an ISO 8601 timestamp'}), 400
+            conditions.append("created_at >= %s")
+        sql, params = pagination.keyset_query(
+            'id, record_type, source, region, created_at', 'ingested_data',
+            conditions, params, after, limit
+        )
+        
+        if stream:
+            chunks = pagination.stream_page(
+                sql, params, limit, stream, app.json.dumps, 'records', {'limit': limit, 'region': REGION}
             )
+            return Response(pagination.primed(chunks), mimetype=pagination.STREAM_MIMETYPES[stream])
         
-        records = cur.fetchall()
-        cur.close()
-        conn.close()
+        with db.read_connection() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute(sql, params)
+            records, next_cursor = pagination.split_page(cur.fetchall(), limit)
+            cur.close()
         
         return jsonify({
             'records': records,
             'count': len(records),
+            'limit': limit,
+            'next_cursor': next_cursor,
             'region': REGION
         }), 200
         
+    except pagination.InvalidPageRequest as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Recent records error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/v1/ingest/export', methods=['GET'])
+def export_ingested_data():
+    """Stream ingested records, payloads included, as a compressed NDJSON or CSV file"""
+    try:
+        fmt, compression, conditions, params = export.parse_export_args(request.args)
+        chunks = pagination.primed(export.stream_export(fmt, compression, conditions, params))
+        return Response(
+            chunks,
+            mimetype=export.mimetype(fmt, compression),
+            headers={'Content-Disposition': f'attachment; filename="{export.filename(fmt, compression)}"'}
+        )
+        
+    except export.InvalidExportRequest as e:
+        return jsonify({'error': str(e)}), 400
+    except export.ExportBusy as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '5'}
+    except Exception as e:
+        logger.error(f"Export error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/v1/ingest/partitions', methods=['GET'])
+def get_partitions():
+    """List ingested_data partitions and their bounds"""
+    try:
+        return jsonify({**partitions.partition_summary(), 'region': REGION}), 200
+    except Exception as e:
+        logger.error(f"Partition listing error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics summed over this pod's workers"""
+    return Response(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/metrics/db-pool', methods=['GET'])
+def get_pool_metrics():
+    """Database connection pool metrics for this worker"""
+    return jsonify({
+        'service': 'data-ingest',
+        'region': REGION,
+        **db.pool_stats()
+    }), 200
+
+@app.route('/metrics/response-cache', methods=['GET'])
+def get_response_cache_metrics():
+    """Response cache metrics for this worker"""
+    return jsonify({
+        'service': 'data-ingest',
+        'region': REGION,
+        'pid': os.getpid(),
+        **response_cache.cache_stats()
+    }), 200
+
+@app.route('/metrics/ingest-coalescer', methods=['GET'])
+def get_coalescer_metrics():
+    """Single-record ingest coalescing counters for this worker"""
+    return jsonify({
+        'service': 'data-ingest',
+        'region': REGION,
+        'pid': os.getpid(),
+        **coalesce.coalescer_stats()
+    }), 200
+
+@app.route('/metrics/admission', methods=['GET'])
+def get_admission_metrics():
+    """Admission limits, queues and shed requests for this worker"""
+    return jsonify({
+        'service': 'data-ingest',
+        'region': REGION,
+        'pid': os.getpid(),
+        **admission.admission_stats()
+    }), 200
+
 @app.route('/api/v1/info', methods=['GET'])
 def get_info():
     """Get service information"""
@@ -275,7 +694,7 @@ def get_info():
         'version': '1.0.0',
         'region': REGION,
         'environment': os.getenv('ENVIRONMENT', 'production'),
-        'database_host': DB_HOST
+        'database_host': db.DB_HOST
     }), 200
 
 if __name__ == '__main__':
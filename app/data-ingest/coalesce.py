@@ -0,0 +1,179 @@
+"""
+Ingest Coalescing
+Micro-batches concurrent single-record ingests into one multi-row INSERT and one commit
+
+Request threads hand their record to this worker's coalescer and wait. A
+writer thread collects the records that arrive within
+INGEST_COALESCE_MAX_DELAY_MS of the first one (or until
+INGEST_COALESCE_MAX_BATCH are waiting), inserts them in one transaction and
+hands each request its own returned row. Needs threaded gunicorn workers
+(--threads) to see concurrent requests.
+"""
+import os
+import time
+import logging
+import threading
+from collections import Counter
+from psycopg2.extras import RealDictCursor, execute_values
+import db
+import idempotency
+import metrics
+import stats
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+COALESCE_ENABLED = os.getenv('INGEST_COALESCE', 'on').lower() in ('on', 'true', '1')
+COALESCE_MAX_DELAY_MS = float(os.getenv('INGEST_COALESCE_MAX_DELAY_MS', '2'))
+# A batch never holds more than the single-record ingests admission control
+# lets in at once, so at that size the writer stops waiting for more
+COALESCE_MAX_BATCH = int(os.getenv('INGEST_COALESCE_MAX_BATCH', os.getenv('INGEST_ADMISSION_MAX_LIMIT', '20')))
+
+INSERT_SQL = """
+    INSERT INTO ingested_data (record_type, payload, source, region)
+    VALUES %s
+    RETURNING id, record_type, source, region, created_at
+"""
+
+BATCH_SIZE = metrics.Histogram(
+    'ingest_coalesced_batch_size', 'Single-record ingests written per coalesced transaction',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+WAIT_SECONDS = metrics.Histogram(
+    'ingest_coalesce_wait_seconds', 'Time a single-record ingest waited for its batch to be written'
+)
+
+
+class Pending:
+    """One request's screened entries, waiting for the writer"""
+    __slots__ = ('dedupe', 'entries', 'rows', 'error', 'arrived', '_done')
+
+    def __init__(self, dedupe, entries):
+        self.dedupe = dedupe
+        self.entries = entries
+        self.rows = []
+        self.error = None
+        self.arrived = time.monotonic()
+        self._done = threading.Event()
+
+
+class Coalescer:
+    """Per-worker queue of single-record ingests and the thread that writes them"""
+
+    def __init__(self, max_delay=COALESCE_MAX_DELAY_MS / 1000.0, max_batch=COALESCE_MAX_BATCH):
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._pending = []
+        self._batches = 0
+        self._records = 0
+        self._errors = 0
+        threading.Thread(target=self._run, name='ingest-coalescer', daemon=True).start()
+
+    def submit(self, dedupe, entries):
+        """Queue (idempotency_key, value) entries and wait for their rows; raises what the write raised"""
+        item = Pending(dedupe, entries)
+        with self._cond:
+            self._pending.append(item)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        item._done.wait()
+        WAIT_SECONDS.observe(time.monotonic() - item.arrived)
+        if item.error is not None:
+            raise item.error
+        return item.rows
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # The window opens with the oldest waiting request
+            deadline = self._pending[0].arrived + self.max_delay
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.error(f"Coalesced insert of {len(batch)} requests failed: {e}")
+                self._errors += 1
+                for item in batch:
+                    item.error = e
+            finally:
+                for item in batch:
+                    item._done.set()
+
+    def _write(self, batch):
+        with db.connection() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            kept = idempotency.claim_together(cur, [(item.dedupe, item.entries) for item in batch])
+            owners = []
+            values = []
+            for item, entries in zip(batch, kept):
+                for _, value in entries:
+                    owners.append(item)
+                    values.append(value)
+            if values:
+                rows = execute_values(cur, INSERT_SQL, values, page_size=len(values), fetch=True)
+                # Ids are assigned in VALUES order; RETURNING order is not guaranteed
+                rows.sort(key=lambda row: row['id'])
+                stats.record_ingest(cur, Counter((value[0], value[2]) for value in values))
+                conn.commit()
+                for item, row in zip(owners, rows):
+                    item.rows.append(row)
+            cur.close()
+        if values:
+            for item in batch:
+                item.dedupe.committed()
+        BATCH_SIZE.observe(len(batch))
+        self._batches += 1
+        self._records += len(values)
+
+    def stats(self):
+        with self._cond:
+            waiting = len(self._pending)
+        return {
+            'enabled': True,
+            'max_delay_ms': self.max_delay * 1000,
+            'max_batch': self.max_batch,
+            'waiting': waiting,
+            'batches': self._batches,
+            'records': self._records,
+            'errors': self._errors,
+            'mean_batch_records': round(self._records / self._batches, 2) if self._batches else None,
+        }
+
+
+_coalescer = None
+_coalescer_pid = None
+_coalescer_lock = threading.Lock()
+
+
+def get_coalescer():
+    """This worker's coalescer, started on first use"""
+    global _coalescer, _coalescer_pid
+    pid = os.getpid()
+    if _coalescer is not None and _coalescer_pid == pid:
+        return _coalescer
+    with _coalescer_lock:
+        if _coalescer is None or _coalescer_pid != pid:
+            # The parent's writer thread does not survive a fork
+            _coalescer = Coalescer()
+            _coalescer_pid = pid
+        return _coalescer
+
+
+def coalescer_stats():
+    """Coalescing counters for this worker"""
+    if not COALESCE_ENABLED:
+        return {'enabled': False}
+    return get_coalescer().stats()
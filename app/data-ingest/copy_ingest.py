@@ -0,0 +1,289 @@
+"""
+Streaming COPY Ingest
+Streams newline-delimited JSON records into ingested_data with COPY FROM STDIN
+"""
+import os
+import io
+import logging
+from functools import partial
+from collections import Counter
+import psycopg2
+import fast_json
+from stats import record_ingest
+from idempotency import record_key
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+COPY_CHUNK_ROWS = int(os.getenv('INGEST_COPY_CHUNK_ROWS', '5000'))
+COPY_MAX_LINE_BYTES = int(os.getenv('INGEST_COPY_MAX_LINE_BYTES', str(1024 * 1024)))
+COPY_MAX_REPORTED_REJECTS = int(os.getenv('INGEST_COPY_MAX_REPORTED_REJECTS', '100'))
+
+# Column limits from init-db.sql; longer values would abort the whole COPY
+MAX_RECORD_TYPE_LENGTH = 50
+MAX_SOURCE_LENGTH = 50
+
+COPY_SQL = "COPY ingested_data (record_type, payload, source, region) FROM STDIN"
+
+# Escapes for the COPY text format
+_COPY_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    '\n': '\\n',
+    '\r': '\\r',
+    '\t': '\\t',
+})
+
+_COPY_UNESCAPES = {'\\': '\\', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class RejectedLine(Exception):
+    """A line that cannot be ingested"""
+
+
+def copy_escape(value):
+    """Escape a value for the COPY text format"""
+    return value.translate(_COPY_ESCAPES)
+
+
+def copy_unescape(value):
+    """Reverse copy_escape for a single field"""
+    if '\\' not in value:
+        return value
+    out = []
+    chars = iter(value)
+    for char in chars:
+        if char == '\\':
+            char = _COPY_UNESCAPES.get(next(chars, ''), '')
+        out.append(char)
+    return ''.join(out)
+
+
+def validate_type_and_source(record_type, source):
+    """Reject record types and sources the ingested_data columns cannot hold"""
+    if not isinstance(record_type, str) or not record_type:
+        raise RejectedLine('type must be a non-empty string')
+    if len(record_type) > MAX_RECORD_TYPE_LENGTH:
+        raise RejectedLine(f"type longer than {MAX_RECORD_TYPE_LENGTH} characters")
+    if not isinstance(source, str) or not source:
+        raise RejectedLine('source must be a non-empty string')
+    if len(source) > MAX_SOURCE_LENGTH:
+        raise RejectedLine(f"source longer than {MAX_SOURCE_LENGTH} characters")
+    if '\x00' in record_type or '\x00' in source:
+        raise RejectedLine('type and source must not contain NUL characters')
+
+
+def validate_record(record, default_source):
+    """Validate a decoded record and return (record_type, payload, source)"""
+    if not isinstance(record, dict):
+        raise RejectedLine('record must be a JSON object')
+
+    record_type = record.get('type', 'generic')
+    source = record.get('source', default_source)
+    validate_type_and_source(record_type, source)
+
+    # jsonb does not keep key order, so skip sorting
+    payload = fast_json.dumps(record.get('data', {}), sort_keys=False)
+    # PostgreSQL rejects \u0000 inside jsonb text values
+    if '\\u0000' in payload:
+        raise RejectedLine('data must not contain NUL characters')
+    return record_type, payload, source
+
+
+def parse_line(line, default_source):
+    """Parse one NDJSON line into (record_type, payload, source, idempotency_key)"""
+    try:
+        record = fast_json.loads(line)
+    except ValueError as e:
+        raise RejectedLine(f"invalid JSON: {e}")
+    record_type, payload, source = validate_record(record, default_source)
+    try:
+        return record_type, payload, source, record_key(record)
+    except ValueError as e:
+        raise RejectedLine(str(e))
+
+
+def raw_line_parser(record_type, source):
+    """Line parser for NDJSON whose lines are payloads, all of one record_type and source
+
+    Each line is checked to be JSON and stored as sent, without building
+    and re-encoding Python objects, so raw lines carry no idempotency key.
+    Raises RejectedLine for an unusable record_type or source.
+    """
+    validate_type_and_source(record_type, source)
+
+    def parse(line, default_source):
+        try:
+            payload = line.strip().decode('utf-8')
+            # Rejects NaN and Infinity on both backends, as jsonb does
+            fast_json.loads(payload)
+        except ValueError as e:
+            raise RejectedLine(f"invalid JSON: {e}")
+        if '\\u0000' in payload:
+            raise RejectedLine('data must not contain NUL characters')
+        return record_type, payload, source, None
+    return parse
+
+
+def format_copy_row(record_type, payload, source, region):
+    """Render one ingested_data row in the COPY text format"""
+    return (
+        f"{copy_escape(record_type)}\t{copy_escape(payload)}\t"
+        f"{copy_escape(source)}\t{copy_escape(region)}\n"
+    )
+
+
+def iter_lines(stream, max_line_bytes=COPY_MAX_LINE_BYTES):
+    """Yield (line_number, line) from a byte stream, flagging oversized lines"""
+    line_number = 0
+    while True:
+        line = stream.readline(max_line_bytes + 1)
+        if not line:
+            return
+        line_number += 1
+        if len(line) > max_line_bytes and not line.endswith(b'\n'):
+            # Drain the rest of the oversized line so the next one starts clean
+            while True:
+                rest = stream.readline(max_line_bytes)
+                if not rest or rest.endswith(b'\n'):
+                    break
+            yield line_number, None
+            continue
+        yield line_number, line
+
+
+def process_ndjson(stream, region, write_chunk, default_source='batch', chunk_rows=COPY_CHUNK_ROWS,
+                   parse=parse_line, select=None):
+    """Validate NDJSON records and hand them to write_chunk in COPY text chunks
+
+    write_chunk(text, rows, counts) is called once per chunk of up to
+    chunk_rows rows, with counts keyed by (record_type, source). It may
+    return [(row index in the chunk, error)] for rows the database refused;
+    those are reported as rejected lines.
+    parse(line, default_source) turns a line into (record_type, payload,
+    source, idempotency_key). select(entries), when given, returns the
+    (idempotency_key, row) entries of a chunk that are to be written; the
+    rest are counted as duplicates.
+    """
+    chunks = []
+    rejected_lines = []
+    entries = []
+    total_rows = 0
+    total_rejected = 0
+    total_duplicates = 0
+    chunk_rejected = 0
+
+    def reject(line_number, error):
+        nonlocal total_rejected, chunk_rejected
+        total_rejected += 1
+        chunk_rejected += 1
+        if len(rejected_lines) < COPY_MAX_REPORTED_REJECTS:
+            rejected_lines.append({'line': line_number, 'error': error})
+
+    def flush():
+        nonlocal entries, total_rows, total_duplicates, chunk_rejected
+        parsed = len(entries)
+        if select is not None and entries:
+            entries = select(entries)
+        duplicates = parsed - len(entries)
+        written = len(entries)
+        if entries:
+            refused = write_chunk(
+                ''.join(format_copy_row(record_type, payload, source, region)
+                        for _, (record_type, payload, source, _) in entries),
+                len(entries),
+                Counter((record_type, source) for _, (record_type, _, source, _) in entries)
+            ) or []
+            for index, error in refused:
+                reject(entries[index][1][3], error)
+            written -= len(refused)
+            total_rows += written
+        total_duplicates += duplicates
+        chunks.append({
+            'chunk': len(chunks) + 1,
+            'rows': written,
+            'rejected': chunk_rejected,
+            'duplicates': duplicates,
+        })
+        entries = []
+        chunk_rejected = 0
+
+    for line_number, line in iter_lines(stream):
+        try:
+            if line is None:
+                raise RejectedLine(f"line longer than {COPY_MAX_LINE_BYTES} bytes")
+            if not line.strip():
+                continue
+            record_type, payload, source, key = parse(line, default_source)
+        except RejectedLine as e:
+            reject(line_number, str(e))
+            continue
+
+        entries.append((key, (record_type, payload, source, line_number)))
+        if len(entries) >= chunk_rows:
+            flush()
+
+    if entries or chunk_rejected:
+        flush()
+
+    return {
+        'ingested': total_rows,
+        'rejected': total_rejected,
+        'duplicates_skipped': total_duplicates,
+        'chunks': chunks,
+        'rejected_lines': rejected_lines,
+        'rejected_lines_truncated': total_rejected > len(rejected_lines),
+    }
+
+
+def copy_chunk(cur, text):
+    """COPY one chunk of rows, retrying row by row when the database refuses one
+
+    Validation catches almost every bad line, but some values only fail as
+    jsonb input (a lone surrogate escape, say). Such a DataError would abort
+    the whole request, so the chunk is rolled back to a savepoint and
+    copied one row at a time instead. Returns [(row index, error, row
+    text)] of the rows that were refused.
+    """
+    cur.execute("SAVEPOINT copy_chunk")
+    try:
+        cur.copy_expert(COPY_SQL, io.StringIO(text))
+        cur.execute("RELEASE SAVEPOINT copy_chunk")
+        return []
+    except psycopg2.DataError as e:
+        logger.warning(f"COPY chunk rejected ({e.diag.message_primary}); retrying row by row")
+        cur.execute("ROLLBACK TO SAVEPOINT copy_chunk")
+
+    refused = []
+    for index, line in enumerate(text.split('\n')[:-1]):
+        try:
+            cur.execute("SAVEPOINT copy_row")
+            cur.copy_expert(COPY_SQL, io.StringIO(line + '\n'))
+            cur.execute("RELEASE SAVEPOINT copy_row")
+        except psycopg2.DataError as e:
+            cur.execute("ROLLBACK TO SAVEPOINT copy_row")
+            refused.append((index, f"rejected by the database: {e.diag.message_primary}", line))
+    return refused
+
+
+def copy_ndjson(conn, stream, region, default_source='batch', chunk_rows=COPY_CHUNK_ROWS, parse=parse_line,
+                dedupe=None):
+    """Stream NDJSON records into ingested_data in bounded COPY chunks
+
+    All chunks run in the caller's transaction; the caller commits. With
+    an idempotency.Deduplicator, each chunk's keys are claimed just before
+    its COPY and repeated records are left out.
+    """
+    cur = conn.cursor()
+
+    def write_chunk(text, rows, counts):
+        refused = copy_chunk(cur, text)
+        for _, _, line in refused:
+            record_type, _, source, _ = line.split('\t')
+            counts[(copy_unescape(record_type), copy_unescape(source))] -= 1
+        record_ingest(cur, +counts)
+        return [(index, error) for index, error, _ in refused]
+
+    select = partial(dedupe.select, cur) if dedupe is not None else None
+    result = process_ndjson(stream, region, write_chunk, default_source, chunk_rows, parse, select)
+    cur.close()
+    return result
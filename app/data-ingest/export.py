@@ -0,0 +1,155 @@
+"""
+Ingest Export
+Streams ingested_data rows, payloads included, as compressed NDJSON or CSV through a server-side cursor
+"""
+import io
+import os
+import csv
+import uuid
+import zlib
+import threading
+from datetime import datetime
+import db
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Configuration from environment variables
+EXPORT_FETCH_SIZE = int(os.getenv('INGEST_EXPORT_FETCH_SIZE', '5000'))
+EXPORT_GZIP_LEVEL = int(os.getenv('INGEST_EXPORT_GZIP_LEVEL', '6'))
+EXPORT_ZSTD_LEVEL = int(os.getenv('INGEST_EXPORT_ZSTD_LEVEL', '3'))
+# Exports hold a database connection for their whole duration
+EXPORT_MAX_CONCURRENT = int(os.getenv('INGEST_EXPORT_MAX_CONCURRENT', '1'))
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+COMPRESSIONS = ('gzip', 'zstd', 'none')
+
+COLUMNS = ('id', 'record_type', 'payload', 'source', 'region', 'created_at')
+
+# PostgreSQL renders each row, so Python only joins the lines
+NDJSON_SELECT = "row_to_json(r)::text"
+CSV_SELECT = """
+    id, record_type, payload::text, source, region,
+    to_char(created_at, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+"""
+
+FILTERS = (
+    ('type', "record_type = %s"),
+    ('source', "source = %s"),
+    ('region', "region = %s"),
+)
+
+MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+COMPRESSED_MIMETYPES = {'gzip': 'application/gzip', 'zstd': 'application/zstd'}
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst', 'none': ''}
+
+_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+
+class InvalidExportRequest(ValueError):
+    """A format, compression or filter the client got wrong"""
+
+
+class ExportBusy(Exception):
+    """This worker is already running INGEST_EXPORT_MAX_CONCURRENT exports"""
+
+
+def parse_export_args(args):
+    """(format, compression, conditions, params) from query args"""
+    fmt = args.get('format', 'ndjson').lower()
+    if fmt not in EXPORT_FORMATS:
+        raise InvalidExportRequest(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    compression = args.get('compression', 'gzip').lower()
+    if compression not in COMPRESSIONS:
+        raise InvalidExportRequest(f"compression must be one of {', '.join(COMPRESSIONS)}")
+    if compression == 'zstd' and zstandard is None:
+        raise InvalidExportRequest('zstd compression is not available on this server')
+
+    conditions = []
+    params = []
+    for arg, condition in FILTERS:
+        value = args.get(arg)
+        if value:
+            conditions.append(condition)
+            params.append(value)
+    # since/until bound created_at, which also lets PostgreSQL skip partitions
+    for arg, condition in (('since', "created_at >= %s"), ('until', "created_at < %s")):
+        value = args.get(arg)
+        if value:
+            try:
+                params.append(datetime.fromisoformat(value))
+            except ValueError:
+                raise InvalidExportRequest(f"{arg} must be an ISO 8601 timestamp")
+            conditions.append(condition)
+    return fmt, compression, conditions, params
+
+
+def export_query(fmt, conditions):
+    """SELECT for an export, oldest rows first"""
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    select = NDJSON_SELECT if fmt == 'ndjson' else CSV_SELECT
+    # The outer query only projects, so rows keep the inner order
+    return (
+        f"SELECT {select} FROM (SELECT {', '.join(COLUMNS)} FROM ingested_data {where} "
+        f"ORDER BY created_at, id) r"
+    )
+
+
+def compressor(compression):
+    """Object with compress(data) and flush() for the chosen compression"""
+    if compression == 'gzip':
+        return zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=EXPORT_ZSTD_LEVEL).compressobj()
+    return None
+
+
+def filename(fmt, compression):
+    return f"ingested_data-{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.{fmt}{EXTENSIONS[compression]}"
+
+
+def mimetype(fmt, compression):
+    return COMPRESSED_MIMETYPES.get(compression, MIMETYPES[fmt])
+
+
+def _encode_rows(fmt, rows):
+    if fmt == 'ndjson':
+        return ('\n'.join(row[0] for row in rows) + '\n').encode('utf-8')
+    out = io.StringIO()
+    csv.writer(out, lineterminator='\n').writerows(rows)
+    return out.getvalue().encode('utf-8')
+
+
+def stream_export(fmt, compression, conditions, params):
+    """Yield the export as compressed byte chunks, EXPORT_FETCH_SIZE rows at a time
+
+    Holds one of this worker's export slots and a read connection until the
+    generator finishes or is closed; raises ExportBusy when no slot is free.
+    """
+    if not _slots.acquire(blocking=False):
+        raise ExportBusy(f"{EXPORT_MAX_CONCURRENT} export(s) already running in this worker")
+    try:
+        packer = compressor(compression)
+        with db.read_connection() as conn:
+            cur = conn.cursor(name=f"export_{uuid.uuid4().hex}")
+            cur.itersize = EXPORT_FETCH_SIZE
+            cur.execute(export_query(fmt, conditions), params)
+            if fmt == 'csv':
+                header = (','.join(COLUMNS) + '\n').encode('utf-8')
+                yield packer.compress(header) if packer else header
+            while True:
+                rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                data = _encode_rows(fmt, rows)
+                if packer:
+                    data = packer.compress(data)
+                if data:
+                    yield data
+            cur.close()
+        if packer:
+            yield packer.flush()
+    finally:
+        _slots.release()
@@ -0,0 +1,114 @@
+"""
+Fast JSON
+orjson encoding and decoding when installed, the stdlib json module otherwise, and a Flask JSON provider on top
+"""
+import os
+import json
+import logging
+import dataclasses
+from uuid import UUID
+from decimal import Decimal
+from datetime import date
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+# 'auto' uses orjson when it is installed; 'stdlib' forces the json module
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto').lower()
+
+JSON_BACKENDS = ('auto', 'orjson', 'stdlib')
+
+if JSON_BACKEND not in JSON_BACKENDS:
+    logger.warning(f"Unknown JSON_BACKEND {JSON_BACKEND!r}, using auto")
+if JSON_BACKEND == 'orjson' and orjson is None:
+    logger.warning("JSON_BACKEND is orjson but orjson is not installed; using the json module")
+
+USE_ORJSON = orjson is not None and JSON_BACKEND != 'stdlib'
+BACKEND = 'orjson' if USE_ORJSON else 'stdlib'
+
+# Datetimes go through _default so both backends render them like Flask
+# does (RFC 822 dates); keys are sorted like Flask's provider
+_ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson is not None else 0
+_ORJSON_UNSORTED = orjson.OPT_PASSTHROUGH_DATETIME if orjson is not None else 0
+
+
+def _default(o):
+    """Same conversions as Flask's default JSON provider"""
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, (Decimal, UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(obj, sort_keys=True):
+    return json.dumps(obj, default=_default, sort_keys=sort_keys, separators=(',', ':'))
+
+
+def dumps_bytes(obj, sort_keys=True):
+    """Compact UTF-8 JSON, with sorted keys unless sort_keys is False"""
+    if USE_ORJSON:
+        try:
+            return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS if sort_keys else _ORJSON_UNSORTED)
+        except orjson.JSONEncodeError:
+            # Integers beyond 64 bits and non-string keys; the json module takes both
+            pass
+    return _stdlib_dumps(obj, sort_keys).encode('utf-8')
+
+
+def dumps(obj, sort_keys=True):
+    """Compact JSON text, with sorted keys unless sort_keys is False"""
+    if USE_ORJSON:
+        return dumps_bytes(obj, sort_keys).decode('utf-8')
+    return _stdlib_dumps(obj, sort_keys)
+
+
+def _reject_constant(name):
+    raise ValueError(f"{name} is not valid JSON")
+
+
+def loads(data):
+    """Decode JSON from str or UTF-8 bytes; raises ValueError on invalid input
+
+    Both backends reject NaN and Infinity, which orjson and PostgreSQL's
+    jsonb treat as invalid but the json module would accept.
+    """
+    if USE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data, parse_constant=_reject_constant)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider with dumps/loads/jsonify on the fast backend
+
+    Output matches the default provider's apart from non-ASCII text, which
+    orjson writes as UTF-8 instead of \\u escapes.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        if self._app.debug:
+            # Pretty-printed like the default provider
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,250 @@
+"""
+Idempotent Ingest
+Deduplication keys claimed with INSERT ... ON CONFLICT DO NOTHING, fronted by a per-worker cache of recent keys
+
+A record carries its own key in an "idempotency_key" field; a whole request
+can carry one in the Idempotency-Key header. Keys are claimed in
+ingest_idempotency_keys in the same transaction as the rows they guard, so
+a retry that races the original on another worker waits for it to commit
+and then finds the key taken.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+# Keys are kept in the database this long, which bounds how late a retry
+# is still recognised
+IDEMPOTENCY_RETENTION_HOURS = int(os.getenv('INGEST_IDEMPOTENCY_RETENTION_HOURS', '24'))
+IDEMPOTENCY_CACHE_SECONDS = float(os.getenv('INGEST_IDEMPOTENCY_CACHE_SECONDS', '300'))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('INGEST_IDEMPOTENCY_CACHE_SIZE', '100000'))
+
+HEADER = 'Idempotency-Key'
+RECORD_FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 200
+
+# Record and request keys share the table; the prefixes keep a record key
+# from ever matching a request key with the same text
+RECORD_PREFIX = 'r:'
+BATCH_PREFIX = 'b:'
+
+DUPLICATES = metrics.Counter(
+    'ingest_duplicates_skipped_total', 'Records skipped as repeats of an already ingested key, by where the key was found',
+    ['found_in']
+)
+
+
+def validate_key(key, name=RECORD_FIELD):
+    """Raise ValueError unless key is usable as an idempotency key"""
+    if not isinstance(key, str) or not key:
+        raise ValueError(f"{name} must be a non-empty string")
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"{name} longer than {MAX_KEY_LENGTH} characters")
+    if '\x00' in key:
+        raise ValueError(f"{name} must not contain NUL characters")
+    return key
+
+
+def record_key(record):
+    """The idempotency key of a decoded record, or None when it has none"""
+    key = record.get(RECORD_FIELD)
+    if key is None:
+        return None
+    return validate_key(key)
+
+
+class RecentKeys:
+    """Keys this worker committed in the last IDEMPOTENCY_CACHE_SECONDS, oldest first"""
+
+    def __init__(self, ttl=IDEMPOTENCY_CACHE_SECONDS, max_size=IDEMPOTENCY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            expires = self._keys.get(key)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._keys[key]
+                return False
+            return True
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, keys):
+        now = time.monotonic()
+        expires = now + self.ttl
+        with self._lock:
+            for key in keys:
+                self._keys[key] = expires
+                self._keys.move_to_end(key)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+            # Every key expires after the ones added before it
+            while self._keys:
+                oldest = next(iter(self._keys))
+                if self._keys[oldest] >= now:
+                    break
+                del self._keys[oldest]
+
+
+recent_keys = RecentKeys()
+
+
+def claim_keys(cur, keys):
+    """Insert keys inside the caller's transaction; returns the set of those that were new
+
+    Keys are inserted in sorted order so two transactions claiming
+    overlapping keys can never deadlock.
+    """
+    if not keys:
+        return set()
+    # A plain cursor on the same connection, whatever the caller's cursor factory
+    cur = cur.connection.cursor()
+    cur.execute(
+        """
+        INSERT INTO ingest_idempotency_keys (idempotency_key)
+        SELECT key FROM unnest(%s::text[]) AS key
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING idempotency_key
+        """,
+        (sorted(keys),)
+    )
+    claimed = {row[0] for row in cur.fetchall()}
+    cur.close()
+    return claimed
+
+
+def prune_keys(cur, limit):
+    """Delete up to limit keys past their retention, oldest first; returns how many
+
+    Run by the maintenance thread in its own transaction, never inside an
+    ingest request's.
+    """
+    cur.execute(
+        """
+        DELETE FROM ingest_idempotency_keys
+        WHERE idempotency_key IN (
+            SELECT idempotency_key FROM ingest_idempotency_keys
+            WHERE created_at < LOCALTIMESTAMP - make_interval(hours => %s)
+            ORDER BY created_at
+            LIMIT %s
+        )
+        """,
+        (IDEMPOTENCY_RETENTION_HOURS, limit)
+    )
+    return cur.rowcount
+
+
+class Deduplicator:
+    """Filters the (key, row) entries of one request down to those not ingested before
+
+    screen() drops repeats within the request and keys in this worker's
+    recent-key cache without touching the database; claim() then claims
+    the remaining keys inside the caller's transaction. Call committed()
+    after the transaction commits so later retries stop at the cache.
+    """
+
+    def __init__(self, batch_key=None):
+        self.batch_key = BATCH_PREFIX + batch_key if batch_key else None
+        # Where the request key was found, once it was: the whole request is a repeat
+        self.duplicate_batch = None
+        self.skipped = 0
+        self._batch_claimed = False
+        self._seen = set()
+        self._accepted = set()
+
+    def _skip(self, count, found_in):
+        if count:
+            self.skipped += count
+            DUPLICATES.labels(found_in).inc(count)
+
+    def screen(self, entries):
+        """Entries whose keys are neither repeated in this request nor recently committed here"""
+        if self.batch_key is not None and self.duplicate_batch is None and self.batch_key in recent_keys:
+            self.duplicate_batch = 'cache'
+        if self.duplicate_batch is not None:
+            self._skip(len(entries), self.duplicate_batch)
+            return []
+        if self.batch_key is not None:
+            self._accepted.add(self.batch_key)
+
+        kept = []
+        for key, row in entries:
+            if key is not None:
+                key = RECORD_PREFIX + key
+                if key in self._seen:
+                    self._skip(1, 'request')
+                    continue
+                self._seen.add(key)
+                if key in recent_keys:
+                    self._skip(1, 'cache')
+                    continue
+                self._accepted.add(key)
+            kept.append((key, row))
+        return kept
+
+    def claim(self, cur, entries):
+        """Screened entries whose keys this transaction claimed first"""
+        return claim_together(cur, [(self, entries)])[0]
+
+    def select(self, cur, entries):
+        """screen() then, when there is a cursor, claim()"""
+        entries = self.screen(entries)
+        if cur is None or not entries:
+            return entries
+        return self.claim(cur, entries)
+
+    def committed(self):
+        """Remember the keys of the committed entries in this worker's cache"""
+        recent_keys.add(self._accepted)
+        self._accepted = set()
+
+
+def claim_together(cur, requests):
+    """Deduplicator.claim() for several requests in one transaction, in two statements
+
+    requests is a list of (deduplicator, screened entries); returns the kept
+    entries of each. Request keys are claimed before record keys, so a
+    repeated request never claims its records' keys. When requests share a
+    key, the earliest in the list wins.
+    """
+    pending = [d for d, _ in requests if d.batch_key is not None and not d._batch_claimed and d.duplicate_batch is None]
+    claimed = claim_keys(cur, {d.batch_key for d in pending})
+    taken = set()
+    for d in pending:
+        d._batch_claimed = True
+        if d.batch_key not in claimed or d.batch_key in taken:
+            d.duplicate_batch = 'database'
+            d._accepted.clear()
+        taken.add(d.batch_key)
+
+    claimed = claim_keys(cur, {
+        key for d, entries in requests if d.duplicate_batch is None for key, _ in entries if key is not None
+    })
+    kept = []
+    for d, entries in requests:
+        if d.duplicate_batch is not None:
+            d._skip(len(entries), d.duplicate_batch)
+            kept.append([])
+            continue
+        rows = []
+        for key, row in entries:
+            if key is not None:
+                if key not in claimed or key in taken:
+                    d._accepted.discard(key)
+                    d._skip(1, 'database')
+                    continue
+                taken.add(key)
+            rows.append((key, row))
+        kept.append(rows)
+    return kept
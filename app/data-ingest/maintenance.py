@@ -0,0 +1,97 @@
+"""
+Background Maintenance
+Per-worker thread that keeps ingested_data partitions current and prunes expired rows off the request path
+"""
+import os
+import time
+import logging
+import threading
+import db
+import idempotency
+import partitions
+import stats
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+PRUNE_INTERVAL = float(os.getenv('INGEST_PRUNE_INTERVAL', '600'))
+PRUNE_BATCH_SIZE = int(os.getenv('INGEST_PRUNE_BATCH_SIZE', '5000'))
+
+# Only one worker in the cluster prunes a table at a time
+PRUNE_LOCK_KEY = 'ingest_retention_prune'
+
+# (name, delete(cur, limit) -> rows deleted) of every table pruned by retention
+PRUNERS = (
+    ('ingest_idempotency_keys', idempotency.prune_keys),
+    ('ingest_stats_minutely', stats.prune_minutely),
+)
+
+
+def prune(name, delete, batch_size=PRUNE_BATCH_SIZE):
+    """Run delete in short transactions of at most batch_size rows until none are left
+
+    Each batch takes the table's advisory lock; when another worker holds
+    it, that worker is already pruning and this one stops. Returns the
+    number of rows deleted.
+    """
+    removed = 0
+    while True:
+        with db.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", (f"{PRUNE_LOCK_KEY}:{name}",))
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                return removed
+            count = delete(cur, batch_size)
+            conn.commit()
+            cur.close()
+        removed += count
+        if count < batch_size:
+            return removed
+
+
+def run_pruning():
+    """Delete expired rows from every pruned table; returns {table: rows deleted}"""
+    removed = {name: prune(name, delete) for name, delete in PRUNERS}
+    if any(removed.values()):
+        logger.info(f"Retention pruning deleted {removed}")
+    return removed
+
+
+_thread = None
+_thread_pid = None
+_thread_lock = threading.Lock()
+
+
+def _maintenance_loop():
+    next_partitions = next_prune = time.monotonic()
+    while True:
+        if partitions.PARTITIONING and time.monotonic() >= next_partitions:
+            try:
+                partitions.run_maintenance()
+            except Exception as e:
+                logger.error(f"Partition maintenance failed: {e}")
+            next_partitions = time.monotonic() + partitions.MAINTENANCE_INTERVAL
+        if time.monotonic() >= next_prune:
+            try:
+                run_pruning()
+            except Exception as e:
+                logger.error(f"Retention pruning failed: {e}")
+            next_prune = time.monotonic() + PRUNE_INTERVAL
+        due = min(next_partitions, next_prune) if partitions.PARTITIONING else next_prune
+        time.sleep(max(due - time.monotonic(), 1.0))
+
+
+def start():
+    """Start this worker's maintenance thread"""
+    global _thread, _thread_pid
+    if partitions.PARTITIONING and partitions.PARTITION_INTERVAL not in partitions.PARTITION_INTERVALS:
+        raise partitions.PartitionError(
+            f"INGEST_PARTITION_INTERVAL must be one of {', '.join(partitions.PARTITION_INTERVALS)}"
+        )
+    with _thread_lock:
+        if _thread is not None and _thread_pid == os.getpid():
+            return
+        _thread = threading.Thread(target=_maintenance_loop, name='ingest-maintenance', daemon=True)
+        _thread_pid = os.getpid()
+        _thread.start()
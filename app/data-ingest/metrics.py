@@ -0,0 +1,528 @@
+"""
+Prometheus Metrics
+Counters, gauges and histograms kept in per-worker memory-mapped files and summed across workers on scrape
+"""
+import os
+import re
+import json
+import mmap
+import time
+import fcntl
+import bisect
+import struct
+import logging
+import tempfile
+import threading
+from flask import g, request
+import db
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'on').lower() in ('on', 'true', '1')
+METRICS_DIR = os.getenv(
+    'METRICS_DIR',
+    os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'metrics')
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers sub-millisecond queries up to slow bulk requests
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Worker files start this large and double as new label sets appear
+INITIAL_FILE_BYTES = 64 * 1024
+
+# Counter and histogram samples of exited workers are folded into this
+# file, so pod-wide totals never go down when gunicorn replaces a worker
+ARCHIVE_FILE = 'archive.db'
+ARCHIVE_LOCK_FILE = 'archive.lock'
+
+_U32 = struct.Struct('<I')
+_F64 = struct.Struct('<d')
+
+_registry = {}
+
+
+class ValueFile:
+    """One worker's samples: a u32 used-bytes header, then [u32 key length][key][f64 value] entries
+
+    Only the owning worker writes its file. Its threads serialise on a
+    per-process lock, so concurrent increments are never lost and a resize
+    never happens under a write.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        self._capacity = INITIAL_FILE_BYTES
+        os.ftruncate(self._fd, self._capacity)
+        self._map = mmap.mmap(self._fd, self._capacity)
+        self._used = 8
+        _U32.pack_into(self._map, 0, self._used)
+        self._offsets = {}
+        self._lock = threading.Lock()
+
+    def _allocate(self, key):
+        """Append an entry for key; the caller holds the lock"""
+        encoded = key.encode('utf-8')
+        # Keep every value 8-byte aligned
+        value_at = (self._used + 4 + len(encoded) + 7) // 8 * 8
+        end = value_at + 8
+        while end > self._capacity:
+            self._capacity *= 2
+            os.ftruncate(self._fd, self._capacity)
+            self._map.resize(self._capacity)
+        _U32.pack_into(self._map, self._used, len(encoded))
+        self._map[self._used + 4:self._used + 4 + len(encoded)] = encoded
+        _F64.pack_into(self._map, value_at, 0.0)
+        self._used = end
+        # Publish the entry only once it is complete
+        _U32.pack_into(self._map, 0, self._used)
+        self._offsets[key] = value_at
+        return value_at
+
+    def add(self, key, amount):
+        with self._lock:
+            offset = self._offsets.get(key)
+            if offset is None:
+                offset = self._allocate(key)
+            _F64.pack_into(self._map, offset, _F64.unpack_from(self._map, offset)[0] + amount)
+
+    def set(self, key, value):
+        with self._lock:
+            offset = self._offsets.get(key)
+            if offset is None:
+                offset = self._allocate(key)
+            _F64.pack_into(self._map, offset, value)
+
+
+def read_values(path):
+    """{key: value} from a worker file"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    values = {}
+    if len(data) < 8:
+        return values
+    used = min(_U32.unpack_from(data, 0)[0], len(data))
+    position = 8
+    while position + 4 <= used:
+        length = _U32.unpack_from(data, position)[0]
+        key = data[position + 4:position + 4 + length].decode('utf-8')
+        value_at = (position + 4 + length + 7) // 8 * 8
+        if value_at + 8 > used:
+            break
+        values[key] = _F64.unpack_from(data, value_at)[0]
+        position = value_at + 8
+    return values
+
+
+def pack_values(values):
+    """Bytes in the value file format for {key: value}"""
+    data = bytearray(8)
+    for key, value in values.items():
+        encoded = key.encode('utf-8')
+        data += _U32.pack(len(encoded)) + encoded
+        data += bytes(-len(data) % 8)
+        data += _F64.pack(value)
+    _U32.pack_into(data, 0, len(data))
+    return bytes(data)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Discard:
+    """Stands in for the value file when metrics are disabled"""
+
+    def add(self, key, amount):
+        pass
+
+    def set(self, key, value):
+        pass
+
+
+_DISCARD = _Discard()
+_file = None
+_file_lock = threading.Lock()
+_directory = METRICS_DIR
+
+
+def configure(service):
+    """Keep this service's worker files in their own subdirectory of METRICS_DIR"""
+    global _directory
+    _directory = os.path.join(METRICS_DIR, service)
+
+
+def _worker_files(directory):
+    """(pid, path) of every worker value file in directory"""
+    for name in os.listdir(directory):
+        pid = name.partition('.')[0]
+        if name.endswith('.db') and pid.isdigit():
+            yield int(pid), os.path.join(directory, name)
+
+
+class _ArchiveLock:
+    """flock on the archive: shared while summing, exclusive while folding"""
+
+    def __init__(self, directory, operation):
+        self.path = os.path.join(directory, ARCHIVE_LOCK_FILE)
+        self.operation = operation
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, self.operation)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+
+
+def _read_archive(directory):
+    try:
+        return read_values(os.path.join(directory, ARCHIVE_FILE))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def fold_exited(directory):
+    """Add the counters and histograms of exited workers to the archive and remove their files
+
+    Gauges of exited workers are dropped. A file carrying this process's
+    pid belongs to an earlier process that had the same pid.
+    """
+    gauges = {metric.name for metric in _registry.values() if metric.type == 'gauge'}
+    with _ArchiveLock(directory, fcntl.LOCK_EX):
+        exited = [path for pid, path in _worker_files(directory) if pid == os.getpid() or not _alive(pid)]
+        if not exited:
+            return
+        archive = _read_archive(directory)
+        for path in exited:
+            try:
+                values = read_values(path)
+            except (FileNotFoundError, ValueError):
+                continue
+            for key, value in values.items():
+                if key[:key.find('[')] not in gauges:
+                    archive[key] = archive.get(key, 0.0) + value
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pack_values(archive))
+            # Summing readers hold the shared lock, so they see the archive
+            # and the worker files either all before or all after the fold
+            os.replace(tmp, os.path.join(directory, ARCHIVE_FILE))
+        except Exception:
+            os.unlink(tmp)
+            raise
+        for path in exited:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+def _values():
+    """This worker's value file, created on first use"""
+    global _file
+    if _file is not None:
+        return _file
+    if not METRICS_ENABLED:
+        return _DISCARD
+    with _file_lock:
+        if _file is None:
+            os.makedirs(_directory, exist_ok=True)
+            try:
+                fold_exited(_directory)
+            except OSError as e:
+                # Unfolded files are still summed on scrape, just not compacted
+                logger.warning(f"Could not archive metrics of exited workers: {e}")
+            _file = ValueFile(os.path.join(_directory, f"{os.getpid()}.db"))
+        return _file
+
+
+def _reset_after_fork():
+    # A forked worker must not write into its parent's file
+    global _file, _file_lock
+    _file = None
+    _file_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _key(sample, values):
+    return sample + json.dumps(values)
+
+
+class _Child:
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+
+class CounterChild(_Child):
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        _values().add(self.key, amount)
+
+
+class GaugeChild(_Child):
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        _values().add(self.key, amount)
+
+    def dec(self, amount=1):
+        _values().add(self.key, -amount)
+
+    def set(self, value):
+        _values().set(self.key, value)
+
+
+class HistogramChild:
+    __slots__ = ('bounds', 'bucket_keys', 'sum_key', 'count_key')
+
+    def __init__(self, name, values, bounds):
+        self.bounds = bounds
+        self.bucket_keys = [_key(f"{name}_bucket", values + [_format_bound(b)]) for b in bounds] + \
+            [_key(f"{name}_bucket", values + ['+Inf'])]
+        self.sum_key = _key(f"{name}_sum", values)
+        self.count_key = _key(f"{name}_count", values)
+
+    def observe(self, value):
+        values = _values()
+        values.add(self.bucket_keys[bisect.bisect_left(self.bounds, value)], 1)
+        values.add(self.sum_key, value)
+        values.add(self.count_key, 1)
+
+
+def _format_bound(bound):
+    return repr(float(bound))
+
+
+class Metric:
+    """A named metric; labels(*values) returns a cached child, so hot paths allocate nothing per update"""
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        _registry[name] = self
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._make_child([str(value) for value in values])
+                    self._children[values] = child
+        return child
+
+    def samples(self):
+        """Sample names this metric writes"""
+        return (self.name,)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _make_child(self, values):
+        return CounterChild(_key(self.name, values))
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class Gauge(Metric):
+    """Summed over live workers; gauges of exited workers are dropped, unlike counters and histograms"""
+    type = 'gauge'
+
+    def _make_child(self, values):
+        return GaugeChild(_key(self.name, values))
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _make_child(self, values):
+        return HistogramChild(self.name, values, self.bounds)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def samples(self):
+        return (f"{self.name}_bucket", f"{self.name}_sum", f"{self.name}_count")
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def collect():
+    """{sample key: value} summed over the archive and every worker file"""
+    owners = {sample: metric for metric in _registry.values() for sample in metric.samples()}
+    totals = {}
+    if not os.path.isdir(_directory):
+        return totals
+    with _ArchiveLock(_directory, fcntl.LOCK_SH):
+        sources = [(True, _read_archive(_directory))]
+        for pid, path in _worker_files(_directory):
+            try:
+                sources.append((_alive(pid), read_values(path)))
+            except (FileNotFoundError, ValueError):
+                continue
+    for alive, values in sources:
+        for key, value in values.items():
+            metric = owners.get(key[:key.find('[')])
+            if metric is None or (metric.type == 'gauge' and not alive):
+                continue
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+def exposition():
+    """All metrics in the Prometheus text format, aggregated across this host's workers"""
+    totals = collect()
+    by_sample = {}
+    for key, value in totals.items():
+        split = key.find('[')
+        by_sample.setdefault(key[:split], []).append((json.loads(key[split:]), value))
+
+    lines = []
+    for metric in _registry.values():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        if metric.type != 'histogram':
+            for values, value in sorted(by_sample.get(metric.name, [])):
+                lines.append(f"{metric.name}{_labels_text(metric.labelnames, values)} {_format_value(value)}")
+            continue
+
+        # Buckets are stored per bucket and exposed cumulatively
+        buckets = {}
+        for values, value in by_sample.get(f"{metric.name}_bucket", []):
+            buckets.setdefault(tuple(values[:-1]), {})[values[-1]] = value
+        sums = {tuple(values): value for values, value in by_sample.get(f"{metric.name}_sum", [])}
+        counts = {tuple(values): value for values, value in by_sample.get(f"{metric.name}_count", [])}
+        names = metric.labelnames + ('le',)
+        for values in sorted(counts):
+            cumulative = 0.0
+            for bound in [_format_bound(b) for b in metric.bounds] + ['+Inf']:
+                cumulative += buckets.get(values, {}).get(bound, 0.0)
+                lines.append(
+                    f"{metric.name}_bucket{_labels_text(names, list(values) + [bound])} {_format_value(cumulative)}"
+                )
+            labels = _labels_text(metric.labelnames, values)
+            lines.append(f"{metric.name}_sum{labels} {_format_value(sums.get(values, 0.0))}")
+            lines.append(f"{metric.name}_count{labels} {_format_value(counts[values])}")
+    return '\n'.join(lines) + '\n'
+
+
+# Metrics every service exposes
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by route template and method',
+    ['route', 'method']
+)
+REQUESTS = Counter('http_requests_total', 'Requests served, by route template, method and status', ['route', 'method', 'status'])
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', 'Requests being handled')
+DB_QUERY_DURATION = Histogram(
+    'db_query_duration_seconds', 'PostgreSQL statement execution time, by statement type and table', ['statement']
+)
+
+_VERB = re.compile(r"\s*(\w+)(?:\s+(\w+))?")
+_TARGET = re.compile(r"\b(?:FROM|INTO)\s+(\w+)", re.IGNORECASE)
+
+
+def statement_label(sql):
+    """'select users', 'insert orders', 'commit', ... from the head of a statement"""
+    head = sql[:200]
+    if isinstance(head, bytes):
+        head = head.decode('utf-8', 'replace')
+    match = _VERB.match(head)
+    if match is None:
+        return 'other'
+    verb = match.group(1).lower()
+    if verb in ('update', 'copy'):
+        table = match.group(2)
+    elif verb in ('select', 'insert', 'delete', 'with', 'declare'):
+        target = _TARGET.search(head)
+        table = target.group(1) if target else None
+    else:
+        return verb
+    return f"{verb} {table.lower()}" if table else verb
+
+
+def observe_query(sql, seconds):
+    DB_QUERY_DURATION.labels(statement_label(sql)).observe(seconds)
+
+
+def observe_request(route, method, status, seconds):
+    REQUEST_DURATION.labels(route, method).observe(seconds)
+    REQUESTS.labels(route, method, status).inc()
+
+
+def instrument(app, service):
+    """Time every request of a Flask app by its route template"""
+    configure(service)
+    if not METRICS_ENABLED:
+        return
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def _observe(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            observe_request(route, request.method, response.status_code, time.perf_counter() - started)
+            REQUESTS_IN_FLIGHT.dec()
+        return response
+
+    @app.teardown_request
+    def _finish(exc):
+        # after_request is skipped when a view raises
+        if g.pop('metrics_started', None) is not None:
+            REQUESTS_IN_FLIGHT.dec()
+
+
+if METRICS_ENABLED:
+    db.add_query_observer(observe_query)
@@ -0,0 +1,192 @@
+"""
+Ingested Data Partition Maintenance
+Creates time-range partitions of ingested_data ahead of time and drops expired ones
+"""
+import os
+import re
+import logging
+from datetime import datetime, timedelta
+import db
+import stats
+import response_cache
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+PARTITIONING = os.getenv('INGEST_PARTITIONING', 'off').lower() in ('on', 'true', '1')
+PARTITION_INTERVAL = os.getenv('INGEST_PARTITION_INTERVAL', 'day').lower()
+PARTITION_PREMAKE = int(os.getenv('INGEST_PARTITION_PREMAKE', '7'))
+RETENTION_DAYS = int(os.getenv('INGEST_RETENTION_DAYS', '0'))
+MAINTENANCE_INTERVAL = float(os.getenv('INGEST_PARTITION_MAINTENANCE_INTERVAL', '3600'))
+
+PARTITION_INTERVALS = ('day', 'week', 'month')
+PARENT_TABLE = 'ingested_data'
+
+# Only one worker in the cluster runs maintenance at a time
+MAINTENANCE_LOCK_KEY = 'ingested_data_partition_maintenance'
+
+# Partition DDL must not queue ingest traffic behind it for long
+DDL_LOCK_TIMEOUT = '5s'
+
+_BOUND_PATTERN = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+class PartitionError(Exception):
+    """Partition maintenance cannot run"""
+
+
+def period_start(ts, interval=PARTITION_INTERVAL):
+    """Start of the partition period containing ts"""
+    day = datetime(ts.year, ts.month, ts.day)
+    if interval == 'day':
+        return day
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    return datetime(ts.year, ts.month, 1)
+
+
+def next_period(start, interval=PARTITION_INTERVAL):
+    """Start of the period following the one that starts at start"""
+    if interval == 'day':
+        return start + timedelta(days=1)
+    if interval == 'week':
+        return start + timedelta(days=7)
+    if start.month == 12:
+        return datetime(start.year + 1, 1, 1)
+    return datetime(start.year, start.month + 1, 1)
+
+
+def _parse_bound(value):
+    value = value.strip()
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return value
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def is_partitioned(cur):
+    """True when ingested_data uses the partitioned layout"""
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (PARENT_TABLE,))
+    row = cur.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def list_partitions(cur):
+    """(name, lower, upper) of each range partition, oldest first"""
+    cur.execute(
+        """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        """,
+        (PARENT_TABLE,)
+    )
+    partitions = []
+    for name, bound in cur.fetchall():
+        match = _BOUND_PATTERN.search(bound or '')
+        if not match:
+            # DEFAULT partition
+            continue
+        partitions.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    partitions.sort(key=lambda p: datetime.min if p[1] == 'MINVALUE' else p[1])
+    return partitions
+
+
+def ensure_partitions(cur, now, interval=PARTITION_INTERVAL, premake=PARTITION_PREMAKE):
+    """Create partitions from the newest existing bound up to premake periods ahead"""
+    partitions = list_partitions(cur)
+    if any(upper == 'MAXVALUE' for _, _, upper in partitions):
+        return []
+    uppers = [upper for _, _, upper in partitions if isinstance(upper, datetime)]
+    start = max(uppers) if uppers else period_start(now, interval)
+
+    horizon = period_start(now, interval)
+    for _ in range(premake + 1):
+        horizon = next_period(horizon, interval)
+
+    created = []
+    while start < horizon:
+        # Partitions end on period boundaries even if the first one starts mid-period
+        end = next_period(period_start(start, interval), interval)
+        name = f"{PARENT_TABLE}_p{start:%Y%m%d}"
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} "
+            "FOR VALUES FROM (%s) TO (%s)",
+            (start, end)
+        )
+        created.append(name)
+        start = end
+    return created
+
+
+def drop_expired_partitions(cur, now, retention_days=RETENTION_DAYS):
+    """Drop partitions whose newest possible row is older than the retention
+
+    Their rows are subtracted from the stats rollups in the same transaction,
+    so the rollups keep matching the table.
+    """
+    if retention_days <= 0:
+        return []
+    cutoff = now - timedelta(days=retention_days)
+    dropped = []
+    for name, _, upper in list_partitions(cur):
+        if isinstance(upper, datetime) and upper <= cutoff:
+            stats.record_removal(cur, name)
+            cur.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+    return dropped
+
+
+def run_maintenance():
+    """Create upcoming partitions and drop expired ones; returns what changed"""
+    with db.connection() as conn:
+        cur = conn.cursor()
+        if not is_partitioned(cur):
+            raise PartitionError(f"{PARENT_TABLE} is not partitioned; run partition-ingested-data.sql")
+        cur.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", (MAINTENANCE_LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return None
+        cur.execute(f"SET LOCAL lock_timeout = '{DDL_LOCK_TIMEOUT}'")
+        cur.execute("SELECT LOCALTIMESTAMP")
+        now = cur.fetchone()[0]
+        created = ensure_partitions(cur, now)
+        dropped = drop_expired_partitions(cur, now)
+        conn.commit()
+        cur.close()
+
+    if dropped:
+        response_cache.invalidate(stats.CACHE_TAG)
+    if created or dropped:
+        logger.info(f"Partition maintenance created {created} dropped {dropped}")
+    return {'created': created, 'dropped': dropped}
+
+
+def partition_summary():
+    """Partitions of ingested_data with their bounds and estimated sizes"""
+    with db.connection() as conn:
+        cur = conn.cursor()
+        if not is_partitioned(cur):
+            return {'partitioned': False, 'partitions': []}
+        partitions = list_partitions(cur)
+        cur.execute(
+            "SELECT relname, reltuples::bigint FROM pg_class WHERE relname = ANY(%s)",
+            ([name for name, _, _ in partitions],)
+        )
+        estimates = dict(cur.fetchall())
+        cur.close()
+    return {
+        'partitioned': True,
+        'interval': PARTITION_INTERVAL,
+        'retention_days': RETENTION_DAYS,
+        'partitions': [
+            {
+                'name': name,
+                'from': lower if isinstance(lower, str) else lower.isoformat(),
+                'to': upper if isinstance(upper, str) else upper.isoformat(),
+                'estimated_rows': max(estimates.get(name, 0), 0),
+            }
+            for name, lower, upper in partitions
+        ],
+    }
+
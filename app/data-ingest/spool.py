@@ -0,0 +1,556 @@
+"""
+Ingest Spool
+Durable local write-behind spool for accept-then-persist ingestion
+
+Records are appended to segment files in the COPY text format and drained to
+ingested_data by a background flusher. Sequence ids are logical byte offsets
+in the spool log: an acknowledged append returns the offset at which it ends,
+and it is persisted once the committed offset has reached that value.
+"""
+import os
+import io
+import time
+import uuid
+import fcntl
+import atexit
+import socket
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import errors
+import db
+from collections import Counter
+from copy_ingest import COPY_SQL, copy_unescape
+import stats
+import response_cache
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+SPOOL_DIR = os.getenv('INGEST_SPOOL_DIR', '/var/spool/data-ingest')
+SPOOL_FSYNC = os.getenv('INGEST_SPOOL_FSYNC', 'interval').lower()
+SPOOL_FSYNC_INTERVAL = float(os.getenv('INGEST_SPOOL_FSYNC_INTERVAL', '1'))
+SPOOL_SEGMENT_BYTES = int(os.getenv('INGEST_SPOOL_SEGMENT_BYTES', str(16 * 1024 * 1024)))
+SPOOL_FLUSH_INTERVAL = float(os.getenv('INGEST_SPOOL_FLUSH_INTERVAL', '0.5'))
+SPOOL_FLUSH_MAX_BYTES = int(os.getenv('INGEST_SPOOL_FLUSH_MAX_BYTES', str(8 * 1024 * 1024)))
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+SEGMENT_SUFFIX = '.seg'
+COPY_BUFFER_BYTES = 1024 * 1024
+
+# How long a worker that is not the flusher waits before trying to take over
+FLUSHER_RETRY_SECONDS = 5
+# Backoff after a failed flush, e.g. while the database is failing over
+FLUSH_ERROR_BACKOFF_SECONDS = 2
+
+# Errors caused by the row itself, which no retry can fix: these rows are
+# isolated into the dead-letter file instead of blocking the spool
+ROW_ERRORS = (
+    errors.InvalidTextRepresentation,
+    errors.NumericValueOutOfRange,
+    errors.StringDataRightTruncation,
+    errors.UntranslatableCharacter,
+    errors.CharacterNotInRepertoire,
+    errors.UniqueViolation,
+)
+# Other data and integrity errors may come from the schema rather than the
+# row (no partition for created_at yet is a CheckViolation): the row and
+# those after it stay pending and are retried. Connection errors are retried too
+BATCH_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+
+
+class SpoolError(Exception):
+    """The spool cannot accept records"""
+
+
+class SpoolBatch:
+    """Rows staged in a temporary file and appended to the log in one step"""
+
+    def __init__(self, spool):
+        self.spool = spool
+        self.rows = 0
+        self._file = tempfile.TemporaryFile(dir=spool.directory)
+
+    def write(self, text, rows, counts=None):
+        self._file.write(text.encode('utf-8'))
+        self.rows += rows
+
+    def commit(self):
+        """Append the staged rows to the log and return their sequence id"""
+        self._file.flush()
+        self._file.seek(0)
+        try:
+            return self.spool._append_from(self._file, self.rows)
+        finally:
+            self.discard()
+
+    def discard(self):
+        self._file.close()
+
+
+class Spool:
+    """Append-only segment log shared by the gunicorn workers of one pod"""
+
+    def __init__(self, directory=SPOOL_DIR, fsync=SPOOL_FSYNC, segment_bytes=SPOOL_SEGMENT_BYTES):
+        if fsync not in FSYNC_POLICIES:
+            raise SpoolError(f"INGEST_SPOOL_FSYNC must be one of {', '.join(FSYNC_POLICIES)}")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self._lock_fd = os.open(os.path.join(directory, 'spool.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            raise SpoolError(f"spool directory {directory} is not usable: {e}")
+
+        self.directory = directory
+        self.fsync = fsync
+        self.segment_bytes = segment_bytes
+
+        # flock() only excludes other processes; threads need their own lock
+        self._thread_lock = threading.Lock()
+        self._segment_fd = None
+        self._segment_base = None
+        self._dirty = False
+        self._last_fsync = time.monotonic()
+
+        self._flush_lock_fd = None
+        self._committed = None
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._appended_records = 0
+        self._appended_bytes = 0
+        self._flushed_records = 0
+        self._flushed_batches = 0
+        self._flush_errors = 0
+        self._dead_lettered = 0
+        self._last_flush_at = None
+
+        self.spool_id = self._load_spool_id()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _locked(self):
+        """Hold the spool lock across threads and worker processes"""
+        with self._thread_lock:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _load_spool_id(self):
+        """Read or create the id that keys this spool's offset in the database"""
+        path = self._path('spool.id')
+        with self._locked():
+            if not os.path.exists(path):
+                write_state_file(path, f"{socket.gethostname()}-{uuid.uuid4().hex[:12]}")
+            with open(path) as f:
+                return f.read().strip()
+
+    def _segments(self):
+        """Sorted (base_offset, path) of all segment files"""
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                try:
+                    segments.append((int(name[:-len(SEGMENT_SUFFIX)]), self._path(name)))
+                except ValueError:
+                    continue
+        segments.sort()
+        return segments
+
+    def _segment_path(self, base):
+        return self._path(f"{base:020d}{SEGMENT_SUFFIX}")
+
+    def _open_segment(self, base):
+        if self._segment_fd is not None:
+            if self._dirty:
+                os.fdatasync(self._segment_fd)
+            os.close(self._segment_fd)
+            self._segment_fd = None
+        self._segment_fd = os.open(self._segment_path(base), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self._segment_base = base
+
+    def _active_segment(self):
+        """Return (fd, base, size) of the segment to append to; caller holds the lock"""
+        if self._segment_fd is not None:
+            st = os.fstat(self._segment_fd)
+            # A full or deleted segment has been rolled over, possibly by another worker
+            if st.st_nlink and st.st_size < self.segment_bytes:
+                return self._segment_fd, self._segment_base, self._repair_tail(st.st_size)
+
+        segments = self._segments()
+        base = segments[-1][0] if segments else 0
+        self._open_segment(base)
+        size = self._repair_tail(os.fstat(self._segment_fd).st_size)
+        if size >= self.segment_bytes:
+            # Next segment starts where this one ends so offsets stay contiguous
+            base += size
+            self._open_segment(base)
+            size = 0
+        return self._segment_fd, base, size
+
+    def _repair_tail(self, size):
+        """Drop a partial line left by a worker that died mid-append"""
+        fd = self._segment_fd
+        if not size or os.pread(fd, 1, size - 1) == b'\n':
+            return size
+        end = size
+        while end > 0:
+            start = max(end - COPY_BUFFER_BYTES, 0)
+            cut = os.pread(fd, end - start, start).rfind(b'\n')
+            if cut >= 0:
+                end = start + cut + 1
+                break
+            end = start
+        logger.warning(f"Truncating torn spool segment {self._segment_base} from {size} to {end} bytes")
+        os.ftruncate(fd, end)
+        return end
+
+    def _write_locked(self, fd, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+
+    def _finish_append(self, fd, base, size, nbytes, rows):
+        """Apply the fsync policy and return the sequence id; caller holds the lock"""
+        if self.fsync == 'always':
+            os.fdatasync(fd)
+        else:
+            self._dirty = True
+        self._appended_records += rows
+        self._appended_bytes += nbytes
+        return base + size + nbytes
+
+    def append(self, text, rows):
+        """Append COPY-formatted rows and return their sequence id"""
+        data = text.encode('utf-8')
+        with self._locked():
+            fd, base, size = self._active_segment()
+            self._write_locked(fd, data)
+            return self._finish_append(fd, base, size, len(data), rows)
+
+    def _append_from(self, f, rows):
+        with self._locked():
+            fd, base, size = self._active_segment()
+            nbytes = 0
+            while True:
+                data = f.read(COPY_BUFFER_BYTES)
+                if not data:
+                    break
+                self._write_locked(fd, data)
+                nbytes += len(data)
+            return self._finish_append(fd, base, size, nbytes, rows)
+
+    def batch(self):
+        """Stage rows for a single atomic append"""
+        return SpoolBatch(self)
+
+    def sync(self):
+        """fsync pending appends for the interval policy"""
+        with self._thread_lock:
+            if not self._dirty or self._segment_fd is None:
+                return
+            self._dirty = False
+            fd = self._segment_fd
+            os.fdatasync(fd)
+            self._last_fsync = time.monotonic()
+
+    def committed_offset(self):
+        """Offset up to which records are persisted in the database"""
+        try:
+            with open(self._path('committed')) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def log_end_offset(self):
+        """Offset just past the last appended record"""
+        segments = self._segments()
+        if not segments:
+            return 0
+        base, path = segments[-1]
+        try:
+            return base + os.path.getsize(path)
+        except FileNotFoundError:
+            return base
+
+    def status(self, sequence):
+        """Persistence status of an acknowledged sequence id"""
+        committed = self.committed_offset()
+        end = self.log_end_offset()
+        return {
+            'sequence': sequence,
+            'known': sequence <= max(end, committed),
+            'persisted': sequence <= committed,
+            'committed_offset': committed,
+            'log_end_offset': end,
+        }
+
+    # Flusher
+
+    def start(self):
+        """Start the background fsync/flush thread for this worker"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='spool-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        try:
+            self.sync()
+        except OSError as e:
+            logger.error(f"Spool fsync on shutdown failed: {e}")
+
+    def _try_become_flusher(self):
+        """Only one worker per spool directory drains it"""
+        fd = os.open(self._path('flush.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._flush_lock_fd = fd
+        self._committed = None
+        logger.info(f"Worker {os.getpid()} is draining spool {self.spool_id}")
+        return True
+
+    def _run(self):
+        next_flusher_attempt = 0.0
+        while not self._stop.is_set():
+            delay = SPOOL_FLUSH_INTERVAL
+            try:
+                if self.fsync == 'interval' and time.monotonic() - self._last_fsync >= SPOOL_FSYNC_INTERVAL:
+                    self.sync()
+                if self._flush_lock_fd is None and time.monotonic() >= next_flusher_attempt:
+                    if not self._try_become_flusher():
+                        next_flusher_attempt = time.monotonic() + FLUSHER_RETRY_SECONDS
+                if self._flush_lock_fd is not None and self.flush_once():
+                    delay = 0
+            except Exception as e:
+                self._flush_errors += 1
+                logger.error(f"Spool flush failed: {e}")
+                delay = FLUSH_ERROR_BACKOFF_SECONDS
+            if delay:
+                self._stop.wait(min(delay, SPOOL_FSYNC_INTERVAL))
+
+    def _load_committed(self, cur):
+        cur.execute(
+            "SELECT committed_offset FROM ingest_spool_offsets WHERE spool_id = %s",
+            (self.spool_id,)
+        )
+        row = cur.fetchone()
+        committed = row[0] if row else 0
+        write_state_file(self._path('committed'), str(committed))
+        return committed
+
+    def _read_pending(self, committed):
+        """Read up to SPOOL_FLUSH_MAX_BYTES of complete lines after the committed offset"""
+        for base, path in self._segments():
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            with f:
+                size = os.fstat(f.fileno()).st_size
+                if base + size <= committed:
+                    continue
+                f.seek(max(committed - base, 0))
+                data = f.read(SPOOL_FLUSH_MAX_BYTES)
+                if data and not data.endswith(b'\n'):
+                    data += f.readline()
+                # Anything after the last newline is an append still in progress
+                data = data[:data.rfind(b'\n') + 1]
+                if data:
+                    return max(base, committed), data
+                return None, b''
+        return None, b''
+
+    def _copy_rows(self, conn, data):
+        """COPY a batch, isolating bad rows into the dead-letter file
+
+        Returns (spool lines inserted, bytes of data consumed). A row that
+        fails with an error outside ROW_ERRORS ends the batch: it and the
+        rows after it stay pending for the next flush, and the error is
+        raised when no row before it was consumed.
+        """
+        cur = conn.cursor()
+        try:
+            cur.execute("SAVEPOINT spool_batch")
+            cur.copy_expert(COPY_SQL, io.BytesIO(data))
+            cur.execute("RELEASE SAVEPOINT spool_batch")
+            return data.splitlines(), len(data)
+        except BATCH_ERRORS as e:
+            logger.warning(f"Spool batch rejected ({e}); retrying row by row")
+            cur.execute("ROLLBACK TO SAVEPOINT spool_batch")
+
+        copied = []
+        rejected = []
+        consumed = 0
+        for line in io.BytesIO(data):
+            try:
+                cur.execute("SAVEPOINT spool_row")
+                cur.copy_expert(COPY_SQL, io.BytesIO(line))
+                cur.execute("RELEASE SAVEPOINT spool_row")
+                copied.append(line)
+            except ROW_ERRORS as e:
+                cur.execute("ROLLBACK TO SAVEPOINT spool_row")
+                rejected.append(line)
+                logger.error(f"Spool row dead-lettered: {e}")
+            except BATCH_ERRORS as e:
+                cur.execute("ROLLBACK TO SAVEPOINT spool_row")
+                if not consumed:
+                    raise
+                logger.warning(f"Spool row left pending ({e}); flushing the rows before it")
+                break
+            consumed += len(line)
+        if rejected:
+            with open(self._path('dead-letter.log'), 'ab') as f:
+                f.writelines(rejected)
+                f.flush()
+                os.fsync(f.fileno())
+            self._dead_lettered += len(rejected)
+        return copied, consumed
+
+    def flush_once(self):
+        """Drain one coalesced batch to the database; returns True if work was done"""
+        with db.connection() as conn:
+            cur = conn.cursor()
+            if self._committed is None:
+                self._committed = self._load_committed(cur)
+                conn.commit()
+            committed = self._committed
+
+            start, data = self._read_pending(committed)
+            if not data:
+                self._remove_flushed_segments(committed)
+                return False
+
+            lines, consumed = self._copy_rows(conn, data)
+            stats.record_ingest(cur, count_spooled_rows(lines))
+            rows = len(lines)
+            new_committed = start + consumed
+            # Fence on the previous offset so a stale flusher can never move it backwards
+            cur.execute(
+                """
+                INSERT INTO ingest_spool_offsets (spool_id, committed_offset, updated_at)
+                VALUES (%s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (spool_id) DO UPDATE
+                SET committed_offset = EXCLUDED.committed_offset, updated_at = EXCLUDED.updated_at
+                WHERE ingest_spool_offsets.committed_offset = %s
+                """,
+                (self.spool_id, new_committed, committed)
+            )
+            if cur.rowcount != 1:
+                conn.rollback()
+                self._committed = None
+                raise SpoolError(f"committed offset for spool {self.spool_id} moved concurrently")
+            conn.commit()
+            cur.close()
+        stats.INGESTED_ROWS.labels('spool').inc(rows)
+        response_cache.invalidate(stats.CACHE_TAG)
+
+        self._committed = new_committed
+        write_state_file(self._path('committed'), str(new_committed))
+        self._remove_flushed_segments(new_committed)
+        self._flushed_records += rows
+        self._flushed_batches += 1
+        self._last_flush_at = time.time()
+        logger.debug(f"Spool flushed {rows} records up to offset {new_committed}")
+        return True
+
+    def _remove_flushed_segments(self, committed):
+        """Delete sealed segments whose records are all committed"""
+        segments = self._segments()
+        for base, path in segments[:-1]:
+            try:
+                if base + os.path.getsize(path) <= committed:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+
+    def stats(self):
+        committed = self.committed_offset()
+        end = self.log_end_offset()
+        return {
+            'spool_id': self.spool_id,
+            'directory': self.directory,
+            'fsync': self.fsync,
+            'flusher': self._flush_lock_fd is not None,
+            'committed_offset': committed,
+            'log_end_offset': end,
+            'pending_bytes': max(end - committed, 0),
+            'segments': len(self._segments()),
+            'appended_records': self._appended_records,
+            'appended_bytes': self._appended_bytes,
+            'flushed_records': self._flushed_records,
+            'flushed_batches': self._flushed_batches,
+            'flush_errors': self._flush_errors,
+            'dead_lettered': self._dead_lettered,
+            'last_flush_at': self._last_flush_at,
+        }
+
+
+def count_spooled_rows(lines):
+    """Counter of (record_type, source) for COPY-formatted spool lines"""
+    counts = Counter()
+    for line in lines:
+        fields = line.decode('utf-8').split('\t', 3)
+        counts[(copy_unescape(fields[0]), copy_unescape(fields[2]))] += 1
+    return counts
+
+
+def write_state_file(path, value):
+    """Atomically replace a small state file"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(value)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+_spool = None
+_spool_pid = None
+_spool_lock = threading.Lock()
+
+
+def get_spool():
+    """Return this worker's spool, starting its flusher on first use"""
+    global _spool, _spool_pid
+    pid = os.getpid()
+    if _spool is not None and _spool_pid == pid:
+        return _spool
+    with _spool_lock:
+        if _spool is None or _spool_pid != pid:
+            spool = Spool()
+            spool.start()
+            _spool, _spool_pid = spool, pid
+    return _spool
+
+
+def has_segments(directory=SPOOL_DIR):
+    """Whether a spool directory holds segment files, e.g. from before a restart"""
+    try:
+        return any(name.endswith(SEGMENT_SUFFIX) for name in os.listdir(directory))
+    except OSError:
+        return False
+
+
+def start_pending_flusher():
+    """Start this worker's flusher now when the spool holds segments
+
+    Otherwise records acknowledged before a worker or pod restart would
+    wait for the next spool-mode request to be drained.
+    """
+    if not has_segments():
+        return
+    try:
+        get_spool()
+    except SpoolError as e:
+        logger.error(f"Spool flusher could not start: {e}")
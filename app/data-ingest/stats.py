@@ -0,0 +1,175 @@
+"""
+Ingest Statistics Rollups
+Per-type/per-source counters maintained in the same transaction as each write
+"""
+import os
+import time
+import random
+import logging
+import threading
+from collections import Counter
+from psycopg2.extras import RealDictCursor, execute_values
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+STATS_SLOTS = int(os.getenv('INGEST_STATS_SLOTS', '8'))
+STATS_MAX_STALENESS = float(os.getenv('INGEST_STATS_MAX_STALENESS', '5'))
+STATS_MINUTE_RETENTION_HOURS = int(os.getenv('INGEST_STATS_MINUTE_RETENTION_HOURS', '48'))
+
+# Response cache tag of the endpoints that read ingested_data
+CACHE_TAG = 'ingested_data'
+
+# Per-second rates come from rate(ingest_rows_total[1m])
+INGESTED_ROWS = metrics.Counter('ingest_rows_total', 'Records committed to ingested_data, by write path', ['path'])
+
+_cache = {'value': None, 'at': 0.0}
+_cache_lock = threading.Lock()
+
+
+def record_ingest(cur, counts):
+    """Add ingested row counts to the rollups inside the caller's transaction
+
+    Counters are spread over INGEST_STATS_SLOTS rows per key so concurrent
+    writers rarely wait on the same row lock; keys are written in sorted
+    order so two transactions can never deadlock on them.
+    """
+    if not counts:
+        return
+    slot = random.randrange(STATS_SLOTS)
+    keys = sorted(counts)
+    execute_values(
+        cur,
+        """
+        INSERT INTO ingest_stats_totals (record_type, source, slot, record_count)
+        VALUES %s
+        ON CONFLICT (record_type, source, slot)
+        DO UPDATE SET record_count = ingest_stats_totals.record_count + EXCLUDED.record_count
+        """,
+        [(record_type, source, slot, counts[(record_type, source)]) for record_type, source in keys]
+    )
+    execute_values(
+        cur,
+        """
+        INSERT INTO ingest_stats_minutely (bucket, record_type, source, slot, record_count)
+        VALUES %s
+        ON CONFLICT (bucket, record_type, source, slot)
+        DO UPDATE SET record_count = ingest_stats_minutely.record_count + EXCLUDED.record_count
+        """,
+        [(record_type, source, slot, counts[(record_type, source)]) for record_type, source in keys],
+        template="(date_trunc('minute', LOCALTIMESTAMP), %s, %s, %s, %s)"
+    )
+
+
+def record_removal(cur, table):
+    """Subtract the rows of table from the rollups inside the caller's transaction
+
+    For a partition of ingested_data about to be dropped. The negative
+    counts go to one slot like any other write; readers sum the slots.
+    Buckets past the per-minute retention are already gone and left alone.
+    """
+    slot = random.randrange(STATS_SLOTS)
+    cur.execute(
+        f"""
+        INSERT INTO ingest_stats_totals (record_type, source, slot, record_count)
+        SELECT record_type, source, %s, -COUNT(*)
+        FROM {table}
+        GROUP BY record_type, source
+        ORDER BY record_type, source
+        ON CONFLICT (record_type, source, slot)
+        DO UPDATE SET record_count = ingest_stats_totals.record_count + EXCLUDED.record_count
+        """,
+        (slot,)
+    )
+    cur.execute(
+        f"""
+        INSERT INTO ingest_stats_minutely (bucket, record_type, source, slot, record_count)
+        SELECT date_trunc('minute', created_at), record_type, source, %s, -COUNT(*)
+        FROM {table}
+        WHERE created_at >= LOCALTIMESTAMP - make_interval(hours => %s)
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3
+        ON CONFLICT (bucket, record_type, source, slot)
+        DO UPDATE SET record_count = ingest_stats_minutely.record_count + EXCLUDED.record_count
+        """,
+        (slot, STATS_MINUTE_RETENTION_HOURS)
+    )
+
+
+def prune_minutely(cur, limit):
+    """Delete up to limit per-minute bucket rows past their retention, oldest first; returns how many
+
+    Run by the maintenance thread in its own transaction, so ingest
+    transactions hold the hot slot rows no longer than their own writes.
+    """
+    cur.execute(
+        """
+        DELETE FROM ingest_stats_minutely
+        WHERE (bucket, record_type, source, slot) IN (
+            SELECT bucket, record_type, source, slot FROM ingest_stats_minutely
+            WHERE bucket < LOCALTIMESTAMP - make_interval(hours => %s)
+            ORDER BY bucket
+            LIMIT %s
+        )
+        """,
+        (STATS_MINUTE_RETENTION_HOURS, limit)
+    )
+    return cur.rowcount
+
+
+def read_rollups(conn):
+    """Compute stats from the rollup tables in O(types x sources)"""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("""
+        SELECT record_type, source, SUM(record_count) AS count
+        FROM ingest_stats_totals
+        GROUP BY record_type, source
+        HAVING SUM(record_count) > 0
+    """)
+    by_type = Counter()
+    sources = set()
+    total = 0
+    for row in cur.fetchall():
+        count = int(row['count'])
+        by_type[row['record_type']] += count
+        sources.add(row['source'])
+        total += count
+
+    cur.execute("""
+        SELECT COALESCE(SUM(record_count), 0) AS recent_count
+        FROM ingest_stats_minutely
+        WHERE bucket >= date_trunc('minute', LOCALTIMESTAMP - INTERVAL '1 hour')
+    """)
+    recent_count = int(cur.fetchone()['recent_count'])
+    cur.close()
+
+    return {
+        'total_records': total,
+        'unique_types': len(by_type),
+        'unique_sources': len(sources),
+        'recent_hour_count': recent_count,
+        'by_type': [
+            {'record_type': record_type, 'count': count}
+            for record_type, count in by_type.most_common(10)
+        ],
+    }
+
+
+def get_stats(connection, max_staleness=STATS_MAX_STALENESS):
+    """Rollup stats, served from this worker's cache when fresh enough
+
+    Returns (stats, age_seconds).
+    """
+    now = time.monotonic()
+    with _cache_lock:
+        value, at = _cache['value'], _cache['at']
+    if value is not None and now - at <= max_staleness:
+        return value, now - at
+
+    with connection() as conn:
+        value = read_rollups(conn)
+    with _cache_lock:
+        _cache['value'] = value
+        _cache['at'] = time.monotonic()
+    return value, 0.0
@@ -3,42 +3,40 @@ Frontend API Service
 Handles user-facing API requests and coordinates with backend services
 """
 import os
+import time
 import logging
-from flask import Flask, jsonify, request
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import requests
+from functools import partial
+from flask import Flask, Response, jsonify, request
+from psycopg2.extras import RealDictCursor, execute_values
 from datetime import datetime
+import db
+import fast_json
+import metrics
+import tracing
+import health
+import pagination
+import backend_client
+from backend_client import BackendUnavailable
+import proxy
+import bulk_users
+import response_cache
 
 app = Flask(__name__)
+app.json = fast_json.FastJSONProvider(app)
 logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
+metrics.instrument(app, 'frontend-api')
+tracing.instrument(app, 'frontend-api')
 
 # Configuration from environment variables
-DB_HOST = os.getenv('DATABASE_HOST', 'localhost')
-DB_PORT = os.getenv('DATABASE_PORT', '5432')
-DB_NAME = os.getenv('DATABASE_NAME', 'appdb')
-DB_USER = os.getenv('DATABASE_USER', 'appuser')
-DB_PASSWORD = os.getenv('DATABASE_PASSWORD', 'password')
 REGION = os.getenv('REGION', 'unknown')
-BUSINESS_LOGIC_URL = os.getenv('BUSINESS_LOGIC_URL', 'http://business-logic:8081')
-DATA_INGEST_URL = os.getenv('DATA_INGEST_URL', 'http://data-ingest:8082')
 
-def get_db_connection():
-    """Create database connection"""
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            connect_timeout=5
-        )
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection failed: {e}")
-        raise
+# 'stream' relays ingest bodies to data-ingest byte for byte; 'parse'
+# decodes and re-encodes them as JSON
+INGEST_PROXY_MODE = os.getenv('INGEST_PROXY_MODE', 'stream').lower()
+
+# Response cache tag of endpoints that read users
+USERS_CACHE_TAG = 'users'
 
 @app.route('/health/live', methods=['GET'])
 def liveness():
@@ -50,63 +48,79 @@ def liveness():
         'timestamp': datetime.utcnow().isoformat()
     }), 200
 
+def check_database():
+    """Postgres reachable through this worker's pool, which may be busy but must be moving"""
+    return db.check_primary(health.HEALTH_CHECK_TIMEOUT / 2, health.HEALTH_MAX_AGE)
+
+health.monitor.register('postgres', check_database)
+
+def check_backend(name):
+    """Backend liveness over the shared keep-alive client"""
+    return backend_client.get_backend(name).is_healthy(timeout=health.HEALTH_CHECK_TIMEOUT)
+
+for backend_name in backend_client.BACKEND_URLS:
+    health.monitor.register(backend_name, partial(check_backend, backend_name))
+
 @app.route('/health/ready', methods=['GET'])
 def readiness():
-    """Readiness probe - checks if service can handle requests"""
-    try:
-        # Check database connectivity
-        conn = get_db_connection()
-        conn.close()
-        
-        # Check backend services
-        business_logic_health = requests.get(
-            f"{BUSINESS_LOGIC_URL}/health/live",
-            timeout=2
-        ).status_code == 200
-        
-        data_ingest_health = requests.get(
-            f"{DATA_INGEST_URL}/health/live",
-            timeout=2
-        ).status_code == 200
-        
-        if business_logic_health and data_ingest_health:
-            return jsonify({
-                'status': 'ready',
-                'service': 'frontend-api',
-                'region': REGION,
-                'database': 'connected',
-                'backend_services': 'healthy',
-                'timestamp': datetime.utcnow().isoformat()
-            }), 200
-        else:
-            return jsonify({
-                'status': 'not_ready',
-                'reason': 'backend_services_unhealthy'
-            }), 503
-            
-    except Exception as e:
-        logger.error(f"Readiness check failed: {e}")
+    """Readiness probe - served from the background health monitor's cached results"""
+    ready, reason, dependencies = health.monitor.readiness()
+    if ready:
         return jsonify({
-            'status': 'not_ready',
-            'reason': str(e)
-        }), 503
+            'status': 'ready',
+            'service': 'frontend-api',
+            'region': REGION,
+            'database': 'connected',
+            'backend_services': 'healthy',
+            'timestamp': datetime.utcnow().isoformat()
+        }), 200
+    return jsonify({
+        'status': 'not_ready',
+        'reason': reason,
+        'dependencies': dependencies
+    }), 503
+
+@app.route('/health/dependencies', methods=['GET'])
+def get_dependencies():
+    """Per-dependency health results and latency history for this worker"""
+    return jsonify({
+        'service': 'frontend-api',
+        'region': REGION,
+        'pid': os.getpid(),
+        'dependencies': health.monitor.details()
+    }), 200
 
 @app.route('/api/v1/users', methods=['GET'])
+@response_cache.cached(USERS_CACHE_TAG, bypass=lambda args: 'stream' in args)
 def get_users():
-    """Get all users"""
+    """Get users, newest first, one keyset page at a time"""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SELECT id, username, email, created_at FROM users ORDER BY created_at DESC LIMIT 100")
-        users = cur.fetchall()
-        cur.close()
-        conn.close()
+        limit, after, stream = pagination.parse_page_args(request.args, 100)
+        sql, params = pagination.keyset_query(
+            'id, username, email, created_at', 'users', [], [], after, limit
+        )
+        
+        if stream:
+            chunks = pagination.stream_page(
+                sql, params, limit, stream, app.json.dumps, 'users', {'limit': limit, 'region': REGION}
+            )
+            return Response(pagination.primed(chunks), mimetype=pagination.STREAM_MIMETYPES[stream])
+        
+        with db.read_connection() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute(sql, params)
+            users, next_cursor = pagination.split_page(cur.fetchall(), limit)
+            cur.close()
         
         return jsonify({
             'users': users,
             'count': len(users),
+            'limit': limit,
+            'next_cursor': next_cursor,
             'region': REGION
         }), 200
+    except pagination.InvalidPageRequest as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error fetching users: {e}")
         return jsonify({'error': str(e)}), 500
@@ -123,26 +137,26 @@ def create_user():
             return jsonify({'error': 'username and email are required'}), 400
         
         # Call business logic service for validation
-        validation_response = requests.post(
-            f"{BUSINESS_LOGIC_URL}/api/v1/validate/user",
+        validation_response = backend_client.get_backend('business-logic').post(
+            '/api/v1/validate/user',
             json={'username': username, 'email': email},
-            timeout=5
+            timeout=(backend_client.BACKEND_CONNECT_TIMEOUT, 5)
         )
         
         if validation_response.status_code != 200:
             return jsonify({'error': 'validation failed'}), 400
         
         # Insert user
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute(
-            "INSERT INTO users (username, email) VALUES (%s, %s) RETURNING id, username, email, created_at",
-            (username, email)
-        )
-        user = cur.fetchone()
-        conn.commit()
-        cur.close()
-        conn.close()
+        with db.connection() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute(
+                "INSERT INTO users (username, email) VALUES (%s, %s) RETURNING id, username, email, created_at",
+                (username, email)
+            )
+            user = cur.fetchone()
+            conn.commit()
+            cur.close()
+        response_cache.invalidate(USERS_CACHE_TAG)
         
         logger.info(f"User created: {user['id']} in region {REGION}")
         
@@ -150,27 +164,120 @@ def create_user():
             'user': user,
             'region': REGION
         }), 201
+    except BackendUnavailable as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         logger.error(f"Error creating user: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/v1/users/bulk', methods=['POST'])
+def create_users_bulk():
+    """Create many users: bulk validation, then multi-row inserts in one transaction"""
+    try:
+        started = time.monotonic()
+        candidates = bulk_users.parse_candidates(request.get_json())
+        
+        # One validation call per chunk instead of one per user
+        business_logic = backend_client.get_backend('business-logic')
+        results = []
+        for offset, chunk in bulk_users.chunks(candidates):
+            validation_response = business_logic.post(
+                '/api/v1/validate/users',
+                json={'users': chunk},
+                timeout=(backend_client.BACKEND_CONNECT_TIMEOUT, 30)
+            )
+            validation = bulk_users.validation_body(validation_response.status_code, validation_response.content)
+            results += bulk_users.validation_results(offset, validation)
+        validated = time.monotonic()
+        
+        created = {}
+        pages = list(bulk_users.insert_pages(results))
+        if pages:
+            with db.connection() as conn:
+                cur = conn.cursor(cursor_factory=RealDictCursor)
+                for rows in pages:
+                    inserted = execute_values(cur, bulk_users.INSERT_SQL, rows, page_size=len(rows), fetch=True)
+                    created.update((row['username'], row) for row in inserted)
+                conn.commit()
+                cur.close()
+            if created:
+                response_cache.invalidate(USERS_CACHE_TAG)
+        
+        summary = bulk_users.finish(results, created, started, validated)
+        logger.info(
+            f"Bulk user import: {summary['created']} created, {summary['duplicate']} duplicate, "
+            f"{summary['invalid']} invalid in {summary['timing']['total_ms']}ms in region {REGION}"
+        )
+        
+        return jsonify({**summary, 'region': REGION}), 200
+    except bulk_users.InvalidBulkRequest as e:
+        return jsonify({'error': str(e)}), 400
+    except bulk_users.ValidationFailed as e:
+        return jsonify({'error': 'validation failed', 'details': e.details}), 502
+    except BackendUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error creating users in bulk: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/v1/data/ingest', methods=['POST'])
 def ingest_data():
     """Proxy request to data ingest service"""
     try:
+        backend = backend_client.get_backend('data-ingest')
+        timeout = (backend_client.BACKEND_CONNECT_TIMEOUT, 10)
+        
+        if INGEST_PROXY_MODE == 'stream':
+            return proxy.forward(backend, '/api/v1/ingest', timeout=timeout)
+        
         data = request.get_json()
         
-        response = requests.post(
-            f"{DATA_INGEST_URL}/api/v1/ingest",
+        response = backend.post(
+            '/api/v1/ingest',
             json=data,
-            timeout=10
+            timeout=timeout
         )
         
-        return jsonify(response.json()), response.status_code
+        return jsonify(fast_json.loads(response.content)), response.status_code
+    except BackendUnavailable as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         logger.error(f"Error proxying to data ingest: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics summed over this pod's workers"""
+    return Response(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/metrics/db-pool', methods=['GET'])
+def get_pool_metrics():
+    """Database connection pool metrics for this worker"""
+    return jsonify({
+        'service': 'frontend-api',
+        'region': REGION,
+        **db.pool_stats()
+    }), 200
+
+@app.route('/metrics/backends', methods=['GET'])
+def get_backend_metrics():
+    """Backend client and circuit breaker metrics for this worker"""
+    return jsonify({
+        'service': 'frontend-api',
+        'region': REGION,
+        **backend_client.backend_stats()
+    }), 200
+
+@app.route('/metrics/response-cache', methods=['GET'])
+def get_response_cache_metrics():
+    """Response cache metrics for this worker"""
+    return jsonify({
+        'service': 'frontend-api',
+        'region': REGION,
+        'pid': os.getpid(),
+        **response_cache.cache_stats()
+    }), 200
+
 @app.route('/api/v1/info', methods=['GET'])
 def get_info():
     """Get service information"""
@@ -179,10 +286,11 @@ def get_info():
         'version': '1.0.0',
         'region': REGION,
         'environment': os.getenv('ENVIRONMENT', 'production'),
-        'database_host': DB_HOST,
+        'server_mode': 'wsgi',
+        'database_host': db.DB_HOST,
         'backend_services': {
-            'business_logic': BUSINESS_LOGIC_URL,
-            'data_ingest': DATA_INGEST_URL
+            'business_logic': backend_client.BUSINESS_LOGIC_URL,
+            'data_ingest': backend_client.DATA_INGEST_URL
         }
     }), 200
 
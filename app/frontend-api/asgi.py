@@ -0,0 +1,691 @@
+"""
+Frontend API Service (ASGI)
+Async serving mode: the same API as app.py on an asyncpg pool and async HTTP clients
+"""
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+from functools import partial, wraps
+from contextlib import asynccontextmanager
+import asyncpg
+import httpx
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.http import parse_etags
+import db
+import fast_json
+import metrics
+import tracing
+import health
+import backend_client
+import pagination
+import proxy
+import bulk_users
+import response_cache
+from backend_client import (
+    BACKEND_CONNECT_TIMEOUT, BACKEND_READ_TIMEOUT, BACKEND_RETRIES, BACKEND_URLS, BUSINESS_LOGIC_URL,
+    DATA_INGEST_URL, IDEMPOTENT_METHODS, BackendBase, BackendUnavailable, backoff, encode_json
+)
+
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
+logger = logging.getLogger(__name__)
+# httpx logs every request at INFO
+logging.getLogger('httpx').setLevel(logging.WARNING)
+metrics.configure('frontend-api')
+tracing.configure('frontend-api')
+
+# Configuration from environment variables
+REGION = os.getenv('REGION', 'unknown')
+INGEST_PROXY_MODE = os.getenv('INGEST_PROXY_MODE', 'stream').lower()
+ASYNC_DB_POOL_MIN_SIZE = int(os.getenv('ASYNC_DB_POOL_MIN_SIZE', '1'))
+ASYNC_DB_POOL_MAX_SIZE = int(os.getenv('ASYNC_DB_POOL_MAX_SIZE', '10'))
+ASYNC_BACKEND_MAX_CONNECTIONS = int(os.getenv('ASYNC_BACKEND_MAX_CONNECTIONS', '1000'))
+ASYNC_BACKEND_MAX_KEEPALIVE = int(os.getenv('ASYNC_BACKEND_MAX_KEEPALIVE', '100'))
+
+# Response cache tag of endpoints that read users (same as app.py)
+USERS_CACHE_TAG = 'users'
+
+# asyncpg counterpart of bulk_users.INSERT_SQL: one statement per page of
+# username/email arrays
+BULK_INSERT_SQL = """
+    INSERT INTO users (username, email)
+    SELECT * FROM unnest($1::varchar[], $2::varchar[])
+    ON CONFLICT DO NOTHING
+    RETURNING id, username, email, created_at
+"""
+
+
+# Same encoder as the Flask app's JSON provider, so both modes answer alike
+dumps = fast_json.dumps
+
+
+async def read_json(request):
+    return fast_json.loads(await request.body())
+
+
+class AppJSONResponse(JSONResponse):
+    def render(self, content):
+        with tracing.span('json.encode'):
+            return fast_json.dumps_bytes(content)
+
+
+def asyncpg_sql(sql):
+    """Rewrite psycopg2 %s placeholders as asyncpg $n placeholders"""
+    parts = sql.split('%s')
+    return ''.join(f"{part}${i}" for i, part in enumerate(parts[:-1], 1)) + parts[-1]
+
+
+def _timeout(timeout):
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout or BACKEND_READ_TIMEOUT, connect=BACKEND_CONNECT_TIMEOUT)
+
+
+def _never_sent(exc):
+    """True when the request failed before any byte reached the backend"""
+    return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+class AsyncBackend(BackendBase):
+    """Async client for one backend with the same retry and breaker policy as backend_client.Backend"""
+
+    def __init__(self, name, base_url):
+        super().__init__(name, base_url)
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=httpx.Limits(
+                max_connections=ASYNC_BACKEND_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_BACKEND_MAX_KEEPALIVE,
+            ),
+            timeout=_timeout(None),
+        )
+
+    async def request(self, method, path, retries=BACKEND_RETRIES, timeout=None, stream=False, **kwargs):
+        """Send a request, retrying with jittered backoff while it is safe to"""
+        method = method.upper()
+        idempotent = method in IDEMPOTENT_METHODS
+        encode_json(kwargs, 'content')
+
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise self._short_circuit()
+
+            started = time.monotonic()
+            try:
+                with tracing.span(
+                    'backend.request', backend=self.name, **{'http.method': method, 'http.path': path, 'attempt': attempt}
+                ) as attempt_span:
+                    kwargs['headers'] = tracing.inject(kwargs.get('headers'))
+                    req = self.client.build_request(method, path, timeout=_timeout(timeout), **kwargs)
+                    response = await self.client.send(req, stream=stream)
+                    attempt_span.set(**{'http.status_code': response.status_code})
+            except httpx.TransportError as e:
+                self._record(time.monotonic() - started, True)
+                self.breaker.record_failure()
+                retryable = idempotent or _never_sent(e)
+                if attempt >= retries or not retryable or not self._take_retry_token():
+                    raise
+                logger.warning(f"{self.name} {method} {path} failed ({e!r}); retrying")
+            else:
+                self._record_response(time.monotonic() - started, response)
+                if not self._should_retry(response, idempotent, attempt, retries):
+                    return response
+                await response.aclose()
+                logger.warning(f"{self.name} {method} {path} returned {response.status_code}; retrying")
+
+            attempt += 1
+            await asyncio.sleep(backoff(attempt))
+
+    async def is_healthy(self, path='/health/live', timeout=2):
+        """Liveness of the backend; False instead of raising (bypasses the breaker like Backend.is_healthy)"""
+        try:
+            response = await self.client.get(path, timeout=_timeout((min(BACKEND_CONNECT_TIMEOUT, timeout), timeout)))
+            return response.status_code == 200
+        except httpx.HTTPError as e:
+            logger.warning(f"{self.name} health check failed: {e!r}")
+            return False
+
+
+def check_database():
+    """Postgres reachable (blocking; run by the health monitor thread)"""
+    return db.check_primary(health.HEALTH_CHECK_TIMEOUT / 2, health.HEALTH_MAX_AGE)
+
+
+def check_backend(name):
+    """Backend liveness (blocking; run by the health monitor thread)"""
+    return backend_client.get_backend(name).is_healthy(timeout=health.HEALTH_CHECK_TIMEOUT)
+
+
+_state = {}
+
+
+@asynccontextmanager
+async def lifespan(app):
+    _state['pool'] = await _create_pool(db.DB_HOST, db.DB_PORT, ASYNC_DB_POOL_MIN_SIZE)
+    # Opened lazily so an unreachable replica cannot keep the worker from starting
+    _state['replica'] = await _create_pool(db.DB_REPLICA_HOST, db.DB_REPLICA_PORT, 0) if db.DB_REPLICA_HOST else None
+    _state['backends'] = {name: AsyncBackend(name, url) for name, url in BACKEND_URLS.items()}
+    # The monitor runs blocking checks in its own threads, off the event loop
+    health.monitor.register('postgres', check_database)
+    for name in BACKEND_URLS:
+        health.monitor.register(name, partial(check_backend, name))
+    health.monitor.start()
+    try:
+        yield
+    finally:
+        for backend in _state['backends'].values():
+            await backend.client.aclose()
+        await _state['pool'].close()
+        if _state['replica'] is not None:
+            await _state['replica'].close()
+
+
+def _create_pool(host, port, min_size):
+    return asyncpg.create_pool(
+        host=host,
+        port=int(port),
+        database=db.DB_NAME,
+        user=db.DB_USER,
+        password=db.DB_PASSWORD,
+        min_size=min(min_size, ASYNC_DB_POOL_MAX_SIZE),
+        max_size=ASYNC_DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=db.DB_POOL_MAX_IDLE,
+        max_queries=50000,
+        timeout=db.DB_CONNECT_TIMEOUT,
+    )
+
+
+def _acquire():
+    return _state['pool'].acquire(timeout=db.DB_POOL_TIMEOUT)
+
+
+# Async counterpart of db.ReplicaRouter's state for this worker
+_replica = {'lag': None, 'checked_at': None, 'down_until': 0.0, 'error': None,
+            'replica_reads': 0, 'primary_reads': 0, 'fallback_lag': 0, 'fallback_unavailable': 0}
+
+
+async def _replica_conn(max_lag):
+    """A replica connection within max_lag seconds of the primary, or None"""
+    replica = _state['replica']
+    now = time.monotonic()
+    if replica is None:
+        return None
+    if now < _replica['down_until']:
+        _replica['fallback_unavailable'] += 1
+        return None
+    conn = None
+    try:
+        conn = await replica.acquire(timeout=db.DB_POOL_TIMEOUT)
+        if _replica['checked_at'] is None or now - _replica['checked_at'] >= db.DB_REPLICA_CHECK_INTERVAL:
+            _replica['lag'] = float(await conn.fetchval(db.REPLICA_LAG_SQL))
+            _replica['checked_at'] = now
+            _replica['error'] = None
+    except Exception as e:
+        if conn is not None:
+            await replica.release(conn)
+        logger.warning(f"Replica unavailable, reading from primary for {db.DB_REPLICA_RETRY_AFTER}s: {e}")
+        _replica.update(down_until=now + db.DB_REPLICA_RETRY_AFTER, error=str(e), lag=None, checked_at=None)
+        _replica['fallback_unavailable'] += 1
+        return None
+    if _replica['lag'] > max_lag:
+        await replica.release(conn)
+        _replica['fallback_lag'] += 1
+        return None
+    return conn
+
+
+@asynccontextmanager
+async def _acquire_read(max_lag=None):
+    """Async counterpart of db.read_connection()"""
+    conn = await _replica_conn(db.DB_REPLICA_MAX_LAG if max_lag is None else max_lag)
+    if conn is None:
+        if _state['replica'] is not None:
+            _replica['primary_reads'] += 1
+        async with _acquire() as conn:
+            yield conn
+        return
+    _replica['replica_reads'] += 1
+    try:
+        yield conn
+    finally:
+        await _state['replica'].release(conn)
+
+
+def _backend(name):
+    return _state['backends'][name]
+
+
+async def liveness(request):
+    """Liveness probe - checks if service is running"""
+    return AppJSONResponse({
+        'status': 'alive',
+        'service': 'frontend-api',
+        'region': REGION,
+        'timestamp': datetime.utcnow().isoformat()
+    }, 200)
+
+
+async def readiness(request):
+    """Readiness probe - served from the background health monitor's cached results"""
+    # The first probe after startup blocks until the first round of checks
+    ready, reason, dependencies = await run_in_threadpool(health.monitor.readiness)
+    if ready:
+        return AppJSONResponse({
+            'status': 'ready',
+            'service': 'frontend-api',
+            'region': REGION,
+            'database': 'connected',
+            'backend_services': 'healthy',
+            'timestamp': datetime.utcnow().isoformat()
+        }, 200)
+    return AppJSONResponse({
+        'status': 'not_ready',
+        'reason': reason,
+        'dependencies': dependencies
+    }, 503)
+
+
+async def get_dependencies(request):
+    """Per-dependency health results and latency history for this worker"""
+    return AppJSONResponse({
+        'service': 'frontend-api',
+        'region': REGION,
+        'pid': os.getpid(),
+        'dependencies': health.monitor.details()
+    }, 200)
+
+
+async def _stream_page(sql, params, limit, fmt, key, extra):
+    """Async counterpart of pagination.stream_page over an asyncpg cursor"""
+    async with _acquire_read() as conn:
+        async with conn.transaction(readonly=True):
+            if fmt == 'json':
+                yield '{' + dumps(key) + ':['
+            count = 0
+            last = None
+            has_more = False
+            async for record in conn.cursor(asyncpg_sql(sql), *params, prefetch=pagination.STREAM_FETCH_SIZE):
+                if count == limit:
+                    has_more = True
+                    break
+                row = dict(record)
+                if fmt == 'json':
+                    yield (',' if count else '') + dumps(row)
+                else:
+                    yield dumps(row) + '\n'
+                count += 1
+                last = row
+
+    next_cursor = pagination.encode_cursor(last['created_at'], last['id']) if has_more else None
+    if fmt == 'json':
+        yield '],' + dumps({'count': count, 'next_cursor': next_cursor, **extra})[1:]
+    else:
+        yield dumps({'next_cursor': next_cursor}) + '\n'
+
+
+async def _primed(chunks):
+    """Run a chunk generator to its first chunk so query errors surface before the response starts"""
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        # Nothing to send
+        first = None
+
+    async def run():
+        try:
+            if first is not None:
+                yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+    return run()
+
+
+def _cached(*tags, bypass=None, volatile=()):
+    """Async counterpart of response_cache.cached for Starlette endpoints"""
+    def decorator(endpoint):
+        @wraps(endpoint)
+        async def wrapper(request):
+            cache = response_cache.get_cache()
+            if cache is None:
+                return await endpoint(request)
+            if bypass is not None and bypass(request.query_params):
+                cache.count('bypassed')
+                return await endpoint(request)
+
+            key = cache.key(request.url.path, request.query_params.multi_items(), tags)
+            entry = cache.get(key)
+            if entry is not None:
+                content_type, etag, body = entry
+                state = 'HIT'
+            else:
+                response = await endpoint(request)
+                if response.status_code != 200 or isinstance(response, StreamingResponse):
+                    return response
+                content_type, body = response.headers['content-type'], response.body
+                etag = cache.put(key, content_type, body, volatile)
+                state = 'MISS'
+
+            headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache', 'X-Cache': state}
+            if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+                cache.count('not_modified')
+                return Response(status_code=304, headers=headers)
+            return Response(body, 200, headers={**headers, 'Content-Type': content_type})
+        return wrapper
+    return decorator
+
+
+@_cached(USERS_CACHE_TAG, bypass=lambda args: 'stream' in args)
+async def get_users(request):
+    """Get users, newest first, one keyset page at a time"""
+    try:
+        limit, after, stream = pagination.parse_page_args(request.query_params, 100)
+        sql, params = pagination.keyset_query(
+            'id, username, email, created_at', 'users', [], [], after, limit
+        )
+
+        if stream:
+            chunks = await _primed(_stream_page(sql, params, limit, stream, 'users', {'limit': limit, 'region': REGION}))
+            return StreamingResponse(chunks, media_type=pagination.STREAM_MIMETYPES[stream])
+
+        async with _acquire_read() as conn:
+            rows = [dict(record) for record in await conn.fetch(asyncpg_sql(sql), *params)]
+        users, next_cursor = pagination.split_page(rows, limit)
+
+        return AppJSONResponse({
+            'users': users,
+            'count': len(users),
+            'limit': limit,
+            'next_cursor': next_cursor,
+            'region': REGION
+        }, 200)
+    except pagination.InvalidPageRequest as e:
+        return AppJSONResponse({'error': str(e)}, 400)
+    except Exception as e:
+        logger.error(f"Error fetching users: {e}")
+        return AppJSONResponse({'error': str(e)}, 500)
+
+
+async def create_user(request):
+    """Create a new user"""
+    try:
+        data = await read_json(request)
+        username = data.get('username')
+        email = data.get('email')
+
+        if not username or not email:
+            return AppJSONResponse({'error': 'username and email are required'}, 400)
+
+        # Call business logic service for validation
+        validation_response = await _backend('business-logic').request(
+            'POST', '/api/v1/validate/user',
+            json={'username': username, 'email': email},
+            timeout=(BACKEND_CONNECT_TIMEOUT, 5)
+        )
+
+        if validation_response.status_code != 200:
+            return AppJSONResponse({'error': 'validation failed'}, 400)
+
+        async with _acquire() as conn:
+            record = await conn.fetchrow(
+                "INSERT INTO users (username, email) VALUES ($1, $2) RETURNING id, username, email, created_at",
+                username, email
+            )
+        user = dict(record)
+        response_cache.invalidate(USERS_CACHE_TAG)
+
+        logger.info(f"User created: {user['id']} in region {REGION}")
+
+        return AppJSONResponse({
+            'user': user,
+            'region': REGION
+        }, 201)
+    except BackendUnavailable as e:
+        return AppJSONResponse({'error': str(e)}, 503)
+    except Exception as e:
+        logger.error(f"Error creating user: {e}")
+        return AppJSONResponse({'error': str(e)}, 500)
+
+
+async def create_users_bulk(request):
+    """Create many users: bulk validation, then multi-row inserts in one transaction"""
+    try:
+        started = time.monotonic()
+        candidates = bulk_users.parse_candidates(await read_json(request))
+
+        business_logic = _backend('business-logic')
+        results = []
+        for offset, chunk in bulk_users.chunks(candidates):
+            validation_response = await business_logic.request(
+                'POST', '/api/v1/validate/users',
+                json={'users': chunk},
+                timeout=(BACKEND_CONNECT_TIMEOUT, 30)
+            )
+            validation = bulk_users.validation_body(validation_response.status_code, validation_response.content)
+            results += bulk_users.validation_results(offset, validation)
+        validated = time.monotonic()
+
+        created = {}
+        pages = list(bulk_users.insert_pages(results))
+        if pages:
+            async with _acquire() as conn:
+                async with conn.transaction():
+                    for rows in pages:
+                        usernames, emails = zip(*rows)
+                        for record in await conn.fetch(BULK_INSERT_SQL, list(usernames), list(emails)):
+                            created[record['username']] = dict(record)
+            if created:
+                response_cache.invalidate(USERS_CACHE_TAG)
+
+        summary = bulk_users.finish(results, created, started, validated)
+        return AppJSONResponse({**summary, 'region': REGION}, 200)
+    except bulk_users.InvalidBulkRequest as e:
+        return AppJSONResponse({'error': str(e)}, 400)
+    except bulk_users.ValidationFailed as e:
+        return AppJSONResponse({'error': 'validation failed', 'details': e.details}, 502)
+    except BackendUnavailable as e:
+        return AppJSONResponse({'error': str(e)}, 503)
+    except Exception as e:
+        logger.error(f"Error creating users in bulk: {e}")
+        return AppJSONResponse({'error': str(e)}, 500)
+
+
+async def ingest_data(request):
+    """Proxy request to data ingest service"""
+    try:
+        backend = _backend('data-ingest')
+        timeout = (BACKEND_CONNECT_TIMEOUT, 10)
+
+        if INGEST_PROXY_MODE != 'stream':
+            response = await backend.request('POST', '/api/v1/ingest', json=await read_json(request), timeout=timeout)
+            return AppJSONResponse(fast_json.loads(response.content), response.status_code)
+
+        headers = {name: request.headers[name] for name in proxy.FORWARD_REQUEST_HEADERS if name in request.headers}
+        if 'content-length' in request.headers:
+            headers['Content-Length'] = request.headers['content-length']
+        upstream = await backend.request(
+            'POST', '/api/v1/ingest', params=request.query_params, content=request.stream(),
+            headers=headers, timeout=timeout, stream=True
+        )
+        response_headers = {
+            name: upstream.headers[name] for name in proxy.FORWARD_RESPONSE_HEADERS if name in upstream.headers
+        }
+        return StreamingResponse(
+            upstream.aiter_raw(proxy.PROXY_CHUNK_BYTES),
+            status_code=upstream.status_code,
+            headers=response_headers,
+            background=BackgroundTask(upstream.aclose),
+        )
+    except BackendUnavailable as e:
+        return AppJSONResponse({'error': str(e)}, 503)
+    except Exception as e:
+        logger.error(f"Error proxying to data ingest: {e}")
+        return AppJSONResponse({'error': str(e)}, 500)
+
+
+class MetricsMiddleware:
+    """Async counterpart of metrics.instrument: times each request by its route template"""
+
+    def __init__(self, app):
+        self.app = app
+        self._paths = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not metrics.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        metrics.REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.REQUESTS_IN_FLIGHT.dec()
+            # The router records the matched endpoint in the scope
+            endpoint = scope.get('endpoint')
+            route = self._paths.get(endpoint)
+            if route is None:
+                route = next((r.path for r in app.routes if r.endpoint is endpoint), 'unmatched')
+                self._paths[endpoint] = route
+            metrics.observe_request(route, scope['method'], status, time.perf_counter() - started)
+
+
+class TracingMiddleware:
+    """Async counterpart of tracing.instrument: a server span per request, continuing the caller's trace"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        traceparent = next((value.decode('latin-1') for name, value in scope['headers'] if name == b'traceparent'), None)
+        server, token = tracing.start_request(traceparent, scope['method'], **{'http.method': scope['method']})
+        status = None
+
+        async def send_with_trace(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if server is not None:
+                    message['headers'] = [*message.get('headers', []), (b'x-trace-id', server.context.trace_id.encode())]
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if server is not None:
+                endpoint = scope.get('endpoint')
+                route = next((r.path for r in app.routes if r.endpoint is endpoint), 'unmatched')
+                server.name = f"{scope['method']} {route}"
+                server.attributes['http.route'] = route
+            tracing.finish_request(server, token, status, error)
+
+
+async def get_metrics(request):
+    """Prometheus metrics summed over this pod's workers"""
+    return Response(metrics.exposition(), media_type=metrics.CONTENT_TYPE)
+
+
+async def get_pool_metrics(request):
+    """Async database pool metrics for this worker"""
+    pools = {'primary': _state['pool'], 'replica': _state['replica']}
+    now = time.monotonic()
+    return AppJSONResponse({
+        'service': 'frontend-api',
+        'region': REGION,
+        'pid': os.getpid(),
+        'pools': [{
+            'name': name,
+            'size': pool.get_size(),
+            'idle': pool.get_idle_size(),
+            'in_use': pool.get_size() - pool.get_idle_size(),
+            'min_size': pool.get_min_size(),
+            'max_size': pool.get_max_size(),
+        } for name, pool in pools.items() if pool is not None],
+        'replica': {
+            'host': db.DB_REPLICA_HOST,
+            'max_lag_seconds': db.DB_REPLICA_MAX_LAG,
+            'lag_seconds': db.lag_seconds(_replica['lag']),
+            'lag_age_seconds': None if _replica['checked_at'] is None else round(now - _replica['checked_at'], 3),
+            'available': now >= _replica['down_until'],
+            **{key: value for key, value in _replica.items() if key not in ('lag', 'checked_at', 'down_until')},
+        } if _state['replica'] is not None else None
+    }, 200)
+
+
+async def get_backend_metrics(request):
+    """Backend client and circuit breaker metrics for this worker"""
+    return AppJSONResponse({
+        'service': 'frontend-api',
+        'region': REGION,
+        'pid': os.getpid(),
+        'backends': [backend.stats() for backend in _state['backends'].values()]
+    }, 200)
+
+
+async def get_response_cache_metrics(request):
+    """Response cache metrics for this worker"""
+    return AppJSONResponse({
+        'service': 'frontend-api',
+        'region': REGION,
+        'pid': os.getpid(),
+        **response_cache.cache_stats()
+    }, 200)
+
+
+async def get_info(request):
+    """Get service information"""
+    return AppJSONResponse({
+        'service': 'frontend-api',
+        'version': '1.0.0',
+        'region': REGION,
+        'environment': os.getenv('ENVIRONMENT', 'production'),
+        'server_mode': 'asgi',
+        'database_host': db.DB_HOST,
+        'backend_services': {
+            'business_logic': BUSINESS_LOGIC_URL,
+            'data_ingest': DATA_INGEST_URL
+        }
+    }, 200)
+
+
+app = Starlette(
+    routes=[
+        Route('/health/live', liveness, methods=['GET']),
+        Route('/health/ready', readiness, methods=['GET']),
+        Route('/health/dependencies', get_dependencies, methods=['GET']),
+        Route('/api/v1/users', get_users, methods=['GET']),
+        Route('/api/v1/users', create_user, methods=['POST']),
+        Route('/api/v1/users/bulk', create_users_bulk, methods=['POST']),
+        Route('/api/v1/data/ingest', ingest_data, methods=['POST']),
+        Route('/metrics', get_metrics, methods=['GET']),
+        Route('/metrics/db-pool', get_pool_metrics, methods=['GET']),
+        Route('/metrics/backends', get_backend_metrics, methods=['GET']),
+        Route('/metrics/response-cache', get_response_cache_metrics, methods=['GET']),
+        Route('/api/v1/info', get_info, methods=['GET']),
+    ],
+    middleware=[Middleware(MetricsMiddleware), Middleware(TracingMiddleware)],
+    lifespan=lifespan,
+)
@@ -0,0 +1,326 @@
+"""
+Backend HTTP Client
+Keep-alive sessions to business-logic and data-ingest with bounded retries and circuit breaking
+"""
+import os
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import fast_json
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+BACKEND_POOL_MAXSIZE = int(os.getenv('BACKEND_POOL_MAXSIZE', '20'))
+BACKEND_CONNECT_TIMEOUT = float(os.getenv('BACKEND_CONNECT_TIMEOUT', '1'))
+BACKEND_READ_TIMEOUT = float(os.getenv('BACKEND_READ_TIMEOUT', '10'))
+BACKEND_RETRIES = int(os.getenv('BACKEND_RETRIES', '2'))
+BACKEND_RETRY_BACKOFF = float(os.getenv('BACKEND_RETRY_BACKOFF', '0.05'))
+BACKEND_RETRY_BACKOFF_MAX = float(os.getenv('BACKEND_RETRY_BACKOFF_MAX', '1'))
+BACKEND_RETRY_BUDGET_RATIO = float(os.getenv('BACKEND_RETRY_BUDGET_RATIO', '0.2'))
+BACKEND_BREAKER_FAILURES = int(os.getenv('BACKEND_BREAKER_FAILURES', '5'))
+BACKEND_BREAKER_RESET = float(os.getenv('BACKEND_BREAKER_RESET', '30'))
+
+BUSINESS_LOGIC_URL = os.getenv('BUSINESS_LOGIC_URL', 'http://business-logic:8081')
+DATA_INGEST_URL = os.getenv('DATA_INGEST_URL', 'http://data-ingest:8082')
+
+# Safe to resend after the backend may already have seen the request
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+
+# Upstream statuses worth retrying for idempotent requests
+RETRY_STATUSES = frozenset((502, 503, 504))
+
+def is_shed(response):
+    """The backend turned the request away to protect itself: 429, or 503 with Retry-After
+
+    These are answers, not failures. They neither open the breaker nor are
+    retried at once, which would only add to the overload.
+    """
+    return response.status_code == 429 or (response.status_code == 503 and 'Retry-After' in response.headers)
+
+
+# Retries saved up while the backend is healthy, spent on failures
+RETRY_BUDGET_MAX_TOKENS = 10.0
+
+# Latency of every attempt, exported on /metrics
+BACKEND_DURATION = metrics.Histogram(
+    'backend_request_duration_seconds', 'Time per backend call attempt, by backend and outcome', ['backend', 'outcome']
+)
+
+
+class BackendUnavailable(Exception):
+    """The backend's circuit breaker is open and the call was not attempted"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half_open -> closed"""
+
+    def __init__(self, failure_threshold=BACKEND_BREAKER_FAILURES, reset_timeout=BACKEND_BREAKER_RESET):
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._opened_count = 0
+
+    def allow(self):
+        """Whether a call may go out now; half-open lets one trial call through"""
+        with self._lock:
+            if self._state == 'closed':
+                return True
+            if self._state == 'open':
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = 'half_open'
+                self._trial_in_flight = False
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != 'closed':
+                logger.info("Circuit closed after successful trial call")
+            self._state = 'closed'
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == 'half_open' or self._failures >= self.failure_threshold:
+                if self._state != 'open':
+                    self._opened_count += 1
+                self._state = 'open'
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            retry_in = 0.0
+            if self._state == 'open':
+                retry_in = max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'opened_count': self._opened_count,
+                'retry_in_seconds': round(retry_in, 3),
+            }
+
+
+class BackendBase:
+    """Retry budget, circuit breaker and counters shared by the sync and async clients"""
+
+    def __init__(self, name, base_url):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.breaker = CircuitBreaker()
+        self._duration_ok = BACKEND_DURATION.labels(name, 'ok')
+        self._duration_failed = BACKEND_DURATION.labels(name, 'failed')
+        self._lock = threading.Lock()
+        self._retry_tokens = RETRY_BUDGET_MAX_TOKENS
+        self._requests = 0
+        self._failures = 0
+        self._retries = 0
+        self._retries_denied = 0
+        self._short_circuited = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def _take_retry_token(self):
+        with self._lock:
+            if self._retry_tokens >= 1:
+                self._retry_tokens -= 1
+                self._retries += 1
+                return True
+            self._retries_denied += 1
+            return False
+
+    def _record(self, elapsed, failed):
+        (self._duration_failed if failed else self._duration_ok).observe(elapsed)
+        with self._lock:
+            self._requests += 1
+            self._failures += failed
+            self._latency_total += elapsed
+            self._latency_max = max(self._latency_max, elapsed)
+            if not failed:
+                self._retry_tokens = min(self._retry_tokens + BACKEND_RETRY_BUDGET_RATIO, RETRY_BUDGET_MAX_TOKENS)
+
+    def _record_response(self, elapsed, response):
+        """Count an answered attempt against the breaker; True when it failed"""
+        failed = response.status_code >= 500 and not is_shed(response)
+        self._record(elapsed, failed)
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return failed
+
+    def _should_retry(self, response, idempotent, attempt, retries):
+        return (idempotent and response.status_code in RETRY_STATUSES and not is_shed(response)
+                and attempt < retries and self._take_retry_token())
+
+    def _short_circuit(self):
+        with self._lock:
+            self._short_circuited += 1
+        return BackendUnavailable(f"{self.name} circuit is open")
+
+    def stats(self):
+        """Snapshot of request counters and breaker state"""
+        with self._lock:
+            count = self._requests
+            counters = {
+                'requests': count,
+                'failures': self._failures,
+                'retries': self._retries,
+                'retries_denied': self._retries_denied,
+                'short_circuited': self._short_circuited,
+                'retry_budget_tokens': round(self._retry_tokens, 2),
+                'latency_ms_avg': round(self._latency_total * 1000 / count, 3) if count else 0.0,
+                'latency_ms_max': round(self._latency_max * 1000, 3),
+            }
+        return {'name': self.name, 'url': self.base_url, **self.breaker.stats(), **counters}
+
+
+class Backend(BackendBase):
+    """One upstream service: a keep-alive session, a retry budget and a breaker"""
+
+    def __init__(self, name, base_url):
+        super().__init__(name, base_url)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=BACKEND_POOL_MAXSIZE, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, path, retries=BACKEND_RETRIES, timeout=None, **kwargs):
+        """Send a request, retrying with jittered backoff while it is safe to
+
+        Idempotent requests are retried on connection errors, timeouts and
+        RETRY_STATUSES unless the backend shed them; other requests only when
+        the connection was never established. Raises BackendUnavailable while
+        the circuit is open.
+        """
+        method = method.upper()
+        idempotent = method in IDEMPOTENT_METHODS
+        timeout = timeout or (BACKEND_CONNECT_TIMEOUT, BACKEND_READ_TIMEOUT)
+        url = f"{self.base_url}{path}"
+        encode_json(kwargs, 'data')
+
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise self._short_circuit()
+
+            started = time.monotonic()
+            try:
+                with tracing.span(
+                    'backend.request', backend=self.name, **{'http.method': method, 'http.path': path, 'attempt': attempt}
+                ) as attempt_span:
+                    # The backend's spans become children of this attempt
+                    kwargs['headers'] = tracing.inject(kwargs.get('headers'))
+                    response = self.session.request(method, url, timeout=timeout, **kwargs)
+                    attempt_span.set(**{'http.status_code': response.status_code})
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(time.monotonic() - started, True)
+                self.breaker.record_failure()
+                retryable = idempotent or _never_sent(e)
+                if attempt >= retries or not retryable or not self._take_retry_token():
+                    raise
+                logger.warning(f"{self.name} {method} {path} failed ({e}); retrying")
+            else:
+                self._record_response(time.monotonic() - started, response)
+                if not self._should_retry(response, idempotent, attempt, retries):
+                    return response
+                response.close()
+                logger.warning(f"{self.name} {method} {path} returned {response.status_code}; retrying")
+
+            attempt += 1
+            time.sleep(backoff(attempt))
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def is_healthy(self, path='/health/live', timeout=2):
+        """Liveness of the backend; False instead of raising
+
+        Probes bypass the breaker and the retry budget: those protect the
+        backend from traffic, and an open breaker must not turn every
+        frontend pod unready at once.
+        """
+        try:
+            response = self.session.get(
+                f"{self.base_url}{path}", timeout=(min(BACKEND_CONNECT_TIMEOUT, timeout), timeout)
+            )
+            return response.status_code == 200
+        except requests.RequestException as e:
+            logger.warning(f"{self.name} health check failed: {e}")
+            return False
+
+
+def encode_json(kwargs, body_arg):
+    """Replace a json= request argument with a body encoded once by fast_json"""
+    if kwargs.get('json') is not None:
+        kwargs[body_arg] = fast_json.dumps_bytes(kwargs.pop('json'), sort_keys=False)
+        kwargs['headers'] = {'Content-Type': 'application/json', **(kwargs.get('headers') or {})}
+
+
+def _never_sent(exc):
+    """True when the request failed before any byte reached the backend"""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def backoff(attempt):
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(BACKEND_RETRY_BACKOFF * (2 ** (attempt - 1)), BACKEND_RETRY_BACKOFF_MAX))
+
+
+BACKEND_URLS = {
+    'business-logic': BUSINESS_LOGIC_URL,
+    'data-ingest': DATA_INGEST_URL,
+}
+
+_backends = {}
+_backends_pid = None
+_backends_lock = threading.Lock()
+
+
+def get_backend(name):
+    """Return this worker's client for a backend, creating it on first use"""
+    global _backends, _backends_pid
+    pid = os.getpid()
+    backend = _backends.get(name) if _backends_pid == pid else None
+    if backend is not None:
+        return backend
+    with _backends_lock:
+        if _backends_pid != pid:
+            # Sockets inherited across a fork are shared with the parent
+            _backends = {}
+            _backends_pid = pid
+        backend = _backends.get(name)
+        if backend is None:
+            backend = Backend(name, BACKEND_URLS[name])
+            _backends[name] = backend
+    return backend
+
+
+def backend_stats():
+    """Stats for every backend client in this worker"""
+    return {
+        'pid': os.getpid(),
+        'backends': [backend.stats() for backend in list(_backends.values())] if _backends_pid == os.getpid() else [],
+    }
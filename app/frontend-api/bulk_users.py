@@ -0,0 +1,126 @@
+"""
+Bulk User Creation
+Request parsing and per-row outcomes shared by the Flask and ASGI bulk user endpoints
+"""
+import os
+import time
+
+import fast_json
+
+# Configuration from environment variables
+USERS_BULK_MAX = int(os.getenv('USERS_BULK_MAX', '100000'))
+USERS_BULK_VALIDATE_CHUNK = int(os.getenv('USERS_BULK_VALIDATE_CHUNK', '5000'))
+USERS_BULK_INSERT_PAGE_SIZE = int(os.getenv('USERS_BULK_INSERT_PAGE_SIZE', '1000'))
+
+# Rows that lose a race with another insert are reported as duplicates
+INSERT_SQL = """
+    INSERT INTO users (username, email) VALUES %s
+    ON CONFLICT DO NOTHING
+    RETURNING id, username, email, created_at
+"""
+
+
+class InvalidBulkRequest(ValueError):
+    """The request body is not a usable list of users"""
+
+
+class ValidationFailed(Exception):
+    """business-logic did not return usable validation results"""
+
+    def __init__(self, details):
+        super().__init__('validation failed')
+        self.details = details
+
+
+def parse_candidates(data):
+    """The list of candidate users from a request body"""
+    candidates = data.get('users') if isinstance(data, dict) else data
+    if not isinstance(candidates, list) or not candidates:
+        raise InvalidBulkRequest('users must be a non-empty list')
+    if len(candidates) > USERS_BULK_MAX:
+        raise InvalidBulkRequest(f"at most {USERS_BULK_MAX} users per request")
+    return candidates
+
+
+def chunks(candidates):
+    """(offset, chunk) pairs of at most USERS_BULK_VALIDATE_CHUNK candidates"""
+    for offset in range(0, len(candidates), USERS_BULK_VALIDATE_CHUNK):
+        yield offset, candidates[offset:offset + USERS_BULK_VALIDATE_CHUNK]
+
+
+def validation_body(status_code, content):
+    """The parsed body of a /api/v1/validate/users response
+
+    The status is checked before the body is parsed: error responses from
+    proxies or a failing backend are often HTML or plain text.
+    """
+    if status_code != 200:
+        raise ValidationFailed(_error_details(content))
+    try:
+        body = fast_json.loads(content)
+    except ValueError:
+        raise ValidationFailed('response is not JSON')
+    if not isinstance(body, dict) or not isinstance(body.get('results'), list):
+        raise ValidationFailed('response has no results list')
+    return body
+
+
+def _error_details(content):
+    """The JSON error body when there is one, otherwise the start of the text"""
+    try:
+        return fast_json.loads(content)
+    except ValueError:
+        return content[:200].decode('utf-8', 'replace')
+
+
+def validation_results(offset, body):
+    """Per-row results from one /api/v1/validate/users response"""
+    return [
+        {
+            'index': offset + result['index'],
+            'username': result['username'],
+            'email': result['email'],
+            'status': 'valid' if result['valid'] else 'duplicate' if result['duplicate'] else 'invalid',
+            'errors': result['errors'],
+        }
+        for result in body['results']
+    ]
+
+
+def insert_pages(results):
+    """(username, email) rows of the valid results, in INSERT-sized pages"""
+    rows = [(r['username'], r['email']) for r in results if r['status'] == 'valid']
+    for page in range(0, len(rows), USERS_BULK_INSERT_PAGE_SIZE):
+        yield rows[page:page + USERS_BULK_INSERT_PAGE_SIZE]
+
+
+def finish(results, created, started, validated):
+    """Mark created rows, count outcomes and report throughput
+
+    created maps username to the inserted row.
+    """
+    counts = {'created': 0, 'duplicate': 0, 'invalid': 0}
+    for result in results:
+        if result['status'] == 'valid':
+            user = created.get(result['username'])
+            if user is not None and user['email'] == result['email']:
+                result['status'] = 'created'
+                result['user'] = user
+            else:
+                result['status'] = 'duplicate'
+                result['errors'] = ['username or email already exists']
+        counts[result['status']] += 1
+
+    finished = time.monotonic()
+    elapsed = finished - started
+    return {
+        **counts,
+        'total': len(results),
+        'results': results,
+        'timing': {
+            'validate_ms': round((validated - started) * 1000, 1),
+            'insert_ms': round((finished - validated) * 1000, 1),
+            'total_ms': round(elapsed * 1000, 1),
+            'rows_per_second': round(len(results) / elapsed, 1) if elapsed > 0 else None,
+        },
+    }
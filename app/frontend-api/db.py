@@ -0,0 +1,616 @@
+"""
+Database Connection Pool
+Bounded per-worker PostgreSQL connection pools shared by all three services, with optional replica routing for reads
+"""
+import os
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+DB_HOST = os.getenv('DATABASE_HOST', 'localhost')
+DB_PORT = os.getenv('DATABASE_PORT', '5432')
+DB_NAME = os.getenv('DATABASE_NAME', 'appdb')
+DB_USER = os.getenv('DATABASE_USER', 'appuser')
+DB_PASSWORD = os.getenv('DATABASE_PASSWORD', 'password')
+DB_CONNECT_TIMEOUT = int(os.getenv('DATABASE_CONNECT_TIMEOUT', '5'))
+DB_POOL_MIN_SIZE = int(os.getenv('DATABASE_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DATABASE_POOL_MAX_SIZE', '2'))
+DB_POOL_TIMEOUT = float(os.getenv('DATABASE_POOL_TIMEOUT', '5'))
+DB_POOL_MAX_LIFETIME = float(os.getenv('DATABASE_POOL_MAX_LIFETIME', '1800'))
+DB_POOL_MAX_IDLE = float(os.getenv('DATABASE_POOL_MAX_IDLE', '300'))
+DB_POOL_CHECK_AFTER = float(os.getenv('DATABASE_POOL_CHECK_AFTER', '30'))
+
+# Read replica for read_connection(); unset sends every read to the primary
+DB_REPLICA_HOST = os.getenv('DATABASE_REPLICA_HOST', '')
+DB_REPLICA_PORT = os.getenv('DATABASE_REPLICA_PORT', DB_PORT)
+DB_REPLICA_MAX_LAG = float(os.getenv('DATABASE_REPLICA_MAX_LAG', '5'))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv('DATABASE_REPLICA_CHECK_INTERVAL', '1'))
+DB_REPLICA_RETRY_AFTER = float(os.getenv('DATABASE_REPLICA_RETRY_AFTER', '10'))
+
+# Seconds the replica is behind: zero when the server is not in recovery,
+# and when it is streaming and has replayed everything it received (an idle
+# primary makes the last replay timestamp look old). A replica that is not
+# streaming may be falling further behind unseen, so it reports its replay
+# timestamp lag, or infinity when it has never replayed a transaction.
+# Reading pg_stat_wal_receiver.status needs pg_read_all_stats.
+REPLICA_LAG_SQL = """
+    SELECT (CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming')
+            THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 'Infinity')
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END)::float8
+"""
+
+# Errors after which a connection can no longer be trusted
+DISCONNECT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+# Called as observer(sql, seconds) after every statement, after every
+# commit (sql 'COMMIT') and after opening a connection (sql 'CONNECT')
+_query_observers = []
+
+
+def add_query_observer(observer):
+    """Register a callable timed statements are reported to"""
+    _query_observers.append(observer)
+
+
+def _observed(sql, started):
+    elapsed = time.perf_counter() - started
+    for observer in _query_observers:
+        try:
+            observer(sql, elapsed)
+        except Exception as e:
+            logger.debug(f"Query observer failed: {e}")
+
+
+class ObservedCursorMixin:
+    """Times execute/executemany/copy_expert for the registered query observers"""
+
+    def execute(self, query, vars=None):
+        if not _query_observers:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _observed(query, started)
+
+    def executemany(self, query, vars_list):
+        if not _query_observers:
+            return super().executemany(query, vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _observed(query, started)
+
+    def copy_expert(self, sql, file, size=8192):
+        if not _query_observers:
+            return super().copy_expert(sql, file, size)
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            _observed(sql, started)
+
+
+_observed_cursor_classes = {}
+
+
+def _observed_cursor_class(factory):
+    cls = _observed_cursor_classes.get(factory)
+    if cls is None:
+        cls = type(f"Observed{factory.__name__}", (ObservedCursorMixin, factory), {})
+        _observed_cursor_classes[factory] = cls
+    return cls
+
+
+class ObservedConnection(extensions.connection):
+    """Connection whose cursors, whatever their cursor_factory, report statement timings"""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor
+        kwargs['cursor_factory'] = _observed_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        if not _query_observers:
+            return super().commit()
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _observed('COMMIT', started)
+
+
+class PoolTimeout(Exception):
+    """No connection became available within the checkout timeout"""
+
+
+class PooledConnection:
+    """A pooled connection and the timestamps used to recycle it"""
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """Bounded pool with health-checked checkout and max-lifetime recycling"""
+
+    def __init__(self, name, connect_kwargs, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 timeout=DB_POOL_TIMEOUT, max_lifetime=DB_POOL_MAX_LIFETIME,
+                 max_idle=DB_POOL_MAX_IDLE, check_after=DB_POOL_CHECK_AFTER):
+        self.name = name
+        self.connect_kwargs = connect_kwargs
+        self.min_size = min(min_size, max_size)
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_after = check_after
+
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        self._returned_at = None
+
+        # Counters exposed through stats()
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._checkout_time_total = 0.0
+        self._checkout_time_max = 0.0
+        self._connections_opened = 0
+        self._connections_closed = 0
+        self._recycled = 0
+        self._failed_checks = 0
+
+    def _connect(self):
+        """Open a new database connection"""
+        started = time.perf_counter()
+        try:
+            conn = psycopg2.connect(
+                connect_timeout=DB_CONNECT_TIMEOUT, connection_factory=ObservedConnection, **self.connect_kwargs
+            )
+        except Exception as e:
+            logger.error(f"Database connection failed ({self.name}): {e}")
+            raise
+        finally:
+            if _query_observers:
+                _observed('CONNECT', started)
+        with self._cond:
+            self._connections_opened += 1
+        return PooledConnection(conn)
+
+    def _discard(self, entry):
+        """Close a connection that is leaving the pool"""
+        try:
+            if not entry.conn.closed:
+                entry.conn.close()
+        except Exception as e:
+            logger.debug(f"Error closing pooled connection ({self.name}): {e}")
+        with self._cond:
+            self._connections_closed += 1
+
+    def _is_usable(self, entry):
+        """Check an idle connection before handing it out"""
+        now = time.monotonic()
+        conn = entry.conn
+        if conn.closed:
+            return False
+        if ((self.max_lifetime and now - entry.created_at > self.max_lifetime)
+                or (self.max_idle and now - entry.last_used > self.max_idle)):
+            with self._cond:
+                self._recycled += 1
+            return False
+        if now - entry.last_used > self.check_after:
+            # Connection has been idle long enough that the server or a
+            # load balancer may have dropped it, so ping before reuse
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+                conn.rollback()
+            except Exception:
+                with self._cond:
+                    self._failed_checks += 1
+                return False
+        return True
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting up to timeout (default: the pool timeout)"""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout(f"pool {self.name} is closed")
+                if self._idle:
+                    entry = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    self._in_use += 1
+                    entry = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"no connection available in pool {self.name} after {timeout}s"
+                    )
+                if not waited:
+                    waited = True
+                    self._waits += 1
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        # Health checks and connects happen outside the lock
+        try:
+            while entry is not None and not self._is_usable(entry):
+                self._discard(entry)
+                with self._cond:
+                    if self._idle:
+                        # Take over an idle connection; the discarded one's slot is freed
+                        entry = self._idle.pop()
+                        self._size -= 1
+                    else:
+                        entry = None
+            if entry is None:
+                entry = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._checkout_time_total += elapsed
+            if elapsed > self._checkout_time_max:
+                self._checkout_time_max = elapsed
+        return entry
+
+    def putconn(self, entry, discard=False):
+        """Return a connection to the pool"""
+        conn = entry.conn
+        if not discard and not conn.closed:
+            try:
+                # Never hand out a connection with an open transaction
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        if discard or conn.closed or self._closed:
+            self._discard(entry)
+            with self._cond:
+                self._returned_at = time.monotonic()
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            return
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._returned_at = entry.last_used
+            self._in_use -= 1
+            self._idle.append(entry)
+            self._cond.notify()
+
+    def returned_within(self, seconds):
+        """Whether a checked-out connection came back in the last `seconds`"""
+        with self._cond:
+            return self._returned_at is not None and time.monotonic() - self._returned_at <= seconds
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Borrow a connection for the duration of a with-block"""
+        entry = self.getconn(timeout)
+        discard = False
+        try:
+            yield entry.conn
+        except DISCONNECT_ERRORS:
+            discard = True
+            raise
+        except Exception:
+            try:
+                entry.conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.putconn(entry, discard=discard)
+
+    def fill(self):
+        """Open connections up to the configured minimum size"""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                entry = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                return
+            with self._cond:
+                self._idle.append(entry)
+                self._cond.notify()
+
+    def close(self):
+        """Close all idle connections and refuse further checkouts"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for entry in idle:
+            self._discard(entry)
+
+    def stats(self):
+        """Snapshot of pool gauges and counters"""
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                'name': self.name,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'checkouts': checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'checkout_ms_avg': round(self._checkout_time_total * 1000 / checkouts, 3) if checkouts else 0.0,
+                'checkout_ms_max': round(self._checkout_time_max * 1000, 3),
+                'connections_opened': self._connections_opened,
+                'connections_closed': self._connections_closed,
+                'recycled': self._recycled,
+                'failed_health_checks': self._failed_checks,
+            }
+
+
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def _connect_kwargs(name):
+    if name == 'replica':
+        return {
+            'host': DB_REPLICA_HOST,
+            'port': DB_REPLICA_PORT,
+            'database': DB_NAME,
+            'user': DB_USER,
+            'password': DB_PASSWORD,
+        }
+    return {
+        'host': DB_HOST,
+        'port': DB_PORT,
+        'database': DB_NAME,
+        'user': DB_USER,
+        'password': DB_PASSWORD,
+    }
+
+
+def get_pool(name='primary'):
+    """Return this worker's pool, creating it on first use"""
+    global _pools, _pools_pid
+    pid = os.getpid()
+    pool = _pools.get(name) if _pools_pid == pid else None
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        if _pools_pid != pid:
+            # Connections inherited across a fork belong to the parent
+            # process and must not be reused or closed here
+            _pools = {}
+            _pools_pid = pid
+        pool = _pools.get(name)
+        if pool is None:
+            pool = ConnectionPool(name, _connect_kwargs(name))
+            _pools[name] = pool
+    pool.fill()
+    return pool
+
+
+def connection():
+    """Borrow a pooled connection: `with db.connection() as conn:`"""
+    return get_pool().connection()
+
+
+def check_primary(timeout, progress_window):
+    """Health check of the primary through this worker's pool; raises when it is down
+
+    A pool whose connections are all taken for `timeout` seconds is busy,
+    not broken: that counts as healthy as long as a connection came back
+    within the last `progress_window` seconds.
+    """
+    pool = get_pool()
+    try:
+        with pool.connection(timeout=timeout) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+    except PoolTimeout:
+        if not pool.returned_within(progress_window):
+            raise
+    return True
+
+
+class ReplicaRouter:
+    """Decides per read whether the replica is close enough behind the primary to serve it"""
+
+    def __init__(self, max_lag=DB_REPLICA_MAX_LAG, check_interval=DB_REPLICA_CHECK_INTERVAL,
+                 retry_after=DB_REPLICA_RETRY_AFTER):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._lag = None
+        self._checked_at = None
+        self._down_until = 0.0
+        self._error = None
+        self._stats = {'replica_reads': 0, 'primary_reads': 0, 'fallback_lag': 0, 'fallback_unavailable': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _mark_down(self, error):
+        logger.warning(f"Replica unavailable, reading from primary for {self.retry_after}s: {error}")
+        with self._lock:
+            self._down_until = time.monotonic() + self.retry_after
+            self._error = str(error)
+            self._lag = None
+            self._checked_at = None
+
+    def _measure_lag(self, conn):
+        """Lag in seconds from the cached measurement, re-measured on conn when it is stale"""
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return self._lag
+        cur = conn.cursor()
+        cur.execute(REPLICA_LAG_SQL)
+        lag = float(cur.fetchone()[0])
+        cur.close()
+        conn.rollback()
+        with self._lock:
+            self._lag = lag
+            self._checked_at = now
+            self._error = None
+        return lag
+
+    @contextmanager
+    def connection(self, max_lag=None):
+        """Borrow a replica connection when it is within max_lag seconds, else a primary one"""
+        max_lag = self.max_lag if max_lag is None else max_lag
+        entry = None
+        if time.monotonic() >= self._down_until:
+            pool = get_pool('replica')
+            try:
+                entry = pool.getconn()
+                lag = self._measure_lag(entry.conn)
+            except Exception as e:
+                if entry is not None:
+                    pool.putconn(entry, discard=True)
+                    entry = None
+                self._mark_down(e)
+                self._count('fallback_unavailable')
+            else:
+                if lag > max_lag:
+                    pool.putconn(entry)
+                    entry = None
+                    self._count('fallback_lag')
+        else:
+            self._count('fallback_unavailable')
+
+        if entry is None:
+            self._count('primary_reads')
+            with connection() as conn:
+                yield conn
+            return
+
+        self._count('replica_reads')
+        discard = False
+        try:
+            yield entry.conn
+        except DISCONNECT_ERRORS as e:
+            discard = True
+            self._mark_down(e)
+            raise
+        except Exception:
+            try:
+                entry.conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            pool.putconn(entry, discard=discard)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'host': DB_REPLICA_HOST,
+                'max_lag_seconds': self.max_lag,
+                'lag_seconds': lag_seconds(self._lag),
+                'lag_age_seconds': None if self._checked_at is None else round(now - self._checked_at, 3),
+                'available': now >= self._down_until,
+                'error': self._error,
+                **self._stats,
+            }
+
+
+_router = None
+_router_pid = None
+
+
+def get_router():
+    """This worker's replica router, or None when no replica is configured"""
+    global _router, _router_pid
+    if not DB_REPLICA_HOST:
+        return None
+    pid = os.getpid()
+    with _pools_lock:
+        if _router is None or _router_pid != pid:
+            _router = ReplicaRouter()
+            _router_pid = pid
+        return _router
+
+
+def lag_seconds(lag):
+    """A measured lag for JSON: rounded, or None when unknown or infinite"""
+    if lag is None or not math.isfinite(lag):
+        return None
+    return round(lag, 3)
+
+
+def read_connection(max_lag=None):
+    """Borrow a connection for read-only queries that tolerate replica lag
+
+    Served by the replica when DATABASE_REPLICA_HOST is set and it is at most
+    max_lag (default DATABASE_REPLICA_MAX_LAG) seconds behind; otherwise by
+    the primary, exactly like connection().
+    """
+    router = get_router()
+    if router is None:
+        return connection()
+    return router.connection(max_lag)
+
+
+def pool_stats():
+    """Stats for every pool in this worker"""
+    router = get_router()
+    return {
+        'pid': os.getpid(),
+        'pools': [pool.stats() for pool in list(_pools.values())] if _pools_pid == os.getpid() else [],
+        'replica': router.stats() if router is not None else None,
+    }
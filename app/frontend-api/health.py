@@ -0,0 +1,173 @@
+"""
+Dependency Health Monitor
+Checks dependencies in the background and serves readiness from the cached results
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', '5'))
+HEALTH_CHECK_TIMEOUT = float(os.getenv('HEALTH_CHECK_TIMEOUT', '2'))
+HEALTH_MAX_AGE = float(os.getenv('HEALTH_MAX_AGE', '15'))
+HEALTH_HISTORY_SIZE = int(os.getenv('HEALTH_HISTORY_SIZE', '60'))
+
+
+class Dependency:
+    """Latest result and recent latency history of one dependency check"""
+
+    def __init__(self, name, check):
+        self.name = name
+        self.check = check
+        self.healthy = None
+        self.error = None
+        self.checked_at = None
+        self.checked_at_wall = None
+        self.latency_ms = None
+        self.consecutive_failures = 0
+        self.history = deque(maxlen=HEALTH_HISTORY_SIZE)
+        self.in_flight = None
+
+    def record(self, healthy, latency_ms, error=None):
+        self.healthy = healthy
+        self.error = error
+        self.checked_at = time.monotonic()
+        self.checked_at_wall = time.time()
+        self.latency_ms = latency_ms
+        self.consecutive_failures = 0 if healthy else self.consecutive_failures + 1
+        self.history.append((self.checked_at_wall, latency_ms, healthy))
+
+    def age(self, now):
+        return None if self.checked_at is None else now - self.checked_at
+
+    def summary(self, now):
+        age = self.age(now)
+        return {
+            'healthy': bool(self.healthy) and age is not None and age <= HEALTH_MAX_AGE,
+            'age_seconds': None if age is None else round(age, 3),
+            'latency_ms': self.latency_ms,
+            'error': self.error,
+        }
+
+    def details(self, now):
+        latencies = sorted(latency for _, latency, _ in self.history)
+        samples = len(latencies)
+        return {
+            **self.summary(now),
+            'consecutive_failures': self.consecutive_failures,
+            'samples': samples,
+            'failures': sum(1 for _, _, healthy in self.history if not healthy),
+            'latency_ms_p50': latencies[samples // 2] if samples else None,
+            'latency_ms_p95': latencies[min(int(samples * 0.95), samples - 1)] if samples else None,
+            'latency_ms_max': latencies[-1] if samples else None,
+            'history': [
+                {'at': round(at, 3), 'latency_ms': latency, 'healthy': healthy}
+                for at, latency, healthy in self.history
+            ],
+        }
+
+
+class HealthMonitor:
+    """Runs every registered check each HEALTH_CHECK_INTERVAL seconds in a daemon thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dependencies = {}
+        self._executor = None
+        self._thread = None
+        self._pid = None
+        self._first_round = threading.Event()
+
+    def register(self, name, check):
+        """Add a check: check() returns truthy when healthy, falsy or raises otherwise"""
+        with self._lock:
+            self._dependencies[name] = Dependency(name, check)
+
+    def _run_check(self, dependency):
+        started = time.monotonic()
+        try:
+            healthy = bool(dependency.check())
+            error = None if healthy else 'check reported unhealthy'
+        except Exception as e:
+            healthy, error = False, str(e)
+        latency_ms = round((time.monotonic() - started) * 1000, 3)
+        with self._lock:
+            dependency.record(healthy, latency_ms, error)
+            dependency.in_flight = None
+
+    def check_now(self):
+        """Run all checks concurrently, waiting up to HEALTH_CHECK_TIMEOUT"""
+        with self._lock:
+            dependencies = list(self._dependencies.values())
+        futures = {}
+        for dependency in dependencies:
+            if dependency.in_flight is not None:
+                # A hung check from an earlier round is still running
+                continue
+            dependency.in_flight = self._executor.submit(self._run_check, dependency)
+            futures[dependency.in_flight] = dependency
+        started = time.monotonic()
+        _, pending = wait(futures, timeout=HEALTH_CHECK_TIMEOUT)
+        for future in pending:
+            dependency = futures[future]
+            with self._lock:
+                dependency.record(False, round((time.monotonic() - started) * 1000, 3),
+                                  f"check timed out after {HEALTH_CHECK_TIMEOUT}s")
+            logger.warning(f"Health check {dependency.name} timed out")
+
+    def _loop(self):
+        while True:
+            try:
+                self.check_now()
+            except Exception as e:
+                logger.error(f"Health monitor failed: {e}")
+            self._first_round.set()
+            time.sleep(HEALTH_CHECK_INTERVAL)
+
+    def start(self):
+        """Start this worker's monitor thread if it is not running yet"""
+        pid = os.getpid()
+        with self._lock:
+            if self._thread is not None and self._pid == pid:
+                return
+            # Threads do not survive a fork; each worker runs its own monitor
+            self._pid = pid
+            self._first_round = threading.Event()
+            for dependency in self._dependencies.values():
+                dependency.in_flight = None
+            self._executor = ThreadPoolExecutor(
+                max_workers=max(len(self._dependencies), 1), thread_name_prefix='health-check'
+            )
+            self._thread = threading.Thread(target=self._loop, name='health-monitor', daemon=True)
+            self._thread.start()
+
+    def readiness(self):
+        """(ready, reason, per-dependency summary) from the cached results"""
+        self.start()
+        # Only the first probe after startup waits, for the first round of checks
+        self._first_round.wait(HEALTH_CHECK_TIMEOUT)
+        now = time.monotonic()
+        with self._lock:
+            summary = {name: dep.summary(now) for name, dep in self._dependencies.items()}
+            never_checked = [name for name, dep in self._dependencies.items() if dep.checked_at is None]
+        if never_checked:
+            return False, f"not checked yet: {', '.join(never_checked)}", summary
+        unhealthy = [name for name, result in summary.items() if not result['healthy']]
+        if unhealthy:
+            return False, f"unhealthy: {', '.join(unhealthy)}", summary
+        return True, None, summary
+
+    def details(self):
+        """Per-dependency results with latency history"""
+        self.start()
+        now = time.monotonic()
+        with self._lock:
+            return {name: dep.details(now) for name, dep in self._dependencies.items()}
+
+
+monitor = HealthMonitor()
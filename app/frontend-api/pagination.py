@@ -0,0 +1,150 @@
+"""
+Keyset Pagination
+Cursor-based paging on (created_at, id) and streamed pages through server-side cursors
+"""
+import os
+import json
+import uuid
+import base64
+import binascii
+from datetime import datetime
+from psycopg2.extras import RealDictCursor
+import db
+
+# Configuration from environment variables
+MAX_PAGE_SIZE = int(os.getenv('PAGINATION_MAX_PAGE_SIZE', '1000'))
+MAX_STREAM_PAGE_SIZE = int(os.getenv('PAGINATION_MAX_STREAM_PAGE_SIZE', '100000'))
+STREAM_FETCH_SIZE = int(os.getenv('PAGINATION_STREAM_FETCH_SIZE', '2000'))
+
+STREAM_FORMATS = ('json', 'ndjson')
+STREAM_MIMETYPES = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
+
+# Newest first; (created_at, id) is unique, so every row has a stable position
+KEYSET_CONDITION = "(created_at, id) < (%s, %s)"
+KEYSET_ORDER = "ORDER BY created_at DESC, id DESC"
+
+
+class InvalidPageRequest(ValueError):
+    """A limit, cursor or stream format the client got wrong"""
+
+
+def encode_cursor(created_at, row_id):
+    """Opaque token for the position after the row (created_at, row_id)"""
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """(created_at, id) encoded in a token from encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, row_id = json.loads(raw)
+        if not isinstance(row_id, int):
+            raise ValueError('id must be an integer')
+        return datetime.fromisoformat(created_at), row_id
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise InvalidPageRequest(f"invalid cursor: {e}")
+
+
+def parse_page_args(args, default_limit):
+    """(limit, cursor position or None, stream format or None) from query args
+
+    A limit above the maximum is clamped to it rather than rejected, as
+    large limits were accepted before pages had a maximum; responses
+    report the limit applied. A limit that is not an integer falls back
+    to default_limit.
+    """
+    stream = args.get('stream')
+    if stream is not None:
+        stream = stream.lower() or 'json'
+        if stream not in STREAM_FORMATS:
+            raise InvalidPageRequest(f"stream must be one of {', '.join(STREAM_FORMATS)}")
+
+    maximum = MAX_STREAM_PAGE_SIZE if stream else MAX_PAGE_SIZE
+    try:
+        limit = int(args.get('limit', default_limit))
+    except ValueError:
+        limit = default_limit
+    if limit < 1:
+        raise InvalidPageRequest('limit must be at least 1')
+    limit = min(limit, maximum)
+
+    cursor = args.get('cursor')
+    return limit, decode_cursor(cursor) if cursor else None, stream
+
+
+def keyset_query(select, table, conditions, params, after, limit):
+    """SQL and params for one page, fetching one extra row to detect the next page"""
+    conditions = list(conditions)
+    params = list(params)
+    if after is not None:
+        conditions.append(KEYSET_CONDITION)
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"SELECT {select} FROM {table} {where} {KEYSET_ORDER} LIMIT %s"
+    return sql, (*params, limit + 1)
+
+
+def split_page(rows, limit):
+    """(rows of this page, next cursor or None) from up to limit + 1 rows"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last['created_at'], last['id'])
+
+
+def primed(chunks):
+    """Run a chunk generator to its first chunk so query errors surface before the response starts"""
+    try:
+        first = next(chunks)
+    except StopIteration:
+        # Nothing to send, e.g. an uncompressed export with no matching rows
+        return iter(())
+
+    def run():
+        try:
+            yield first
+            yield from chunks
+        finally:
+            chunks.close()
+    return run()
+
+
+def stream_page(sql, params, limit, fmt, dumps, key, extra=None):
+    """Yield a page as chunked JSON or NDJSON, reading through a named cursor
+
+    Only STREAM_FETCH_SIZE rows are held in memory at a time. The JSON form
+    is the same envelope as a buffered page; NDJSON emits one row per line
+    followed by a final {"next_cursor": ...} line.
+    """
+    extra = extra or {}
+    with db.read_connection() as conn:
+        cur = conn.cursor(name=f"page_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+        cur.itersize = STREAM_FETCH_SIZE
+        cur.execute(sql, params)
+
+        if fmt == 'json':
+            yield '{' + json.dumps(key) + ':['
+        count = 0
+        last = None
+        has_more = False
+        for row in cur:
+            if count == limit:
+                # The extra row only proves there is a next page
+                has_more = True
+                break
+            if fmt == 'json':
+                yield (',' if count else '') + dumps(row)
+            else:
+                yield dumps(row) + '\n'
+            count += 1
+            last = row
+        cur.close()
+
+    next_cursor = encode_cursor(last['created_at'], last['id']) if has_more else None
+    if fmt == 'json':
+        tail = dumps({'count': count, 'next_cursor': next_cursor, **extra})
+        yield '],' + tail[1:]
+    else:
+        yield dumps({'next_cursor': next_cursor}) + '\n'
@@ -0,0 +1,85 @@
+"""
+Streaming Proxy
+Forwards request and response bodies to a backend chunk by chunk without parsing them
+"""
+import os
+from flask import Response, request
+
+# Configuration from environment variables
+PROXY_CHUNK_BYTES = int(os.getenv('PROXY_CHUNK_BYTES', str(64 * 1024)))
+
+# Request headers passed to the backend; everything else (Host, hop-by-hop
+# headers) belongs to the client connection
+FORWARD_REQUEST_HEADERS = (
+    'Content-Type', 'Content-Encoding', 'Accept', 'Accept-Encoding',
+    'X-Request-ID', 'Idempotency-Key', 'traceparent', 'tracestate',
+)
+
+# Response headers passed back to the client
+FORWARD_RESPONSE_HEADERS = (
+    'Content-Type', 'Content-Encoding', 'Content-Length', 'Location',
+    'Retry-After', 'ETag', 'Cache-Control', 'X-Request-ID',
+)
+
+
+class _RequestBody:
+    """File-like view of the request stream with a known length
+
+    requests sends it with a Content-Length header and reads it in blocks,
+    so the body is never held in memory.
+    """
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+
+def _iter_request_body(stream):
+    while True:
+        chunk = stream.read(PROXY_CHUNK_BYTES)
+        if not chunk:
+            return
+        yield chunk
+
+
+def forward(backend, path, timeout=None):
+    """Send the current request body to backend path and stream the reply back
+
+    The upstream response is relayed undecoded, so a compressed response
+    stays compressed and Content-Length stays valid.
+    """
+    headers = {name: request.headers[name] for name in FORWARD_REQUEST_HEADERS if name in request.headers}
+    length = request.content_length
+    if length is not None:
+        body = _RequestBody(request.stream, length)
+    else:
+        # Chunked client upload: relay it chunked
+        body = _iter_request_body(request.stream)
+
+    if request.query_string:
+        path = f"{path}?{request.query_string.decode('latin-1')}"
+
+    # Non-idempotent requests are only retried when the connection was never
+    # established, i.e. before any of the body stream was consumed
+    upstream = backend.request(
+        request.method, path, data=body, headers=headers, stream=True, timeout=timeout
+    )
+
+    response_headers = {
+        name: upstream.headers[name] for name in FORWARD_RESPONSE_HEADERS if name in upstream.headers
+    }
+    response = Response(
+        upstream.raw.stream(PROXY_CHUNK_BYTES, decode_content=False),
+        status=upstream.status_code,
+        headers=response_headers,
+        direct_passthrough=True,
+    )
+    response.call_on_close(upstream.close)
+    return response
+
@@ -0,0 +1,341 @@
+"""
+Response Cache
+TTL cache of GET responses with ETag/If-None-Match support and tag-based invalidation on writes
+"""
+import os
+import json
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+from functools import wraps
+from urllib.parse import urlencode
+from collections import OrderedDict
+from flask import current_app, request
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+# 'off' disables caching; 'local' keeps an LRU per worker; 'shared' stores
+# entries as files in RESPONSE_CACHE_DIR (tmpfs) so every worker on the
+# host serves them. Invalidations reach all workers in both modes.
+RESPONSE_CACHE = os.getenv('RESPONSE_CACHE', 'local').lower()
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '2'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1024'))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRY_BYTES', str(1024 * 1024)))
+RESPONSE_CACHE_DIR = os.getenv(
+    'RESPONSE_CACHE_DIR',
+    os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'response-cache')
+)
+
+CACHE_MODES = ('off', 'local', 'shared')
+
+# Invalidation counters live in a small shared file; tags hash onto slots,
+# so a collision only invalidates a little more than necessary
+GENERATION_SLOTS = 64
+GENERATION_FILE = 'generations'
+
+# Shared-mode stores between sweeps of expired entry files
+SWEEP_EVERY_STORES = 100
+
+ENTRY_SUFFIX = '.entry'
+
+
+def etag_of(body, volatile=()):
+    """Hex digest of a body, leaving out the volatile top-level keys of a JSON object
+
+    Fields like a generation timestamp change on every recompute; hashing
+    them would give each recompute a new ETag and defeat If-None-Match.
+    """
+    if volatile:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            stable = {k: v for k, v in data.items() if k not in volatile}
+            body = json.dumps(stable, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def _slot(tag):
+    return int.from_bytes(hashlib.blake2b(tag.encode('utf-8'), digest_size=2).digest(), 'little') % GENERATION_SLOTS
+
+
+class Generations:
+    """Per-tag invalidation counters shared by every worker on the host"""
+
+    def __init__(self, directory):
+        self._lock = threading.Lock()
+        self._local = [0] * GENERATION_SLOTS
+        self._map = None
+        self._fd = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self._fd = os.open(os.path.join(directory, GENERATION_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+            size = GENERATION_SLOTS * 8
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+        except OSError as e:
+            # Still correct within each worker; other workers rely on the TTL
+            logger.warning(f"Response cache invalidations are per worker, cannot share {directory}: {e}")
+
+    def get(self, tag):
+        if self._map is None:
+            return self._local[_slot(tag)]
+        return struct.unpack_from('<Q', self._map, _slot(tag) * 8)[0]
+
+    def bump(self, tag):
+        offset = _slot(tag) * 8
+        if self._map is None:
+            with self._lock:
+                self._local[_slot(tag)] += 1
+            return
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                value = struct.unpack_from('<Q', self._map, offset)[0]
+                struct.pack_into('<Q', self._map, offset, value + 1)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class LocalStore:
+    """Bounded in-process LRU of (expires, content_type, etag, body)"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < now:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1:]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry[3])
+
+    def put(self, key, content_type, etag, body, ttl):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, content_type, etag, body)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def size(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes}
+
+
+class SharedStore:
+    """Entries as files in a tmpfs directory, readable by every worker on the host"""
+
+    def __init__(self, directory, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._stores = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest() + ENTRY_SUFFIX)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        header, _, body = data.partition(b'\n')
+        meta = json.loads(header)
+        if meta['key'] != key or meta['expires'] < time.time():
+            return None
+        return meta['content_type'], meta['etag'], body
+
+    def put(self, key, content_type, etag, body, ttl):
+        header = json.dumps({'key': key, 'expires': time.time() + ttl, 'content_type': content_type, 'etag': etag})
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header.encode('utf-8') + b'\n' + body)
+            # Readers see either the old file or the new one, never a partial write
+            os.replace(tmp, self._path(key))
+        except Exception:
+            os.unlink(tmp)
+            raise
+        self._stores += 1
+        if self._stores % SWEEP_EVERY_STORES == 0:
+            self.sweep()
+
+    def _entry_files(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(ENTRY_SUFFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    yield path, os.stat(path)
+                except FileNotFoundError:
+                    pass
+
+    def sweep(self):
+        """Delete expired entries, then the oldest ones beyond max_entries"""
+        cutoff = time.time() - RESPONSE_CACHE_TTL
+        kept = []
+        for path, st in self._entry_files():
+            if st.st_mtime < cutoff:
+                self._unlink(path)
+            else:
+                kept.append((st.st_mtime, path))
+        kept.sort()
+        for _, path in kept[:max(len(kept) - self.max_entries, 0)]:
+            self._unlink(path)
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def size(self):
+        files = list(self._entry_files())
+        return {'entries': len(files), 'bytes': sum(st.st_size for _, st in files)}
+
+
+class ResponseCache:
+    """Cached GET bodies keyed on route, query arguments and the route's tag generations"""
+
+    def __init__(self, mode=RESPONSE_CACHE, ttl=RESPONSE_CACHE_TTL, directory=RESPONSE_CACHE_DIR):
+        self.mode = mode
+        self.ttl = ttl
+        self.generations = Generations(directory)
+        self.store = SharedStore(directory) if mode == 'shared' else LocalStore()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'not_modified': 0, 'bypassed': 0,
+                       'invalidations': 0, 'store_errors': 0}
+
+    def count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def key(self, path, query_items, tags):
+        query = urlencode(sorted(query_items))
+        generations = ','.join(str(self.generations.get(tag)) for tag in tags)
+        return f"{path}?{query}#{generations}"
+
+    def get(self, key):
+        entry = self.store.get(key)
+        self.count('hits' if entry is not None else 'misses')
+        return entry
+
+    def put(self, key, content_type, body, volatile=()):
+        """Store a body and return its ETag, which ignores the volatile keys"""
+        etag = etag_of(body, volatile)
+        if len(body) <= RESPONSE_CACHE_MAX_ENTRY_BYTES:
+            try:
+                self.store.put(key, content_type, etag, body, self.ttl)
+                self.count('stores')
+            except OSError as e:
+                logger.warning(f"Response cache store failed: {e}")
+                self.count('store_errors')
+        return etag
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.generations.bump(tag)
+        self.count('invalidations')
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._stats)
+        return {
+            'mode': self.mode,
+            'ttl_seconds': self.ttl,
+            **self.store.size(),
+            **counters,
+        }
+
+
+_cache = None
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """This worker's cache, or None when RESPONSE_CACHE is off"""
+    global _cache, _cache_pid
+    if RESPONSE_CACHE == 'off' or RESPONSE_CACHE not in CACHE_MODES:
+        return None
+    pid = os.getpid()
+    with _cache_lock:
+        if _cache is None or _cache_pid != pid:
+            _cache = ResponseCache()
+            _cache_pid = pid
+        return _cache
+
+
+def cached(*tags, bypass=None, volatile=()):
+    """Cache a GET view's 200 responses and answer If-None-Match with 304
+
+    bypass(args) returning True skips the cache for that request, for
+    parameters that promise fresh or streamed results. volatile names
+    top-level JSON keys, such as timestamps, left out of the ETag.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            if cache is None or request.method != 'GET':
+                return view(*args, **kwargs)
+            if bypass is not None and bypass(request.args):
+                cache.count('bypassed')
+                return view(*args, **kwargs)
+
+            key = cache.key(request.path, request.args.items(multi=True), tags)
+            entry = cache.get(key)
+            if entry is not None:
+                content_type, etag, body = entry
+                response = current_app.response_class(body, 200, content_type=content_type)
+                response.headers['X-Cache'] = 'HIT'
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed or response.direct_passthrough:
+                    return response
+                etag = cache.put(key, response.content_type, response.get_data(), volatile)
+                response.headers['X-Cache'] = 'MISS'
+
+            response.set_etag(etag)
+            # Clients may keep the body but must revalidate; unchanged data costs a 304
+            response.headers['Cache-Control'] = 'no-cache'
+            response.make_conditional(request)
+            if response.status_code == 304:
+                cache.count('not_modified')
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate(*tags):
+    """Drop cached responses of every route cached under any of tags"""
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate(*tags)
+
+
+def cache_stats():
+    cache = get_cache()
+    return cache.stats() if cache is not None else {'mode': 'off'}
@@ -0,0 +1,28 @@
+"""
+Frontend API Launcher
+Starts gunicorn with sync Flask workers or async ASGI workers depending on SERVER_MODE
+"""
+import os
+
+# Configuration from environment variables
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi').lower()
+SERVER_WORKERS = os.getenv('SERVER_WORKERS', '4')
+PORT = os.getenv('PORT', '8080')
+
+SERVER_MODES = ('wsgi', 'asgi')
+
+
+def main():
+    if SERVER_MODE not in SERVER_MODES:
+        raise SystemExit(f"SERVER_MODE must be one of {', '.join(SERVER_MODES)}")
+    argv = ['gunicorn', '--bind', f"0.0.0.0:{PORT}", '--workers', SERVER_WORKERS, '--timeout', '60']
+    if SERVER_MODE == 'asgi':
+        argv += ['--worker-class', 'uvicorn.workers.UvicornWorker', 'asgi:app']
+    else:
+        argv += ['app:app']
+    # GUNICORN_CMD_ARGS still applies on top of these
+    os.execvp(argv[0], argv)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""
+Distributed Tracing
+W3C traceparent propagation between the services and sampled spans exported to a file or a collector
+"""
+import os
+import re
+import json
+import time
+import queue
+import random
+import logging
+import tempfile
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from flask import g, request
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+# Requests without an incoming traceparent start a trace sampled at this
+# rate; requests with one follow the caller's decision
+TRACING_SAMPLE_RATE = float(os.getenv('TRACING_SAMPLE_RATE', '0.01'))
+# 'file' appends JSON lines to TRACING_FILE; 'http' POSTs JSON batches to
+# TRACING_COLLECTOR_URL; 'off' records nothing but still propagates
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'file').lower()
+TRACING_FILE = os.getenv('TRACING_FILE', '')
+TRACING_COLLECTOR_URL = os.getenv('TRACING_COLLECTOR_URL', '')
+TRACING_QUEUE_SIZE = int(os.getenv('TRACING_QUEUE_SIZE', '10000'))
+TRACING_BATCH_SIZE = int(os.getenv('TRACING_BATCH_SIZE', '512'))
+
+EXPORTERS = ('file', 'http', 'off')
+
+TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(?:-.*)?$")
+SAMPLED_FLAG = 0x01
+
+# Statement text kept on query spans
+MAX_STATEMENT_CHARS = 500
+
+SPANS = metrics.Counter('tracing_spans_total', 'Sampled spans, by export outcome', ['outcome'])
+
+
+class TraceContext:
+    """Trace id, current span id and sampling decision of the code running now"""
+    __slots__ = ('trace_id', 'span_id', 'sampled')
+
+    def __init__(self, trace_id, span_id, sampled):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+_current = contextvars.ContextVar('trace_context', default=None)
+_service = 'unknown'
+
+
+def _new_id(bits):
+    return f"{random.getrandbits(bits) or 1:0{bits // 4}x}"
+
+
+def parse_traceparent(header):
+    """TraceContext of the caller's span from a traceparent header, or None if absent or invalid"""
+    match = TRACEPARENT.match(header.strip().lower()) if header else None
+    if match is None:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == 'ff' or trace_id == '0' * 32 or span_id == '0' * 16:
+        return None
+    return TraceContext(trace_id, span_id, bool(int(flags, 16) & SAMPLED_FLAG))
+
+
+class Span:
+    """One timed operation; exported when it ends"""
+    __slots__ = ('name', 'context', 'parent_id', 'start', '_started', 'attributes', 'status')
+
+    def __init__(self, name, context, parent_id, attributes):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.attributes = attributes
+        self.status = 'ok'
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, duration=None):
+        if duration is None:
+            duration = time.perf_counter() - self._started
+        _export({
+            'trace_id': self.context.trace_id,
+            'span_id': self.context.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'service': _service,
+            'start': self.start,
+            'duration_ms': round(duration * 1000, 3),
+            'status': self.status,
+            'attributes': self.attributes,
+        })
+
+
+class _NoopSpan:
+    """Stands in for a span outside sampled traces"""
+    status = 'ok'
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def _child(name, attributes):
+    parent = _current.get()
+    if parent is None or not parent.sampled or TRACING_EXPORTER == 'off':
+        return None
+    return Span(name, TraceContext(parent.trace_id, _new_id(64), True), parent.span_id, attributes)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a block as a child of the current span; a no-op outside sampled traces"""
+    child = _child(name, attributes)
+    if child is None:
+        yield _NOOP
+        return
+    token = _current.set(child.context)
+    try:
+        yield child
+    except BaseException as e:
+        child.status = 'error'
+        child.attributes['error'] = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        child.end()
+
+
+def record(name, seconds, **attributes):
+    """Add a child span for an operation that just finished after taking seconds"""
+    child = _child(name, attributes)
+    if child is not None:
+        child.start -= seconds
+        child.end(seconds)
+
+
+def start_request(traceparent, name, **attributes):
+    """Enter the server span of an incoming request; returns (span, token) for finish_request
+
+    The span continues the caller's trace when traceparent is valid and
+    starts a new one, sampled at TRACING_SAMPLE_RATE, otherwise. Unsampled
+    requests still get a context so the decision reaches the backends.
+    """
+    parent = parse_traceparent(traceparent)
+    if parent is None:
+        trace_id, parent_id = _new_id(128), None
+        sampled = random.random() < TRACING_SAMPLE_RATE
+    else:
+        trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+    context = TraceContext(trace_id, _new_id(64), sampled and TRACING_EXPORTER != 'off')
+    server = Span(name, context, parent_id, attributes) if context.sampled else None
+    return server, _current.set(context)
+
+
+def finish_request(server, token, status_code=None, error=None):
+    _current.reset(token)
+    if server is None:
+        return
+    if status_code is not None:
+        server.attributes['http.status_code'] = status_code
+    if error is not None or (status_code is not None and status_code >= 500):
+        server.status = 'error'
+        if error is not None:
+            server.attributes['error'] = type(error).__name__
+    server.end()
+
+
+def inject(headers=None):
+    """Copy of headers with the traceparent of the current span added"""
+    headers = dict(headers or {})
+    context = _current.get()
+    if context is not None:
+        headers['traceparent'] = context.traceparent()
+    return headers
+
+
+def observe_query(sql, seconds):
+    """Query observer for db.py: statements, commits and connects as spans of the current trace"""
+    context = _current.get()
+    if context is None or not context.sampled:
+        return
+    if sql == 'COMMIT':
+        record('db.commit', seconds)
+    elif sql == 'CONNECT':
+        record('db.connect', seconds)
+    else:
+        if isinstance(sql, bytes):
+            sql = sql[:MAX_STATEMENT_CHARS].decode('utf-8', 'replace')
+        record('db.query', seconds, statement=' '.join(sql[:MAX_STATEMENT_CHARS].split()))
+
+
+class Exporter:
+    """Ships finished spans from a bounded queue on a background thread, so requests never wait on I/O"""
+
+    def __init__(self, kind, path, url):
+        self.kind = kind
+        self.path = path
+        self.url = url
+        self._queue = queue.Queue(TRACING_QUEUE_SIZE)
+        self._exported = SPANS.labels('exported')
+        self._dropped = SPANS.labels('dropped')
+        self._failed = SPANS.labels('failed')
+        threading.Thread(target=self._run, name='trace-exporter', daemon=True).start()
+
+    def submit(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._dropped.inc()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < TRACING_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+                self._exported.inc(len(batch))
+            except Exception as e:
+                logger.warning(f"Exporting {len(batch)} spans failed: {e}")
+                self._failed.inc(len(batch))
+
+    def _write(self, batch):
+        if self.kind == 'http':
+            body = json.dumps(batch, default=str).encode('utf-8')
+            req = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(req, timeout=2) as response:
+                response.read()
+            return
+        # One appending write per batch keeps lines from several workers whole
+        data = ''.join(json.dumps(record, default=str) + '\n' for record in batch).encode('utf-8')
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+_exporter = None
+_exporter_pid = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """This worker's exporter, started on first use"""
+    global _exporter, _exporter_pid
+    pid = os.getpid()
+    if _exporter is not None and _exporter_pid == pid:
+        return _exporter
+    with _exporter_lock:
+        if _exporter is None or _exporter_pid != pid:
+            # The parent's export thread does not survive a fork
+            kind = TRACING_EXPORTER if TRACING_EXPORTER in EXPORTERS else 'file'
+            if kind == 'http' and not TRACING_COLLECTOR_URL:
+                logger.warning("TRACING_EXPORTER is http but TRACING_COLLECTOR_URL is unset; writing to a file")
+                kind = 'file'
+            path = TRACING_FILE or os.path.join(tempfile.gettempdir(), 'traces', f"{_service}.jsonl")
+            _exporter = Exporter(kind, path, TRACING_COLLECTOR_URL)
+            _exporter_pid = pid
+        return _exporter
+
+
+def _export(record):
+    get_exporter().submit(record)
+
+
+def configure(service):
+    """Name the service on exported spans"""
+    global _service
+    _service = service
+
+
+def traced_json_provider(app):
+    """The app's JSON provider with jsonify() timed as a json.encode span"""
+    class TracedJSONProvider(type(app.json)):
+        def response(self, *args, **kwargs):
+            with span('json.encode'):
+                return super().response(*args, **kwargs)
+    return TracedJSONProvider(app)
+
+
+def instrument(app, service):
+    """Continue or start a trace for every request of a Flask app"""
+    configure(service)
+    app.json = traced_json_provider(app)
+
+    @app.before_request
+    def _start_span():
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        g.trace = start_request(
+            request.headers.get('traceparent'), f"{request.method} {route}",
+            **{'http.method': request.method, 'http.route': route}
+        )
+
+    @app.after_request
+    def _trace_header(response):
+        server = g.get('trace', (None, None))[0]
+        if server is not None:
+            response.headers['X-Trace-Id'] = server.context.trace_id
+            server.attributes['http.status_code'] = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_span(exc):
+        trace = g.pop('trace', None)
+        if trace is not None:
+            server, token = trace
+            status_code = server.attributes.get('http.status_code') if server is not None else None
+            finish_request(server, token, status_code, exc)
+
+
+db.add_query_observer(observe_query)
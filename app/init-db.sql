@@ -30,6 +30,86 @@ CREATE TABLE IF NOT EXISTS ingested_data (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Spool flush progress (used by data-ingest write-behind mode)
+-- committed_offset is advanced in the same transaction that inserts the
+-- spooled records, so a restarted flusher never inserts them twice
+CREATE TABLE IF NOT EXISTS ingest_spool_offsets (
+    spool_id VARCHAR(100) PRIMARY KEY,
+    committed_offset BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Idempotency keys of ingested records and requests (used by data-ingest)
+-- Kept apart from ingested_data so uniqueness does not depend on its
+-- partitioning; claimed in the same transaction as the rows they guard
+CREATE TABLE IF NOT EXISTS ingest_idempotency_keys (
+    idempotency_key TEXT PRIMARY KEY,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Ingest statistics rollups (maintained by data-ingest in the same
+-- transaction as each write). Each key is spread over several slots to
+-- reduce row-lock contention between concurrent writers.
+CREATE TABLE IF NOT EXISTS ingest_stats_totals (
+    record_type VARCHAR(50) NOT NULL,
+    source VARCHAR(50) NOT NULL,
+    slot SMALLINT NOT NULL DEFAULT 0,
+    record_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (record_type, source, slot)
+);
+
+CREATE TABLE IF NOT EXISTS ingest_stats_minutely (
+    bucket TIMESTAMP NOT NULL,
+    record_type VARCHAR(50) NOT NULL,
+    source VARCHAR(50) NOT NULL,
+    slot SMALLINT NOT NULL DEFAULT 0,
+    record_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, record_type, source, slot)
+);
+
+-- Seed the rollups from existing rows the first time they are created
+INSERT INTO ingest_stats_totals (record_type, source, slot, record_count)
+SELECT record_type, source, 0, COUNT(*)
+FROM ingested_data
+WHERE NOT EXISTS (SELECT 1 FROM ingest_stats_totals)
+GROUP BY record_type, source;
+
+INSERT INTO ingest_stats_minutely (bucket, record_type, source, slot, record_count)
+SELECT date_trunc('minute', created_at), record_type, source, 0, COUNT(*)
+FROM ingested_data
+WHERE created_at >= LOCALTIMESTAMP - INTERVAL '2 days'
+  AND NOT EXISTS (SELECT 1 FROM ingest_stats_minutely)
+GROUP BY date_trunc('minute', created_at), record_type, source;
+
+-- Analytics rollups: order totals per day and status, maintained with each
+-- insert; user counts per day, rolled up from users.created_at up to the
+-- watermark in analytics_watermarks
+CREATE TABLE IF NOT EXISTS order_stats_daily (
+    day DATE NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    slot SMALLINT NOT NULL DEFAULT 0,
+    order_count BIGINT NOT NULL DEFAULT 0,
+    total_amount NUMERIC NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, status, slot)
+);
+
+CREATE TABLE IF NOT EXISTS user_stats_daily (
+    day DATE PRIMARY KEY,
+    user_count BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS analytics_watermarks (
+    name VARCHAR(50) PRIMARY KEY,
+    rolled_up_until DATE NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO order_stats_daily (day, status, slot, order_count, total_amount)
+SELECT created_at::date, status, 0, COUNT(*), SUM(amount)
+FROM orders
+WHERE NOT EXISTS (SELECT 1 FROM order_stats_daily)
+GROUP BY created_at::date, status;
+
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
@@ -39,6 +119,15 @@ CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at);
 CREATE INDEX IF NOT EXISTS idx_ingested_data_type ON ingested_data(record_type);
 CREATE INDEX IF NOT EXISTS idx_ingested_data_region ON ingested_data(region);
 CREATE INDEX IF NOT EXISTS idx_ingested_data_created_at ON ingested_data(created_at);
+CREATE INDEX IF NOT EXISTS idx_ingest_idempotency_keys_created_at ON ingest_idempotency_keys(created_at);
+
+-- Keyset pagination indexes: (created_at, id) order with the listed columns
+-- included so pages are served by index-only scans
+CREATE INDEX IF NOT EXISTS idx_users_created_at_id ON users(created_at, id) INCLUDE (username, email);
+CREATE INDEX IF NOT EXISTS idx_ingested_data_created_at_id
+    ON ingested_data(created_at, id) INCLUDE (record_type, source, region);
+CREATE INDEX IF NOT EXISTS idx_ingested_data_type_created_at_id
+    ON ingested_data(record_type, created_at, id) INCLUDE (source, region);
 
 -- Insert sample data for testing
 INSERT INTO users (username, email) VALUES
@@ -0,0 +1,58 @@
+-- Convert ingested_data to a range-partitioned table on created_at
+-- Run once before enabling INGEST_PARTITIONING=on in data-ingest.
+--
+-- Existing rows stay where they are: the old table is attached as the first
+-- partition, covering everything up to the start of tomorrow. data-ingest
+-- then creates the following partitions ahead of time and drops expired
+-- ones according to INGEST_RETENTION_DAYS.
+
+BEGIN;
+
+LOCK TABLE ingested_data IN ACCESS EXCLUSIVE MODE;
+
+-- The partition key must not be NULL
+UPDATE ingested_data SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+
+ALTER TABLE ingested_data RENAME TO ingested_data_legacy;
+ALTER TABLE ingested_data_legacy ALTER COLUMN created_at SET NOT NULL;
+-- Unique constraints on a partitioned table must include the partition key
+ALTER TABLE ingested_data_legacy DROP CONSTRAINT ingested_data_pkey;
+ALTER TABLE ingested_data_legacy ADD CONSTRAINT ingested_data_legacy_pkey PRIMARY KEY (id, created_at);
+ALTER INDEX IF EXISTS idx_ingested_data_type RENAME TO idx_ingested_data_legacy_type;
+ALTER INDEX IF EXISTS idx_ingested_data_region RENAME TO idx_ingested_data_legacy_region;
+ALTER INDEX IF EXISTS idx_ingested_data_created_at RENAME TO idx_ingested_data_legacy_created_at;
+ALTER INDEX IF EXISTS idx_ingested_data_created_at_id RENAME TO idx_ingested_data_legacy_created_at_id;
+ALTER INDEX IF EXISTS idx_ingested_data_type_created_at_id RENAME TO idx_ingested_data_legacy_type_created_at_id;
+
+CREATE TABLE ingested_data (
+    id INTEGER NOT NULL DEFAULT nextval('ingested_data_id_seq'),
+    record_type VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL,
+    source VARCHAR(50) NOT NULL,
+    region VARCHAR(20) NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE ingested_data_id_seq OWNED BY ingested_data.id;
+
+DO $$
+BEGIN
+    EXECUTE format(
+        'ALTER TABLE ingested_data ATTACH PARTITION ingested_data_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+        date_trunc('day', LOCALTIMESTAMP) + INTERVAL '1 day'
+    );
+END
+$$;
+
+-- Indexes on the parent are created on every partition, existing and future
+CREATE INDEX IF NOT EXISTS idx_ingested_data_type ON ingested_data(record_type);
+CREATE INDEX IF NOT EXISTS idx_ingested_data_region ON ingested_data(region);
+CREATE INDEX IF NOT EXISTS idx_ingested_data_created_at ON ingested_data(created_at);
+-- Keyset pagination indexes, as in init-db.sql
+CREATE INDEX IF NOT EXISTS idx_ingested_data_created_at_id
+    ON ingested_data(created_at, id) INCLUDE (record_type, source, region);
+CREATE INDEX IF NOT EXISTS idx_ingested_data_type_created_at_id
+    ON ingested_data(record_type, created_at, id) INCLUDE (source, region);
+
+COMMIT;
@@ -140,6 +140,8 @@ if [[ $REPLY =~ ^[Yy][Ee][Ss]$ ]]; then
     kubectl exec -n database postgresql-primary-0 -- psql -U postgres -d appdb -c "GRANT USAGE, SELECT ON ALL SEQUENCES IN SCHEMA public TO appuser;"
     kubectl exec -n database postgresql-primary-0 -- psql -U postgres -d appdb -c "ALTER DEFAULT PRIVILEGES IN SCHEMA public GRANT ALL ON TABLES TO appuser;"
     kubectl exec -n database postgresql-primary-0 -- psql -U postgres -d appdb -c "ALTER DEFAULT PRIVILEGES IN SCHEMA public GRANT USAGE, SELECT ON SEQUENCES TO appuser;"
+    # Replica lag checks read pg_stat_wal_receiver.status
+    kubectl exec -n database postgresql-primary-0 -- psql -U postgres -d appdb -c "GRANT pg_read_all_stats TO appuser;"
     
     echo "✓ Database initialized in Primary cluster"
     echo ""
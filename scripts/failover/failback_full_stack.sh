@@ -34,7 +34,7 @@ echo "JupyterHub hub scaled to 0"
 
 # Scale down Microservices
 kubectl scale deployment business-logic -n app --replicas=0
-kubectl scale deployment data-ingest -n app --replicas=0
+kubectl scale statefulset data-ingest -n app --replicas=0
 kubectl scale deployment frontend-api -n app --replicas=0
 echo "Microservices scaled to 0"
 
@@ -152,7 +152,7 @@ echo "JupyterHub hub scaled to 1"
 
 # Scale up Microservices
 kubectl scale deployment frontend-api -n app --replicas=1
-kubectl scale deployment data-ingest -n app --replicas=1
+kubectl scale statefulset data-ingest -n app --replicas=1
 kubectl scale deployment business-logic -n app --replicas=1
 echo "Microservices scaled to 1"
 